@@ -0,0 +1,136 @@
+"""
+Apply several cart line changes at once.
+
+Operations are dicts, applied in order within one transaction:
+
+* ``{"op": "set", "item_id": 3, "quantity": 2}`` (0 removes the line)
+* ``{"op": "add", "product_id": 1, "variant_id": 5, "quantity": 1}``
+* ``{"op": "remove", "item_id": 3}``
+
+Stock is checked for the final quantity of every line against one query
+over the variants involved, and the cart's stored totals are recomputed
+with a single UPDATE at the end.
+"""
+from django.db import transaction
+
+from products.models import Product, ProductVariant
+
+from .models import Cart, CartItem, recalculate_totals
+
+
+MAX_OPERATIONS = 100
+
+
+class CartBatchError(ValueError):
+    """An operation was malformed or can't be satisfied; nothing was applied"""
+
+    def __init__(self, message, index=None, status=400):
+        super().__init__(message)
+        self.index = index
+        self.status = status
+
+
+def _positive_int(value, name, index, allow_zero=False):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise CartBatchError(f'{name} must be an integer', index)
+    if number < 0 or (number == 0 and not allow_zero):
+        raise CartBatchError(f'{name} must be {"zero or more" if allow_zero else "positive"}', index)
+    return number
+
+
+def parse_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError('operations must be a non-empty list')
+    if len(operations) > MAX_OPERATIONS:
+        raise CartBatchError(f'at most {MAX_OPERATIONS} operations per request')
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise CartBatchError('operation must be an object', index)
+        op = operation.get('op')
+        if op == 'set':
+            parsed.append((op, _positive_int(operation.get('item_id'), 'item_id', index),
+                           _positive_int(operation.get('quantity'), 'quantity', index, allow_zero=True)))
+        elif op == 'remove':
+            parsed.append((op, _positive_int(operation.get('item_id'), 'item_id', index), 0))
+        elif op == 'add':
+            variant_id = operation.get('variant_id')
+            parsed.append((op, (
+                _positive_int(operation.get('product_id'), 'product_id', index),
+                _positive_int(variant_id, 'variant_id', index) if variant_id not in (None, '') else None,
+            ), _positive_int(operation.get('quantity', 1), 'quantity', index)))
+        else:
+            raise CartBatchError('op must be one of set, add, remove', index)
+    return parsed
+
+
+def apply_operations(request_cart, operations):
+    """Apply ``operations`` to the requester's cart and return the updated ``Cart``"""
+    parsed = parse_operations(operations)
+    needs_cart = any(op == 'add' for op, target, quantity in parsed)
+    cart = request_cart.get_or_create() if needs_cart else request_cart.cart
+    if cart is None:
+        raise CartBatchError('Your cart is empty', status=404)
+
+    with transaction.atomic():
+        lines = {
+            (item.product_id, item.variant_id): item
+            for item in CartItem.objects.select_for_update().filter(cart=cart)
+        }
+        by_id = {item.pk: key for key, item in lines.items()}
+        quantities = {key: item.quantity for key, item in lines.items()}
+
+        for index, (op, target, quantity) in enumerate(parsed):
+            if op == 'add':
+                quantities[target] = quantities.get(target, 0) + quantity
+                continue
+            if target not in by_id:
+                raise CartBatchError('No such item in your cart', index, status=404)
+            quantities[by_id[target]] = quantity
+
+        keys = [key for key, quantity in quantities.items() if quantity]
+        variants = ProductVariant.objects.in_bulk(
+            [variant_id for product_id, variant_id in keys if variant_id]
+        )
+        # Lines without a variant are rare; their products need checking separately
+        new_plain_products = {product_id for product_id, variant_id in keys if not variant_id and (product_id, None) not in lines}
+        known_products = set()
+        if new_plain_products:
+            known_products = set(Product.objects.filter(pk__in=new_plain_products).values_list('pk', flat=True))
+
+        to_create, to_update, to_delete = [], [], []
+        for key, quantity in quantities.items():
+            product_id, variant_id = key
+            line = lines.get(key)
+            if quantity:
+                if line is None and not variant_id and product_id not in known_products:
+                    raise CartBatchError(f'Product {product_id} does not exist', status=404)
+                if variant_id:
+                    variant = variants.get(variant_id)
+                    if variant is None or variant.product_id != product_id:
+                        raise CartBatchError(f'Variant {variant_id} does not exist', status=404)
+                    # Only what this batch adds is checked: a line that stock has
+                    # since fallen under can still be lowered or left alone
+                    grew = line is None or quantity > line.quantity
+                    if grew and quantity > variant.available:
+                        raise CartBatchError(
+                            f'Only {variant.available} of {variant.size} / {variant.color} available', status=409,
+                        )
+            if line is None:
+                to_create.append(CartItem(cart=cart, product_id=product_id, variant_id=variant_id, quantity=quantity))
+            elif not quantity:
+                to_delete.append(line.pk)
+            elif quantity != line.quantity:
+                line.quantity = quantity
+                to_update.append(line)
+
+        CartItem.objects.filter(pk__in=to_delete).delete()
+        CartItem.objects.bulk_update(to_update, ['quantity'])
+        CartItem.objects.bulk_create(to_create)
+        recalculate_totals(Cart.objects.filter(pk=cart.pk))
+
+    request_cart.invalidate()
+    return cart
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+from django.utils.module_loading import import_string
+
+from ecommerce.caches import is_process_local
+
+from .stores import CacheCartStore
+
+
+@register(Tags.caches, deploy=True)
+def check_cart_cache(app_configs, **kwargs):
+    store = import_string(getattr(settings, 'CART_STORE', 'cart.stores.SignedCookieCartStore'))
+    alias = getattr(settings, 'CART_CACHE_ALIAS', 'default')
+    if settings.DEBUG or not issubclass(store, CacheCartStore) or not is_process_local(alias):
+        return []
+    return [Warning(
+        f'CacheCartStore keeps anonymous carts in a cache ({alias!r}) local to each process.',
+        hint='Visitors lose their cart whenever another worker answers. Set CART_CACHE_BACKEND to a shared cache.',
+        id='cart.W001',
+    )]
@@ -1,18 +1,21 @@
-from .models import Cart
+from .loader import get_request_cart
+from .wishlist import get_wishlist_ids
 
 
 def cart_count(request):
     """Add cart count to all templates"""
-    try:
-        if request.user.is_authenticated:
-            cart = Cart.objects.filter(user=request.user).first()
-        else:
-            session_key = request.session.session_key
-            cart = Cart.objects.filter(session_key=session_key).first()
-        
-        if cart:
-            return {'cart_count': cart.get_item_count()}
-    except:
-        pass
-    
-    return {'cart_count': 0}
+    # Shared (cached) pages load the badge from cart_status instead
+    if getattr(request, 'shared_page', False):
+        return {'cart_count': 0}
+
+    # Same memoized query the view used, if it looked at the cart
+    return {'cart_count': get_request_cart(request).item_count}
+
+
+def wishlist_ids(request):
+    """Product ids in the user's wishlist, for marking hearts without a query per product"""
+    if getattr(request, 'shared_page', False):
+        return {'wishlist_ids': []}
+
+    # Called by the template only if a page asks for it
+    return {'wishlist_ids': lambda: sorted(get_wishlist_ids(request))}
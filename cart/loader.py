@@ -0,0 +1,110 @@
+"""
+Request-scoped cart.
+
+``CartMiddleware`` attaches a ``RequestCart`` as ``request.cart``. Nothing
+is queried until something asks for it; then the cart row, which carries
+its own item count and subtotal, is fetched once and reused by the view,
+the templates and the ``cart_count`` context processor for the rest of
+the request.
+
+Anonymous carts are found through the configured cart store
+(``cart.stores``); reading one never writes to the database.
+"""
+from decimal import Decimal
+
+from .models import Cart, CartItem
+from .stores import get_store
+
+
+def _cart_queryset(request, store, session_key):
+    """Carts owned by the requester (none for a visitor who never added anything)"""
+    if request.user.is_authenticated:
+        return Cart.objects.filter(user=request.user)
+    cart_id = store.get_cart_id()
+    if cart_id is not None:
+        return Cart.objects.filter(pk=cart_id, user__isnull=True)
+    # Carts created before cart stores were keyed by session
+    if session_key:
+        return Cart.objects.filter(session_key=session_key, user__isnull=True)
+    return Cart.objects.none()
+
+
+class RequestCart:
+    """Lazy, memoized view of the requester's cart"""
+
+    def __init__(self, request):
+        self.request = request
+        self.store = get_store(request)
+        # Logging in cycles the session key; carts from before cart stores
+        # are keyed by the one the request arrived with
+        self.session_key = request.session.session_key
+        self._loaded = False
+        self._cart = None
+        self._items = None
+
+    def _load(self):
+        if not self._loaded:
+            self._cart = _cart_queryset(self.request, self.store, self.session_key).order_by('pk').first()
+            self._loaded = True
+        return self._cart
+
+    @property
+    def cart(self):
+        """The ``Cart`` row, or None if the requester has none yet"""
+        return self._load()
+
+    @property
+    def item_count(self):
+        cart = self._load()
+        return cart.item_count if cart else 0
+
+    @property
+    def total(self):
+        cart = self._load()
+        return cart.subtotal if cart else Decimal('0.00')
+
+    def __bool__(self):
+        return self.item_count > 0
+
+    def items(self):
+        """Cart lines with product and variant joined in (one query, memoized)"""
+        if self._items is None:
+            cart = self._load()
+            if cart is None or not cart.item_count:
+                self._items = []
+            else:
+                self._items = list(
+                    CartItem.objects.filter(cart=cart)
+                    .select_related('product', 'variant', 'variant__product')
+                    .order_by('pk')
+                )
+        return self._items
+
+    def get_or_create(self):
+        """The cart row, creating it when missing"""
+        cart = self._load()
+        if cart is not None:
+            return cart
+        if self.request.user.is_authenticated:
+            cart, created = Cart.objects.get_or_create(user=self.request.user)
+        else:
+            # First item for an anonymous visitor: the only point we write
+            cart = Cart.objects.create()
+            self.store.set_cart_id(cart.pk)
+        self.invalidate()
+        return cart
+
+    def invalidate(self):
+        """Forget memoized state after the cart was changed"""
+        self.store.touch()
+        self._loaded = False
+        self._cart = None
+        self._items = None
+
+
+def get_request_cart(request):
+    """``request.cart``, also for requests that bypassed ``CartMiddleware``"""
+    cart = getattr(request, 'cart', None)
+    if cart is None:
+        cart = request.cart = RequestCart(request)
+    return cart
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart import reaper
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned anonymous carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=reaper.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f'{reaper.abandoned_carts().count()} abandoned carts would be deleted')
+            return
+
+        started = time.monotonic()
+
+        def on_batch(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{stats.carts} carts, {stats.items} items, {stats.sessions} sessions so far')
+
+        stats = reaper.reap(options['batch_size'], options['sleep'], on_batch=on_batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Reclaimed {stats.carts} carts, {stats.items} cart items and {stats.sessions} sessions '
+            f'in {stats.batches} batches ({time.monotonic() - started:.1f}s)'
+        ))
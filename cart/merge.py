@@ -0,0 +1,61 @@
+"""
+Folding an anonymous cart into the user's cart when they log in.
+
+Everything is done with a fixed handful of set-based statements, whatever
+the size of either cart: lines both carts share get their quantities
+summed, the rest move across, and every quantity is clamped to the
+variant's stock.
+"""
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Least
+
+from products.models import AVAILABLE, ProductVariant
+
+from .models import Cart, CartItem, recalculate_totals
+
+
+def _same_line(cart):
+    """Lines of ``cart`` for the outer line's product and variant (variant may be NULL)"""
+    return CartItem.objects.filter(cart=cart, product=OuterRef('product')).annotate(
+        variant_key=Coalesce('variant', Value(0)),
+    ).filter(variant_key=Coalesce(OuterRef('variant'), Value(0)))
+
+
+def _variant_stock():
+    return Subquery(ProductVariant.objects.filter(pk=OuterRef('variant')).annotate(available=AVAILABLE).values('available')[:1])
+
+
+def merge_carts(anonymous_cart_id, user):
+    """Merge the anonymous cart into ``user``'s; returns the user's cart (or None)"""
+    with transaction.atomic():
+        anonymous = Cart.objects.select_for_update().filter(pk=anonymous_cart_id, user__isnull=True).first()
+        if anonymous is None:
+            return None
+
+        user_cart = Cart.objects.select_for_update().filter(user=user).order_by('pk').first()
+        if user_cart is None:
+            # Nothing to merge with: the anonymous cart simply becomes theirs
+            Cart.objects.filter(pk=anonymous.pk).update(user=user, session_key=None)
+            return anonymous
+
+        # Lines in both carts: add the anonymous quantity, capped at stock
+        user_lines = CartItem.objects.filter(cart=user_cart)
+        shared = user_lines.filter(Exists(_same_line(anonymous)))
+        shared.filter(variant__isnull=True).update(
+            quantity=F('quantity') + Subquery(_same_line(anonymous).values('quantity')[:1]),
+        )
+        shared.filter(variant__isnull=False).update(
+            quantity=Least(F('quantity') + Subquery(_same_line(anonymous).values('quantity')[:1]), _variant_stock()),
+        )
+
+        # Lines only the anonymous cart has move across, capped at stock
+        moved = CartItem.objects.filter(cart=anonymous).exclude(Exists(_same_line(user_cart)))
+        moved.update(cart=user_cart)
+        user_lines.filter(variant__isnull=False).update(quantity=Least(F('quantity'), _variant_stock()))
+        user_lines.filter(quantity__lte=0).delete()
+
+        # The shared lines left behind go with the anonymous cart
+        anonymous.delete()
+        recalculate_totals(Cart.objects.filter(pk=user_cart.pk))
+    return user_cart
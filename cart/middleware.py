@@ -0,0 +1,14 @@
+from .loader import RequestCart
+
+
+class CartMiddleware:
+    """Attach a lazily loaded ``request.cart`` (needs session and auth middleware)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart = RequestCart(request)
+        response = self.get_response(request)
+        # Remember a newly created anonymous cart (or forget a merged one)
+        return request.cart.store.process_response(response)
@@ -1,28 +1,72 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 from products.models import Product, ProductVariant
 
 
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+# Price of a cart line, for aggregates over CartItem
+LINE_TOTAL = models.ExpressionWrapper(F('quantity') * F('product__price'), output_field=MONEY)
+
+
 class Cart(models.Model):
     """Shopping cart - user-based or session-based"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='carts')
     session_key = models.CharField(max_length=40, null=True, blank=True)
+    # Denormalised from the items; kept in step with F() updates (see adjust)
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # reap_carts scans anonymous carts by age
+            models.Index(fields=['updated_at'], name='cart_anonymous_updated_idx', condition=Q(user__isnull=True)),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Cart ({self.user.username})"
         return f"Cart ({self.session_key})"
 
     def get_total(self):
-        total = 0
-        for item in self.items.all():
-            total += item.get_total()
-        return total
+        """Total recomputed from the items in one aggregate query"""
+        return self.items.aggregate(total=Coalesce(Sum(LINE_TOTAL), Value(Decimal('0.00')), output_field=MONEY))['total']
 
     def get_item_count(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.items.aggregate(count=Coalesce(Sum('quantity'), 0))['count']
+
+    def adjust(self, quantity, amount):
+        """Atomically add ``quantity`` items worth ``amount`` to the stored totals"""
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=F('item_count') + quantity,
+            subtotal=F('subtotal') + amount,
+            updated_at=timezone.now(),
+        )
+
+    def clear(self):
+        """Remove every item and zero the totals"""
+        self.items.all().delete()
+        Cart.objects.filter(pk=self.pk).update(item_count=0, subtotal=0, updated_at=timezone.now())
+
+
+def recalculate_totals(carts):
+    """Recompute stored totals for a queryset of carts in one UPDATE"""
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    carts.update(
+        item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), 0),
+        subtotal=Coalesce(
+            Subquery(items.annotate(total=Sum(LINE_TOTAL)).values('total'), output_field=MONEY),
+            Value(Decimal('0.00')),
+            output_field=MONEY,
+        ),
+    )
 
 
 class CartItem(models.Model):
@@ -0,0 +1,85 @@
+"""
+Removal of abandoned anonymous carts and expired sessions.
+
+Nothing else ever deletes an anonymous cart: once its cookie or session is
+gone nobody can reach it again. Work is done in small batches, each in its
+own short transaction, with an optional pause in between so the reaper can
+run against the live database without holding long locks.
+"""
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclass
+class ReapStats:
+    carts: int = 0
+    items: int = 0
+    sessions: int = 0
+    batches: int = 0
+
+
+def abandoned_carts(now=None):
+    """
+    Anonymous carts nobody can reach any more: session-keyed carts whose
+    session expired or is gone, and cookie-store carts untouched for longer
+    than the cookie lives.
+    """
+    now = now or timezone.now()
+    cookie_cutoff = now - timedelta(seconds=getattr(settings, 'CART_COOKIE_AGE', 60 * 60 * 24 * 30))
+    live_session = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gte=now)
+    return Cart.objects.filter(user__isnull=True).filter(
+        Q(session_key__isnull=False) & ~Exists(live_session)
+        | Q(session_key__isnull=True, updated_at__lt=cookie_cutoff)
+    )
+
+
+def _batches(queryset, batch_size, sleep, stats, skipped=()):
+    """Primary keys of ``queryset`` a batch at a time until none are left"""
+    while True:
+        pending = queryset.exclude(pk__in=skipped) if skipped else queryset
+        pks = list(pending.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks
+        stats.batches += 1
+        if sleep:
+            time.sleep(sleep)
+
+
+def reap(batch_size=DEFAULT_BATCH_SIZE, sleep=0, now=None, on_batch=None):
+    """Delete abandoned carts (with their items), then expired sessions"""
+    now = now or timezone.now()
+    stats = ReapStats()
+
+    carts = abandoned_carts(now)
+    # Carts locked by a live request are left for the next run
+    skipped = set()
+    for pks in _batches(carts, batch_size, sleep, stats, skipped):
+        with transaction.atomic():
+            # Re-check inside the transaction: a visitor may have come back
+            doomed = list(carts.filter(pk__in=pks).select_for_update(skip_locked=True).values_list('pk', flat=True))
+            stats.items += CartItem.objects.filter(cart_id__in=doomed).delete()[0]
+            stats.carts += Cart.objects.filter(pk__in=doomed).delete()[0]
+        skipped.update(set(pks) - set(doomed))
+        if on_batch:
+            on_batch(stats)
+
+    sessions = Session.objects.filter(expire_date__lt=now)
+    for pks in _batches(sessions, batch_size, sleep, stats):
+        stats.sessions += Session.objects.filter(pk__in=pks, expire_date__lt=now).delete()[0]
+        if on_batch:
+            on_batch(stats)
+
+    return stats
@@ -0,0 +1,63 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from products.models import Product, ProductVariant
+from products.signals import catalog_bulk_updated
+
+from .loader import get_request_cart
+from .merge import merge_carts
+from .models import Cart, recalculate_totals
+
+
+def _carts_with(**item_filter):
+    return Cart.objects.filter(pk__in=Cart.objects.filter(**{f'items__{key}': value for key, value in item_filter.items()}).values('pk'))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    """Stored cart subtotals follow product price changes"""
+    if raw:
+        return
+    recalculate_totals(_carts_with(product=instance))
+
+
+@receiver(catalog_bulk_updated)
+def products_bulk_updated(sender, product_ids, **kwargs):
+    recalculate_totals(_carts_with(product__in=product_ids))
+
+
+@receiver(pre_delete, sender=Product)
+@receiver(pre_delete, sender=ProductVariant)
+def remember_carts(sender, instance, **kwargs):
+    """Cascade deletes remove cart lines without going through the cart views"""
+    field = 'product' if sender is Product else 'variant'
+    instance._cart_ids = list(_carts_with(**{field: instance}).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductVariant)
+def recalculate_carts(sender, instance, **kwargs):
+    cart_ids = getattr(instance, '_cart_ids', None)
+    if cart_ids:
+        recalculate_totals(Cart.objects.filter(pk__in=cart_ids))
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Keep what the visitor put in their cart before logging in"""
+    if request is None:
+        return
+    request_cart = get_request_cart(request)
+    cart_id = request_cart.store.get_cart_id()
+    if cart_id is None and request_cart.session_key:
+        # Carts created before cart stores were keyed by session
+        cart_id = (
+            Cart.objects.filter(session_key=request_cart.session_key, user=None)
+            .order_by('pk').values_list('pk', flat=True).first()
+        )
+    if cart_id is None:
+        return
+    merge_carts(cart_id, user)
+    request_cart.store.clear()
+    request_cart.invalidate()
@@ -0,0 +1,145 @@
+"""
+Where an anonymous visitor's cart is remembered.
+
+Logged-in users find their cart by ``Cart.user``. Anonymous visitors used
+to need a session row plus a ``Cart`` row keyed by its session key before
+they had put anything in it. Now a cart store remembers which cart belongs
+to the visitor, and a ``Cart`` row only exists once they add an item.
+
+``CART_STORE`` picks the backend:
+
+* ``cart.stores.SignedCookieCartStore`` (default): the cart id in a signed
+  cookie. No server-side state at all.
+* ``cart.stores.CacheCartStore``: a random token in the cookie, mapped to
+  the cart id in the ``CART_CACHE_ALIAS`` cache. Tokens can be revoked
+  server-side. The cache must be shared by every web worker (Redis,
+  Memcached); on local memory a visitor's cart vanishes whenever another
+  worker answers, which ``check --deploy`` warns about.
+
+Either way the cart is remembered for ``CART_COOKIE_AGE`` seconds after it
+was last changed, not after it was created.
+"""
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'cart.stores'
+
+
+def _cookie_age():
+    return getattr(settings, 'CART_COOKIE_AGE', 60 * 60 * 24 * 30)
+
+
+class BaseCartStore:
+    def __init__(self, request):
+        self.request = request
+        self._pending = None
+
+    def get_cart_id(self):
+        raise NotImplementedError
+
+    def set_cart_id(self, cart_id):
+        """Remember ``cart_id`` for this visitor from the response onwards"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Forget the visitor's cart (after it was merged or reaped)"""
+        raise NotImplementedError
+
+    def touch(self):
+        """The cart just changed: remember it for another ``CART_COOKIE_AGE``"""
+        raise NotImplementedError
+
+    def process_response(self, response):
+        if self._pending is None:
+            return response
+        value = self._pending
+        if value == '':
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        else:
+            self._set_cookie(response, value)
+        return response
+
+    def _set_cookie(self, response, value):
+        response.set_cookie(
+            COOKIE_NAME, value, max_age=_cookie_age(), httponly=True, samesite='Lax',
+            secure=settings.SESSION_COOKIE_SECURE,
+        )
+
+
+class SignedCookieCartStore(BaseCartStore):
+    def get_cart_id(self):
+        if self._pending is not None:
+            return self._pending or None
+        try:
+            return int(self.request.get_signed_cookie(COOKIE_NAME, salt=COOKIE_SALT, max_age=_cookie_age()))
+        except (KeyError, ValueError, signing.BadSignature):
+            return None
+
+    def set_cart_id(self, cart_id):
+        self._pending = cart_id
+
+    def clear(self):
+        self._pending = ''
+
+    def touch(self):
+        if self._pending is None:
+            cart_id = self.get_cart_id()
+            if cart_id is not None:
+                # Re-signing restarts the max_age clock
+                self._pending = cart_id
+
+    def _set_cookie(self, response, value):
+        response.set_signed_cookie(
+            COOKIE_NAME, str(value), salt=COOKIE_SALT, max_age=_cookie_age(), httponly=True,
+            samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+        )
+
+
+class CacheCartStore(BaseCartStore):
+    def __init__(self, request):
+        super().__init__(request)
+        self.cache = caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+        self._cart_id = None
+
+    def _key(self, token):
+        return f'cart:token:{token}'
+
+    def get_cart_id(self):
+        if self._pending is not None:
+            return self._cart_id
+        token = self.request.COOKIES.get(COOKIE_NAME)
+        return self.cache.get(self._key(token)) if token else None
+
+    def set_cart_id(self, cart_id):
+        token = secrets.token_urlsafe(24)
+        self.cache.set(self._key(token), cart_id, _cookie_age())
+        self._pending = token
+        self._cart_id = cart_id
+
+    def clear(self):
+        token = self.request.COOKIES.get(COOKIE_NAME)
+        if token:
+            self.cache.delete(self._key(token))
+        self._pending = ''
+        self._cart_id = None
+
+    def touch(self):
+        if self._pending is not None:
+            return
+        token = self.request.COOKIES.get(COOKIE_NAME)
+        cart_id = self.cache.get(self._key(token)) if token else None
+        if cart_id is not None:
+            self.cache.touch(self._key(token), _cookie_age())
+            self._pending = token
+            self._cart_id = cart_id
+
+
+def get_store(request):
+    store_class = import_string(getattr(settings, 'CART_STORE', 'cart.stores.SignedCookieCartStore'))
+    return store_class(request)
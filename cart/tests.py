@@ -1,7 +1,21 @@
-from django.test import TestCase, Client
+import io
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from products.models import Product, ProductVariant
-from cart.models import Cart, CartItem
+from cart import checks
+from cart.models import Cart, CartItem, Wishlist, recalculate_totals
 from orders.models import Order
 
 
@@ -45,3 +59,361 @@ class CartCheckoutTests(TestCase):
 		if cart:
 			self.assertNotEqual(cart.get_item_count(), 10)
 
+
+
+class RequestCartTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='shopper', password='testpass', email='s@example.com')
+		self.product = Product.objects.create(name='Tee', description='desc', price='250.00', category='test')
+		self.variant = ProductVariant.objects.create(product=self.product, size='M', color='Red', stock=10)
+		other = ProductVariant.objects.create(product=self.product, size='L', color='Red', stock=10)
+		cart = Cart.objects.create(user=self.user)
+		CartItem.objects.create(cart=cart, product=self.product, variant=self.variant, quantity=2)
+		CartItem.objects.create(cart=cart, product=self.product, variant=other, quantity=1)
+		# Lines written directly; bring the stored totals in step
+		recalculate_totals(Cart.objects.filter(pk=cart.pk))
+		self.client.login(username='shopper', password='testpass')
+
+	def cart_queries(self, url):
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.client.get(url)
+		self.assertEqual(resp.status_code, 200)
+		return resp, [q['sql'] for q in queries if 'FROM "cart_cart"' in q['sql']]
+
+	def test_cart_page_loads_cart_once(self):
+		resp, queries = self.cart_queries('/cart/')
+		# One aggregate for view, badge and summary alike
+		self.assertEqual(len(queries), 1)
+		self.assertEqual(resp.context['total'], Decimal('750.00'))
+		self.assertEqual(resp.context['total_items'], 3)
+		self.assertEqual(resp.context['cart_count'], 3)
+
+	def test_checkout_uses_stored_totals(self):
+		resp, queries = self.cart_queries('/payments/checkout/')
+		self.assertEqual(len(queries), 1)
+		self.assertEqual(resp.context['total'], Decimal('750.00'))
+		self.assertEqual(len(resp.context['cart_items']), 2)
+
+	def test_anonymous_browsing_creates_no_cart(self):
+		self.client.logout()
+		self.client.get('/cart/')
+		self.assertEqual(Cart.objects.filter(user__isnull=True).count(), 0)
+
+
+class AnonymousCartStoreTests(TestCase):
+	def setUp(self):
+		self.product = Product.objects.create(name='Mug', description='desc', price='120.00', category='test')
+		self.variant = ProductVariant.objects.create(product=self.product, size='One', color='White', stock=10)
+
+	def add(self, quantity=1):
+		return self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': quantity})
+
+	def test_browsing_writes_nothing(self):
+		with CaptureQueriesContext(connection) as queries:
+			for url in ('/', f'/products/product/{self.product.id}/', '/cart/', '/cart/status/'):
+				self.assertEqual(self.client.get(url).status_code, 200)
+		writes = [q['sql'] for q in queries if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+		self.assertEqual(writes, [])
+		self.assertEqual(Cart.objects.count(), 0)
+		self.assertEqual(Session.objects.count(), 0)
+
+	def test_first_add_creates_cart_remembered_by_cookie(self):
+		self.add(2)
+		self.add(1)
+		self.assertEqual(Cart.objects.count(), 1)
+		self.assertEqual(Session.objects.count(), 0)
+		self.assertEqual(self.client.get('/cart/status/').json()['cart_count'], 3)
+
+		# A tampered cookie is ignored rather than trusted
+		self.client.cookies['cart'] = 'not-signed'
+		self.assertEqual(self.client.get('/cart/status/').json()['cart_count'], 0)
+
+	@override_settings(CART_STORE='cart.stores.CacheCartStore')
+	def test_cache_store(self):
+		self.add(2)
+		token = self.client.cookies['cart'].value
+		self.assertNotEqual(token, str(Cart.objects.get().pk))
+		self.assertEqual(self.client.get('/cart/status/').json()['cart_count'], 2)
+
+	def test_cookie_expiry_slides_with_each_change(self):
+		day = 24 * 60 * 60
+		start = time.time()
+		self.add()
+		with mock.patch('time.time', return_value=start + 20 * day):
+			self.assertNotIn('cart', self.client.get('/cart/').cookies)
+			self.assertIn('cart', self.add().cookies)
+		with mock.patch('time.time', return_value=start + 40 * day):
+			self.assertEqual(self.client.get('/cart/status/').json()['cart_count'], 2)
+		with mock.patch('time.time', return_value=start + 51 * day):
+			self.assertEqual(self.client.get('/cart/status/').json()['cart_count'], 0)
+
+	@override_settings(CART_STORE='cart.stores.CacheCartStore', DEBUG=False)
+	def test_cache_store_on_local_memory_is_flagged(self):
+		self.assertEqual([warning.id for warning in checks.check_cart_cache(None)], ['cart.W001'])
+
+
+class CartTotalsTests(TestCase):
+	def setUp(self):
+		self.product = Product.objects.create(name='Cap', description='desc', price='300.00', category='test')
+		self.variant = ProductVariant.objects.create(product=self.product, size='One', color='Blue', stock=5)
+
+	def cart(self):
+		return Cart.objects.get()
+
+	def assertTotals(self, count, subtotal):
+		cart = self.cart()
+		self.assertEqual((cart.item_count, cart.subtotal), (count, Decimal(subtotal)))
+		# Stored totals always agree with the aggregate over the lines
+		self.assertEqual((cart.get_item_count(), cart.get_total()), (count, Decimal(subtotal)))
+
+	def test_mutations_keep_totals_in_step(self):
+		self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 2})
+		self.assertTotals(2, '600.00')
+		item = CartItem.objects.get()
+
+		self.client.get(f'/cart/update/{item.id}/increase/')
+		self.assertTotals(3, '900.00')
+		self.client.get(f'/cart/update/{item.id}/decrease/')
+		self.assertTotals(2, '600.00')
+
+		# Price changes flow into stored subtotals
+		self.product.price = '250.00'
+		self.product.save()
+		self.assertTotals(2, '500.00')
+
+		self.client.get(f'/cart/remove/{item.id}/')
+		self.assertTotals(0, '0.00')
+
+		self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 1})
+		self.client.get('/cart/clear/')
+		self.assertTotals(0, '0.00')
+
+	def test_repeated_remove_subtracts_once(self):
+		self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 2})
+		item = CartItem.objects.get()
+		self.client.get(f'/cart/remove/{item.id}/')
+		resp = self.client.get(f'/cart/remove/{item.id}/')
+		self.assertEqual(resp.status_code, 404)
+		self.client.get(f'/cart/update/{item.id}/decrease/')
+		self.assertTotals(0, '0.00')
+
+	def test_cannot_touch_another_visitors_line(self):
+		self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 1})
+		item = CartItem.objects.get()
+		resp = Client().get(f'/cart/remove/{item.id}/')
+		self.assertEqual(resp.status_code, 404)
+		self.assertTotals(1, '300.00')
+
+	def test_deleting_a_variant_updates_carts(self):
+		self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 2})
+		self.variant.delete()
+		self.assertTotals(0, '0.00')
+
+
+class CartBatchTests(TestCase):
+	def setUp(self):
+		self.product = Product.objects.create(name='Sock', description='desc', price='100.00', category='test')
+		self.small = ProductVariant.objects.create(product=self.product, size='S', color='Grey', stock=5)
+		self.large = ProductVariant.objects.create(product=self.product, size='L', color='Grey', stock=2)
+
+	def batch(self, *operations):
+		return self.client.post('/cart/batch/', json.dumps({'operations': list(operations)}), content_type='application/json')
+
+	def test_applies_operations_in_one_request(self):
+		resp = self.batch(
+			{'op': 'add', 'product_id': self.product.id, 'variant_id': self.small.id, 'quantity': 2},
+			{'op': 'add', 'product_id': self.product.id, 'variant_id': self.large.id},
+		)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['cart_count'], 3)
+		small_line, large_line = CartItem.objects.order_by('variant__size').values_list('id', flat=True)[::-1]
+
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.batch(
+				{'op': 'set', 'item_id': small_line, 'quantity': 4},
+				{'op': 'remove', 'item_id': large_line},
+			)
+		data = resp.json()
+		self.assertEqual((data['cart_count'], data['subtotal']), (4, '400.00'))
+		self.assertEqual([item['quantity'] for item in data['items']], [4])
+		self.assertEqual(len([q for q in queries if 'FROM "products_productvariant"' in q['sql']]), 1)
+
+	def test_rejects_whole_batch_when_stock_is_short(self):
+		self.batch({'op': 'add', 'product_id': self.product.id, 'variant_id': self.small.id, 'quantity': 1})
+		line = CartItem.objects.get()
+		resp = self.batch(
+			{'op': 'set', 'item_id': line.id, 'quantity': 3},
+			{'op': 'add', 'product_id': self.product.id, 'variant_id': self.large.id, 'quantity': 3},
+		)
+		self.assertEqual(resp.status_code, 409)
+		self.assertEqual(CartItem.objects.get().quantity, 1)
+		self.assertEqual(Cart.objects.get().item_count, 1)
+
+	def test_line_above_fallen_stock_does_not_block_other_changes(self):
+		self.batch(
+			{'op': 'add', 'product_id': self.product.id, 'variant_id': self.small.id, 'quantity': 4},
+			{'op': 'add', 'product_id': self.product.id, 'variant_id': self.large.id},
+		)
+		small_line = CartItem.objects.get(variant=self.small).id
+		large_line = CartItem.objects.get(variant=self.large).id
+		# Someone else buys most of the small socks
+		ProductVariant.objects.filter(pk=self.small.pk).update(stock=2)
+
+		self.assertEqual(self.batch({'op': 'remove', 'item_id': large_line}).status_code, 200)
+		self.assertEqual(self.batch({'op': 'set', 'item_id': small_line, 'quantity': 3}).status_code, 200)
+		self.assertEqual(self.batch({'op': 'set', 'item_id': small_line, 'quantity': 4}).status_code, 409)
+		self.assertEqual(Cart.objects.get().item_count, 3)
+
+	def test_validates_payload(self):
+		self.assertEqual(self.batch({'op': 'explode'}).status_code, 400)
+		self.assertEqual(self.batch({'op': 'set', 'item_id': 999, 'quantity': 1}).status_code, 404)
+		resp = self.client.post('/cart/batch/', 'not json', content_type='application/json')
+		self.assertEqual(resp.status_code, 400)
+
+
+class ReapCartsTests(TestCase):
+	def test_reaps_only_unreachable_carts(self):
+		product = Product.objects.create(name='Bag', description='desc', price='10.00', category='test')
+		live = SessionStore()
+		live.create()
+		expired = SessionStore()
+		expired.create()
+		Session.objects.filter(pk=expired.session_key).update(expire_date=timezone.now() - timedelta(days=1))
+
+		user = get_user_model().objects.create_user(username='keeper', password='x')
+		keep = [
+			Cart.objects.create(user=user),
+			Cart.objects.create(session_key=live.session_key),
+			Cart.objects.create(),
+		]
+		reap = [
+			Cart.objects.create(session_key=expired.session_key),
+			Cart.objects.create(session_key='gone'),
+			Cart.objects.create(),
+		]
+		Cart.objects.filter(pk=reap[2].pk).update(updated_at=timezone.now() - timedelta(days=60))
+		for cart in keep + reap:
+			CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+		out = io.StringIO()
+		call_command('reap_carts', '--batch-size', '2', '--sleep', '0', stdout=out)
+		self.assertIn('Reclaimed 3 carts, 3 cart items and 1 sessions', out.getvalue())
+		self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {cart.pk for cart in keep})
+		self.assertEqual(list(Session.objects.values_list('pk', flat=True)), [live.session_key])
+
+
+class LoginCartMergeTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='merger', password='testpass', email='m@example.com')
+		self.product = Product.objects.create(name='Scarf', description='desc', price='200.00', category='test')
+		self.red = ProductVariant.objects.create(product=self.product, size='One', color='Red', stock=3)
+		self.blue = ProductVariant.objects.create(product=self.product, size='One', color='Blue', stock=10)
+		self.green = ProductVariant.objects.create(product=self.product, size='One', color='Green', stock=10)
+
+	def add(self, variant, quantity):
+		self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': variant.id, 'quantity': quantity})
+
+	def test_anonymous_cart_merges_into_user_cart(self):
+		user_cart = Cart.objects.create(user=self.user)
+		CartItem.objects.create(cart=user_cart, product=self.product, variant=self.red, quantity=2)
+		CartItem.objects.create(cart=user_cart, product=self.product, variant=self.blue, quantity=1)
+		recalculate_totals(Cart.objects.filter(pk=user_cart.pk))
+
+		self.add(self.red, 2)
+		self.add(self.green, 4)
+		with CaptureQueriesContext(connection) as queries:
+			self.client.post('/accounts/login/', {'email': 'm@example.com', 'password': 'testpass'})
+		merge_queries = [q for q in queries if 'cart_cartitem' in q['sql']]
+
+		lines = dict(CartItem.objects.filter(cart=user_cart).values_list('variant__color', 'quantity'))
+		# Red is summed and clamped to its stock of 3
+		self.assertEqual(lines, {'Red': 3, 'Blue': 1, 'Green': 4})
+		self.assertEqual(Cart.objects.count(), 1)
+		user_cart.refresh_from_db()
+		self.assertEqual((user_cart.item_count, user_cart.subtotal), (8, Decimal('1600.00')))
+		self.assertLessEqual(len(merge_queries), 8)
+
+	def test_anonymous_cart_is_adopted_when_user_has_none(self):
+		self.add(self.blue, 2)
+		resp = self.client.post('/accounts/login/', {'email': 'm@example.com', 'password': 'testpass'})
+		self.assertEqual(resp.status_code, 302)
+		cart = Cart.objects.get()
+		self.assertEqual((cart.user, cart.item_count), (self.user, 2))
+		self.assertEqual(self.client.get('/cart/status/').json()['cart_count'], 2)
+
+
+	def test_session_keyed_cart_merges_on_login(self):
+		# Carts from before cart stores are found by session key
+		session = self.client.session
+		session.save()
+		cart = Cart.objects.create(session_key=session.session_key)
+		CartItem.objects.create(cart=cart, product=self.product, variant=self.green, quantity=2)
+		recalculate_totals(Cart.objects.filter(pk=cart.pk))
+
+		self.client.post('/accounts/login/', {'email': 'm@example.com', 'password': 'testpass'})
+		cart = Cart.objects.get()
+		self.assertEqual((cart.user, cart.session_key, cart.item_count), (self.user, None, 2))
+
+
+class WishlistTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='wisher', password='testpass')
+		self.client.force_login(self.user)
+		self.shirt = Product.objects.create(name='Shirt', description='desc', price='300.00', category='test')
+		self.shirt_m = ProductVariant.objects.create(product=self.shirt, size='M', color='Red', stock=0)
+		self.shirt_l = ProductVariant.objects.create(product=self.shirt, size='L', color='Red', stock=2)
+		self.mug = Product.objects.create(name='Mug', description='desc', price='100.00', category='test')
+		self.hat = Product.objects.create(name='Hat', description='desc', price='150.00', category='test')
+		ProductVariant.objects.create(product=self.hat, size='One', color='Blue', stock=0)
+
+	def wish(self, product):
+		return Wishlist.objects.create(user=self.user, product=product)
+
+	def test_product_page_reads_wishlist_ids_once(self):
+		self.wish(self.shirt)
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.client.get(f'/products/product/{self.shirt.id}/')
+		self.assertTrue(resp.context['in_wishlist'])
+		self.assertEqual(len([q for q in queries if 'cart_wishlist' in q['sql']]), 1)
+		self.assertContains(resp, f'<script id="wishlistIds" type="application/json">[{self.shirt.id}]</script>', html=False)
+
+	def test_wishlist_changes_show_up_straight_away(self):
+		self.assertEqual(self.client.get('/cart/status/').json()['wishlist'], [])
+		item = self.wish(self.mug)
+		self.assertEqual(self.client.get('/cart/status/').json()['wishlist'], [self.mug.id])
+		self.client.get(f'/cart/wishlist/remove/{item.id}/')
+		self.assertEqual(self.client.get('/cart/status/').json()['wishlist'], [])
+
+	def test_wishlist_page_query_count_does_not_grow(self):
+		self.wish(self.shirt)
+		with CaptureQueriesContext(connection) as one:
+			self.client.get('/cart/wishlist/')
+		self.wish(self.mug)
+		self.wish(self.hat)
+		with CaptureQueriesContext(connection) as three:
+			resp = self.client.get('/cart/wishlist/')
+		self.assertEqual(len(resp.context['wishlist_items']), 3)
+		self.assertEqual(len(three), len(one))
+
+	def test_move_selected_items_to_cart(self):
+		shirt, mug, hat = self.wish(self.shirt), self.wish(self.mug), self.wish(self.hat)
+		resp = self.client.post('/cart/wishlist/move-to-cart/', {'item_ids': [shirt.id, mug.id, hat.id]})
+		self.assertRedirects(resp, '/cart/', fetch_redirect_response=False)
+
+		cart = Cart.objects.get(user=self.user)
+		lines = set(CartItem.objects.filter(cart=cart).values_list('product_id', 'variant_id', 'quantity'))
+		# First in-stock variant; no variant for products without any
+		self.assertEqual(lines, {(self.shirt.id, self.shirt_l.id, 1), (self.mug.id, None, 1)})
+		self.assertEqual((cart.item_count, cart.subtotal), (2, Decimal('400.00')))
+		# The out of stock hat stays wishlisted
+		self.assertEqual(list(Wishlist.objects.values_list('product_id', flat=True)), [self.hat.id])
+		self.assertEqual(self.client.get('/cart/status/').json()['wishlist'], [self.hat.id])
+
+	def test_move_ignores_other_users_items(self):
+		other = get_user_model().objects.create_user(username='other', password='x')
+		theirs = Wishlist.objects.create(user=other, product=self.mug)
+		resp = self.client.post('/cart/wishlist/move-to-cart/', {'item_ids': [theirs.id]})
+		self.assertRedirects(resp, '/cart/wishlist/', fetch_redirect_response=False)
+		self.assertFalse(CartItem.objects.exists())
+		self.assertTrue(Wishlist.objects.filter(pk=theirs.pk).exists())
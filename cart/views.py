@@ -1,37 +1,36 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
+from django.db.models import F
 from django.http import JsonResponse
+from django.utils.cache import add_never_cache_headers
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_POST
+from .batch import CartBatchError, apply_operations
+from .context_processors import cart_count
+from .loader import get_request_cart
 from .models import Cart, CartItem, Wishlist
+from .wishlist import get_wishlist_ids, move_to_cart
 from products.models import Product, ProductVariant
 
 
 def get_cart(request):
     """Get or create cart based on user or session"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    return cart
+    return get_request_cart(request).get_or_create()
 
 
 def cart_detail(request):
     """View cart contents"""
-    cart = get_cart(request)
-    items = cart.items.all()
-
-    # Calculate total items
-    total_items = sum(item.quantity for item in items)
+    cart = get_request_cart(request)
 
     context = {
-        'cart': cart,
-        'cart_items': items,
-        'total': cart.get_total(),
-        'total_items': total_items,
+        'cart': cart.cart,
+        'cart_items': cart.items(),
+        'total': cart.total,
+        'total_items': cart.item_count,
     }
     return render(request, 'cart.html', context)
 
@@ -48,67 +47,90 @@ def add_to_cart(request):
         if variant_id:
             variant = get_object_or_404(ProductVariant, id=variant_id)
             # Check stock
-            if variant.stock < quantity:
-                messages.error(request, f"Only {variant.stock} items available in stock")
+            if variant.available < quantity:
+                messages.error(request, f"Only {variant.available} items available in stock")
                 return redirect('product_detail', id=product_id)
 
         cart = get_cart(request)
 
-        # Check if item already in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            variant=variant,
-            defaults={'quantity': quantity}
-        )
-
-        if not created:
-            cart_item.quantity += quantity
-            # Check stock
-            if variant and cart_item.quantity > variant.stock:
-                messages.error(request, f"Only {variant.stock} items available in stock")
-                return redirect('product_detail', id=product_id)
-            cart_item.save()
-
+        with transaction.atomic():
+            # Check if item already in cart
+            cart_item, created = CartItem.objects.select_for_update().get_or_create(
+                cart=cart,
+                product=product,
+                variant=variant,
+                defaults={'quantity': quantity}
+            )
+
+            if not created:
+                # Check stock
+                if variant and cart_item.quantity + quantity > variant.available:
+                    messages.error(request, f"Only {variant.available} items available in stock")
+                    return redirect('product_detail', id=product_id)
+                CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + quantity)
+            cart.adjust(quantity, product.price * quantity)
+
+        get_request_cart(request).invalidate()
         messages.success(request, f"{product.name} added to cart!")
         return redirect('cart')
 
     return redirect('home')
 
 
+def _owned_item(request, item_id):
+    """Cart line by id, only from the requester's own cart, locked until the transaction ends"""
+    return get_object_or_404(
+        # Lock the line only; the variant join is nullable
+        CartItem.objects.select_related('cart', 'product', 'variant').select_for_update(of=('self',)),
+        id=item_id, cart=get_request_cart(request).cart,
+    )
+
+
 def update_cart_item(request, item_id, action):
     """Update cart item quantity - increase or decrease"""
-    cart_item = get_object_or_404(CartItem, id=item_id)
-
-    if action == 'increase':
-        # Check stock
-        if cart_item.variant and cart_item.quantity >= cart_item.variant.stock:
-            messages.error(request, f"Only {cart_item.variant.stock} items available")
-            return redirect('cart')
-        cart_item.quantity += 1
-        cart_item.save()
-    elif action == 'decrease':
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-        else:
-            cart_item.delete()
+    with transaction.atomic():
+        # Read under the lock so a concurrent change can't leave us a stale quantity
+        cart_item = _owned_item(request, item_id)
+        price = cart_item.product.price
 
+        if action == 'increase':
+            # Check stock
+            if cart_item.variant and cart_item.quantity >= cart_item.variant.available:
+                messages.error(request, f"Only {cart_item.variant.available} items available")
+                return redirect('cart')
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + 1)
+            cart_item.cart.adjust(1, price)
+        elif action == 'decrease':
+            if cart_item.quantity > 1:
+                changed = CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') - 1)
+            else:
+                changed, _ = CartItem.objects.filter(pk=cart_item.pk).delete()
+            if changed:
+                cart_item.cart.adjust(-1, -price)
+
+    get_request_cart(request).invalidate()
     return redirect('cart')
 
 
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
-    cart_item = get_object_or_404(CartItem, id=item_id)
-    cart_item.delete()
+    with transaction.atomic():
+        cart_item = _owned_item(request, item_id)
+        # Of two concurrent removes only the one that deleted the row adjusts the totals
+        deleted, _ = CartItem.objects.filter(pk=cart_item.pk).delete()
+        if deleted:
+            cart_item.cart.adjust(-cart_item.quantity, -cart_item.product.price * cart_item.quantity)
+    get_request_cart(request).invalidate()
     messages.success(request, "Item removed from cart")
     return redirect('cart')
 
 
 def clear_cart(request):
     """Clear all items from cart"""
-    cart = get_cart(request)
-    cart.items.all().delete()
+    cart = get_request_cart(request)
+    if cart.cart:
+        cart.cart.clear()
+        cart.invalidate()
     messages.success(request, "Cart cleared")
     return redirect('cart')
 
@@ -117,7 +139,7 @@ def clear_cart(request):
 @login_required
 def wishlist(request):
     """View wishlist"""
-    wishlist_items = Wishlist.objects.filter(user=request.user)
+    wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product').order_by('-created_at')
     return render(request, 'wishlist.html', {'wishlist_items': wishlist_items})
 
 
@@ -150,7 +172,62 @@ def remove_from_wishlist(request, item_id):
     return redirect('wishlist')
 
 
+@login_required
+@require_POST
+def move_wishlist_to_cart(request):
+    """Move the selected wishlist items to the cart in one go"""
+    item_ids = [item_id for item_id in request.POST.getlist('item_ids') if item_id.isdigit()]
+    if not item_ids:
+        messages.info(request, "Select the items you want to move to your cart")
+        return redirect('wishlist')
+
+    try:
+        moved, unavailable = move_to_cart(get_request_cart(request), request.user, item_ids)
+    except CartBatchError as exc:
+        messages.error(request, str(exc))
+        return redirect('wishlist')
+
+    if moved:
+        messages.success(request, f"Moved {len(moved)} item{'s' if len(moved) != 1 else ''} to your cart")
+    if unavailable:
+        names = ', '.join(product.name for product in unavailable)
+        messages.warning(request, f"Out of stock, kept in your wishlist: {names}")
+    return redirect('cart' if moved else 'wishlist')
+
+
 def get_cart_count(request):
     """AJAX - Get cart item count"""
-    cart = get_cart(request)
-    return JsonResponse({'count': cart.get_item_count()})
+    return JsonResponse({'count': get_request_cart(request).item_count})
+
+
+@require_POST
+def cart_batch(request):
+    """AJAX - Apply a list of line operations in one go, return the new cart"""
+    try:
+        payload = json.loads(request.body or b'{}')
+        cart = apply_operations(get_request_cart(request), payload.get('operations') if isinstance(payload, dict) else None)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except CartBatchError as exc:
+        return JsonResponse({'error': str(exc), 'operation': exc.index}, status=exc.status)
+
+    cart_state = get_request_cart(request)
+    return JsonResponse({
+        'cart_count': cart_state.item_count,
+        'subtotal': str(cart_state.total),
+        'items': [
+            {'id': item.id, 'quantity': item.quantity, 'total': str(item.get_total())}
+            for item in cart_state.items()
+        ],
+    })
+
+
+@ensure_csrf_cookie
+def cart_status(request):
+    """AJAX - Per-user parts of shared (cached) pages: cart badge and wishlist hearts"""
+    response = JsonResponse({
+        'cart_count': cart_count(request)['cart_count'],
+        'wishlist': sorted(get_wishlist_ids(request)),
+    })
+    add_never_cache_headers(response)
+    return response
@@ -0,0 +1,72 @@
+"""
+Wishlist membership and bulk moves to the cart.
+
+A user's wishlisted product ids are read with one query on the
+``(user, product)`` unique index and memoized on the request. Any page can
+then mark hearts with plain set lookups instead of a query per product.
+They aren't cached across requests: a per-process cache would keep hearts
+wrong in every worker but the one that saw the change.
+"""
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from products.models import ProductVariant
+
+from .batch import apply_operations
+from .models import Wishlist
+
+
+def wishlist_ids(user):
+    """Frozen set of product ids in ``user``'s wishlist"""
+    if not user.is_authenticated:
+        return frozenset()
+    return frozenset(Wishlist.objects.filter(user=user).values_list('product_id', flat=True))
+
+
+def get_wishlist_ids(request):
+    """``wishlist_ids`` for the requester, looked up at most once per request"""
+    ids = getattr(request, '_wishlist_ids', None)
+    if ids is None:
+        ids = request._wishlist_ids = wishlist_ids(request.user)
+    return ids
+
+
+def move_to_cart(request_cart, user, item_ids):
+    """
+    Move the given wishlist entries to the cart in one transaction.
+
+    Each product goes in with quantity 1 of its first in-stock variant
+    (products without variants go in as they are). Returns
+    ``(moved, unavailable)`` lists of products; unavailable ones stay
+    wishlisted.
+    """
+    with transaction.atomic():
+        items = list(
+            Wishlist.objects.filter(user=user, pk__in=item_ids)
+            .select_related('product')
+            .annotate(has_variants=Exists(ProductVariant.objects.filter(product=OuterRef('product'))))
+        )
+        in_stock = {}
+        variants = (
+            ProductVariant.objects.filter(product__in=[item.product_id for item in items], stock__gt=F('reserved'))
+            .order_by('product_id', 'pk')
+            .values_list('product_id', 'pk')
+        )
+        for product_id, variant_id in variants:
+            in_stock.setdefault(product_id, variant_id)
+
+        operations, moved, unavailable = [], [], []
+        for item in items:
+            if item.has_variants and item.product_id not in in_stock:
+                unavailable.append(item.product)
+                continue
+            operations.append({
+                'op': 'add', 'product_id': item.product_id,
+                'variant_id': in_stock.get(item.product_id), 'quantity': 1,
+            })
+            moved.append(item)
+
+        if operations:
+            apply_operations(request_cart, operations)
+            Wishlist.objects.filter(pk__in=[item.pk for item in moved]).delete()
+    return [item.product for item in moved], unavailable
@@ -0,0 +1,48 @@
+"""
+Small in-process worker pool for work that shouldn't block a request.
+
+Jobs are submitted after the surrounding transaction commits, so workers
+always see the rows that scheduled them. ``BACKGROUND_WORKERS = 0`` runs
+jobs inline instead, which is what tests and management commands want.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='background',
+                )
+    return _executor
+
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background job %s failed', getattr(func, '__name__', func))
+    finally:
+        # Worker threads keep their own connections; don't leak them
+        close_old_connections()
+
+
+def submit(func, *args):
+    """Run ``func(*args)`` on the pool once the current transaction commits"""
+    if getattr(settings, 'BACKGROUND_WORKERS', 0) <= 0:
+        transaction.on_commit(lambda: func(*args))
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run, func, args))
@@ -0,0 +1,15 @@
+"""
+Helpers for the Django caches the apps share.
+
+Several features keep state in a cache that every web worker must see
+(catalog versions, shared pages, cart tokens). ``LocMemCache`` lives inside
+one process, so under gunicorn's several workers a write in one is invisible
+to the others.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_process_local(alias):
+    """True if the cache ``alias`` is private to this process"""
+    return isinstance(caches[alias], LocMemCache)
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'accounts',
@@ -60,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cart.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -78,6 +80,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'cart.context_processors.cart_count',
+                'cart.context_processors.wishlist_ids',
             ],
         },
     },
@@ -99,6 +102,48 @@ DATABASES = {
     }
 }
 
+# Caches
+# The catalog cache holds versioned product data (see products/cache.py).
+# Point CATALOG_CACHE_BACKEND at a shared cache such as
+# django.core.cache.backends.redis.RedisCache in production: with several
+# gunicorn workers on local memory, a change only reaches the worker that
+# made it, and the others serve stale data for up to
+# CATALOG_LOCAL_VERSION_TIMEOUT seconds.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': os.getenv('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CATALOG_CACHE_LOCATION', 'catalog'),
+        'TIMEOUT': None,
+    },
+    'carts': {
+        'BACKEND': os.getenv('CART_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CART_CACHE_LOCATION', 'carts'),
+    },
+}
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 3600
+CATALOG_LOCAL_VERSION_TIMEOUT = 60
+# Whole-page cache for anonymous visitors (products/page_cache.py). None:
+# on only when the catalog cache is shared, or in DEBUG
+SHARED_PAGE_CACHE = None
+
+# Anonymous carts (see cart/stores.py): a signed cookie by default, or
+# cart.stores.CacheCartStore to keep them in CART_CACHE_ALIAS, which must
+# then be shared by every worker (set CART_CACHE_BACKEND, e.g. to Redis)
+CART_STORE = os.getenv('CART_STORE', 'cart.stores.SignedCookieCartStore')
+CART_CACHE_ALIAS = 'carts'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+
+# Seconds stock stays held for an order awaiting online payment; see
+# orders/reservations.py and the release_reservations command
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Session reads come from the cache; writes still go to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -140,6 +185,13 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Rendered PDF invoices (orders/invoices.py); keep outside MEDIA_ROOT, they
+# are only served to their owner through download_invoice
+INVOICE_ROOT = os.getenv('INVOICE_ROOT', os.path.join(BASE_DIR, 'private', 'invoices'))
+
+# Threads for ecommerce.background jobs (image renditions); 0 runs them inline
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '2'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -163,8 +215,15 @@ STRIPE_PUBLISHABLE_KEY = "your_stripe_publishable_key"
 STRIPE_SECRET_KEY = "your_stripe_secret_key"
 
 # Email Configuration
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# Order emails are queued in the outbox and sent by `manage.py send_outbox`
+# (orders/outbox.py); use the filebased backend with EMAIL_FILE_PATH to
+# inspect them locally
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', os.path.join(BASE_DIR, 'sent_emails'))
 DEFAULT_FROM_EMAIL = 'noreply@parikart.com'
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE = 60
+OUTBOX_RETRY_MAX = 6 * 60 * 60
 
 # Login URLs
 LOGIN_URL = 'login'
@@ -0,0 +1,216 @@
+"""
+Turning a cart into an order.
+
+Everything happens in one transaction with a fixed number of statements,
+whatever the size of the cart: the cart lines are read once, the variants
+involved are locked in primary key order (so concurrent checkouts never
+deadlock), the order lines are inserted with one bulk INSERT and stock is
+taken (or, for online payment, reserved) with a single conditional UPDATE.
+If any line is short, nothing is written.
+"""
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Sum, When
+
+from cart.models import Cart, CartItem
+from products.models import AVAILABLE, ProductVariant
+
+from . import ids, invoices, outbox, reservations
+from .models import Order, OrderEvent, OrderItem, StockReservation
+
+
+# Stock for these is only held until the payment comes through
+ONLINE_PAYMENT_METHODS = ('razorpay', 'stripe')
+
+# Tries at a fresh order ID when one is already taken by another process
+ORDER_ID_ATTEMPTS = 3
+
+
+class OutOfStock(Exception):
+    """Some cart lines ask for more than is left; nothing was changed"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(', '.join(
+            f'Only {available} of {variant.product.name} ({variant.size} / {variant.color}) left'
+            for variant, available in shortages
+        ) or 'Some items in your cart are no longer in stock')
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def _take_stock(quantities, hold=False):
+    """
+    Take ``{variant_id: quantity}`` out of available stock, raising
+    ``OutOfStock`` on any shortfall. With ``hold`` the units are only
+    reserved, pending an online payment.
+    """
+    if not quantities:
+        return
+    available = dict(
+        ProductVariant.objects.select_for_update()
+        .filter(pk__in=quantities).order_by('pk').annotate(available=AVAILABLE).values_list('pk', 'available')
+    )
+    short = [pk for pk, quantity in quantities.items() if available.get(pk, 0) < quantity]
+    if short:
+        variants = ProductVariant.objects.select_related('product').in_bulk(short)
+        raise OutOfStock([(variants[pk], max(available.get(pk, 0), 0)) for pk in short if pk in variants])
+
+    # The available >= n guard holds even where the locks above are not
+    # enough (e.g. a variant edited outside a transaction): short rows are
+    # not updated
+    enough = reduce(or_, (Q(pk=pk, stock__gte=F('reserved') + quantity) for pk, quantity in quantities.items()))
+    per_variant = Case(*(When(pk=pk, then=quantity) for pk, quantity in quantities.items()))
+    if hold:
+        updated = ProductVariant.objects.filter(enough).update(reserved=F('reserved') + per_variant)
+    else:
+        updated = ProductVariant.objects.filter(enough).update(stock=F('stock') - per_variant)
+    if updated != len(quantities):
+        raise OutOfStock([])
+    reservations.stock_changed(quantities)
+
+
+def _order_quantities(order):
+    quantities = Counter()
+    for variant_id, quantity in order.items.filter(variant__isnull=False).values_list('variant_id', 'quantity'):
+        quantities[variant_id] += quantity
+    return quantities
+
+
+def _create_order(**fields):
+    """
+    Insert an order. If its ID is already taken (another process drew the
+    same node number), draw a new node number and try again.
+    """
+    for attempt in range(1, ORDER_ID_ATTEMPTS + 1):
+        order_id = ids.new_order_id()
+        try:
+            with transaction.atomic():
+                return Order.objects.create(order_id=order_id, **fields)
+        except IntegrityError:
+            if attempt == ORDER_ID_ATTEMPTS or not Order.objects.filter(order_id=order_id).exists():
+                raise
+            ids.renew_node()
+
+
+def place_order(user, cart, shipping_address, phone, payment_method='cod'):
+    """
+    Create an order from ``cart``, take the stock and empty the cart.
+
+    Orders paid online only hold their stock until the payment is
+    confirmed (``confirm_payment``) or the hold expires.
+    """
+    with transaction.atomic():
+        # A second submit of the same cart waits here, then finds it empty
+        Cart.objects.select_for_update().filter(pk=cart.pk).first()
+        lines = list(
+            CartItem.objects.filter(cart=cart).order_by('pk')
+            .values_list('product_id', 'variant_id', 'quantity', 'product__price')
+        )
+        if not lines:
+            raise EmptyCart()
+
+        quantities = Counter()
+        for product_id, variant_id, quantity, price in lines:
+            if variant_id:
+                quantities[variant_id] += quantity
+        online = payment_method in ONLINE_PAYMENT_METHODS
+        _take_stock(quantities, hold=online)
+
+        order = _create_order(
+            user=user,
+            total_price=sum(quantity * price for product_id, variant_id, quantity, price in lines),
+            shipping_address=shipping_address,
+            phone=phone,
+            status='pending',
+            payment_method=payment_method,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, variant_id=variant_id, quantity=quantity, price=price)
+            for product_id, variant_id, quantity, price in lines
+        ])
+        OrderEvent.record([(order.pk, '')], 'pending', actor=user, note='Order placed')
+        if online:
+            reservations.create(order, quantities)
+        else:
+            outbox.enqueue(
+                f'Order Confirmation - {order.order_id}',
+                f'Thank you for your order! Your order ID is {order.order_id}.\n\nTotal: ₹{order.total_price}\n\nPayment Method: Cash on Delivery',
+                [user.email],
+            )
+        cart.clear()
+    return order
+
+
+def confirm_payment(order, payment_id):
+    """
+    Record a successful online payment and turn the order's stock hold into
+    a sale. If the hold lapsed (payment_status ``expired``) the stock is
+    taken again when it's still there. Otherwise, or when the order was
+    cancelled on purpose, it stays cancelled with payment_status
+    ``refund_due``.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.payment_status == 'completed':
+            # Callback delivered twice
+            return order
+        previous = order.status
+        expired = order.payment_status == 'expired'
+        order.payment_id = payment_id
+        order.payment_status = 'completed'
+        order.status = 'processing'
+        if not reservations.commit(order):
+            if not expired:
+                # Cancelled by the customer or staff: paying doesn't undo that
+                order.status = previous
+                order.payment_status = 'refund_due'
+            else:
+                try:
+                    with transaction.atomic():
+                        _take_stock(_order_quantities(order))
+                except OutOfStock:
+                    order.status = 'cancelled'
+                    order.payment_status = 'refund_due'
+        order.save()
+        if order.status != previous:
+            # Outside TRANSITIONS on purpose: a late payment revives an expired order
+            OrderEvent.record(
+                [(order.pk, previous)], order.status,
+                note='Payment received' if order.status == 'processing' else 'Paid after the stock ran out',
+            )
+        if order.payment_status == 'completed':
+            invoices.schedule(order)
+            outbox.enqueue(
+                f'Payment Successful - Order {order.order_id}',
+                f'Your payment of ₹{order.total_price} has been successful!\n\n'
+                f'Order ID: {order.order_id}\n'
+                f'Payment ID: {payment_id}\n\n'
+                f'Thank you for shopping with us!',
+                [order.user.email],
+            )
+    return order
+
+
+def restock_orders(order_ids):
+    """
+    Put the stock of ``order_ids`` back: holds are released, and orders that
+    took stock outright return it. A fixed number of statements per call.
+    """
+    held = set(StockReservation.objects.filter(order_id__in=order_ids).values_list('order_id', flat=True))
+    reservations._release(held)
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=set(order_ids) - held, variant__isnull=False)
+        .values('variant_id').annotate(total=Sum('quantity')).values_list('variant_id', 'total')
+    )
+    if quantities:
+        ProductVariant.objects.filter(pk__in=quantities).update(
+            stock=F('stock') + Case(*(When(pk=pk, then=quantity) for pk, quantity in quantities.items())),
+        )
+        reservations.stock_changed(quantities)
+
@@ -0,0 +1,121 @@
+"""
+Bulk invoice export.
+
+Orders are split into chunks and rendered across a process pool with the
+same layout and on-disk cache as ``download_invoice`` (``orders.invoices``),
+so an invoice rendered once is never rendered again. Workers hand back file
+paths, not PDFs; the parent copies each file into the ZIP as it arrives, so
+memory stays flat however many invoices there are. The archive can go to a
+file (``export_invoices``) or be streamed as it's written (the admin
+action).
+"""
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.db import connections
+from django.db.models import Prefetch
+
+from . import invoices
+from .models import Order, OrderItem
+
+
+CHUNK_SIZE = 25
+
+
+def _init_worker():
+    # Needed with the spawn start method; a no-op when forked
+    if not apps.ready:
+        django.setup()
+
+
+def _render_chunk(order_pks):
+    """Render (or find) the invoices for ``order_pks``; returns ``[(order_id, path), ...]``"""
+    orders = (
+        Order.objects.filter(pk__in=order_pks).select_related('user').order_by('pk')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product', 'variant')))
+    )
+    return [(order.order_id, str(invoices.get_invoice(order)[0])) for order in orders]
+
+
+def _chunks(pks, size):
+    for start in range(0, len(pks), size):
+        yield pks[start:start + size]
+
+
+def render_all(queryset, workers=None, chunk_size=CHUNK_SIZE):
+    """Yield ``(order_id, path)`` for every order in ``queryset``, rendering across ``workers`` processes"""
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(pks) <= chunk_size:
+        for chunk in _chunks(pks, chunk_size):
+            yield from _render_chunk(chunk)
+        return
+
+    # Forked workers must not share the parent's database sockets
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for rendered in pool.map(_render_chunk, _chunks(pks, chunk_size)):
+            yield from rendered
+
+
+def _zip(output, queryset, workers, on_progress=None):
+    """Write the ZIP to ``output``, yielding after each invoice added"""
+    total = queryset.count()
+    started = time.monotonic()
+    # PDFs are compressed already
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        for done, (order_id, path) in enumerate(render_all(queryset, workers), 1):
+            try:
+                archive.write(path, f'invoice_{order_id}.pdf')
+            except FileNotFoundError:
+                # Replaced by a concurrent rendering since the worker found it
+                order = Order.objects.select_related('user').get(order_id=order_id)
+                invoice, _ = invoices.open_invoice(order)
+                with invoice:
+                    archive.writestr(f'invoice_{order_id}.pdf', invoice.read())
+            if on_progress:
+                on_progress(done, total, time.monotonic() - started)
+            yield done
+
+
+def write_zip(output, queryset, workers=None, on_progress=None):
+    """
+    Write every invoice in ``queryset`` into a ZIP on the file object
+    ``output``; ``on_progress(done, total, elapsed)`` is called per invoice.
+    Returns the number of invoices written.
+    """
+    done = 0
+    for done in _zip(output, queryset, workers, on_progress):
+        pass
+    return done
+
+
+class _Chunks:
+    """Write-only file object collecting what ZipFile writes, for streaming"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_zip(queryset, workers=None):
+    """ZIP bytes for every invoice in ``queryset``, yielded as they're written"""
+    output = _Chunks()
+    for _ in _zip(output, queryset, workers):
+        yield from output.drain()
+    # The central directory is written on close
+    yield from output.drain()
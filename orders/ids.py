@@ -0,0 +1,126 @@
+"""
+Time-ordered order IDs.
+
+``ORD-7KZ2M4Q-R9X01F3``: 14 Crockford base32 characters (no I, L, O or U,
+so they read back over the phone) holding
+
+* 45 bits of milliseconds since 2024-01-01,
+* a 15-bit node number picked at random when the process starts (and again
+  after a fork), never 0,
+* a 10-bit sequence for IDs made in the same millisecond.
+
+Within a process IDs strictly increase, so they can't repeat; across
+processes the node number keeps them apart. Two processes can still draw
+the same node number, so ``place_order`` retries an ID that hits the
+unique index after ``renew_node``. Because the time comes first,
+new IDs sort after every earlier one and inserts land at the right-hand
+edge of the unique index instead of all over it. Node 0 is reserved for
+IDs given to orders created before this scheme (see ``for_legacy``).
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+PREFIX = 'ORD-'
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+TIME_BITS, NODE_BITS, SEQUENCE_BITS = 45, 15, 10
+LENGTH = (TIME_BITS + NODE_BITS + SEQUENCE_BITS) // 5
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+_DECODE = {char: value for value, char in enumerate(ALPHABET)}
+# Crockford's forgiving reads
+_DECODE.update({'O': 0, 'I': 1, 'L': 1})
+
+_lock = threading.Lock()
+_node = None
+_last_ms = 0
+_sequence = 0
+
+
+def _new_node():
+    global _node, _last_ms, _sequence
+    _node = random.SystemRandom().randint(1, (1 << NODE_BITS) - 1)
+    _last_ms, _sequence = 0, 0
+
+
+_new_node()
+if hasattr(os, 'register_at_fork'):
+    # Forked workers (gunicorn, process pools) must not share a node number
+    os.register_at_fork(after_in_child=_new_node)
+
+
+def renew_node():
+    """Draw a new node number, e.g. after this one turned out to be shared"""
+    with _lock:
+        _new_node()
+
+
+def encode(ms, node, sequence):
+    """The ID for a millisecond timestamp (since EPOCH_MS), node and sequence"""
+    value = (ms << (NODE_BITS + SEQUENCE_BITS)) | (node << SEQUENCE_BITS) | sequence
+    chars = []
+    for _ in range(LENGTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    body = ''.join(reversed(chars))
+    return f'{PREFIX}{body[:7]}-{body[7:]}'
+
+
+def decode(order_id):
+    """``(ms, node, sequence)`` of an ID; ValueError if it isn't one of ours"""
+    body = order_id.upper().removeprefix(PREFIX).replace('-', '')
+    if len(body) != LENGTH:
+        raise ValueError(f'Not a time-ordered order ID: {order_id!r}')
+    value = 0
+    for char in body:
+        if char not in _DECODE:
+            raise ValueError(f'Not a time-ordered order ID: {order_id!r}')
+        value = value << 5 | _DECODE[char]
+    sequence = value & MAX_SEQUENCE
+    node = (value >> SEQUENCE_BITS) & ((1 << NODE_BITS) - 1)
+    return value >> (NODE_BITS + SEQUENCE_BITS), node, sequence
+
+
+def created_at(order_id):
+    """When an ID was generated, as an aware UTC datetime"""
+    ms = decode(order_id)[0]
+    return datetime.fromtimestamp((EPOCH_MS + ms) / 1000, tz=dt_timezone.utc)
+
+
+def _ms(when=None):
+    seconds = time.time() if when is None else when.timestamp()
+    return int(seconds * 1000) - EPOCH_MS
+
+
+def new_order_id():
+    """A fresh ID, greater than every ID this process made before"""
+    global _last_ms, _sequence
+    with _lock:
+        ms = _ms()
+        if ms > _last_ms:
+            _last_ms, _sequence = ms, 0
+        elif _sequence < MAX_SEQUENCE:
+            _sequence += 1
+        else:
+            # Out of sequence numbers (or the clock went back): borrow the next millisecond
+            _last_ms, _sequence = _last_ms + 1, 0
+        return encode(_last_ms, _node, _sequence)
+
+
+def for_legacy(created, taken):
+    """
+    A node-0 ID for an order created at ``created`` before this scheme;
+    ``taken`` is the set of (ms, sequence) pairs handed out so far.
+    """
+    ms, sequence = max(_ms(created), 0), 0
+    while (ms, sequence) in taken:
+        sequence += 1
+        if sequence > MAX_SEQUENCE:
+            ms, sequence = ms + 1, 0
+    taken.add((ms, sequence))
+    return encode(ms, 0, sequence)
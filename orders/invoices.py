@@ -0,0 +1,209 @@
+"""
+PDF invoices, rendered once and kept on disk.
+
+An invoice only changes when something printed on it does, so each PDF is
+stored under a digest of those inputs (the order's ID, status, payment
+fields, total, shipping address and phone, the customer's name and email,
+and the layout version): ``INVOICE_ROOT/<order_id>/<digest>.pdf``. The
+digest doubles as the ETag.
+Paying for an order renders its invoice in the background; a download finds
+the file already there, or renders it on the spot when the inputs moved on.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from ecommerce import background
+
+from .models import Order
+
+
+# Bump when the layout changes so every invoice is rendered again
+LAYOUT_VERSION = 1
+
+# Lookups before giving up when concurrent renderings keep replacing the file
+OPEN_ATTEMPTS = 3
+
+COLUMN_WIDTHS = [2 * inch, 1.5 * inch, 0.5 * inch, 1 * inch, 1 * inch]
+
+
+@lru_cache(maxsize=None)
+def _styles():
+    """Paragraph and table styles, built once per process"""
+    styles = getSampleStyleSheet()
+    subtitle = ParagraphStyle('Subtitle', parent=styles['Normal'], fontSize=10, textColor=colors.gray)
+    table = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -3), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -3), colors.black),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ])
+    return styles['Title'], styles['Heading2'], styles['Normal'], subtitle, table
+
+
+def digest(order):
+    """Hash of everything the invoice prints that can change after checkout"""
+    user = order.user
+    inputs = [
+        LAYOUT_VERSION, order.pk, order.order_id, order.status, order.payment_status,
+        order.payment_id, order.payment_method, str(order.total_price),
+        order.shipping_address, order.phone,
+        user.get_full_name() or user.username, user.email,
+    ]
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()[:32]
+
+
+def _root():
+    return Path(getattr(settings, 'INVOICE_ROOT', Path(settings.BASE_DIR) / 'private' / 'invoices'))
+
+
+def path_for(order, order_digest=None):
+    return _root() / order.order_id / f'{order_digest or digest(order)}.pdf'
+
+
+def _items(order):
+    # Bulk exports prefetch the lines for a whole chunk of orders
+    if 'items' in getattr(order, '_prefetched_objects_cache', {}):
+        return order.items.all()
+    return order.items.select_related('product', 'variant')
+
+
+def render(order):
+    """The invoice PDF for ``order`` as bytes"""
+    title_style, heading_style, normal_style, subtitle_style, table_style = _styles()
+    user = order.user
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
+    content = []
+
+    # Company Header
+    content.append(Paragraph("Pari kart - Invoice", title_style))
+    content.append(Paragraph("123 E-Commerce Street, Online City, India", subtitle_style))
+    content.append(Paragraph("Phone: +91 9876543210 | Email: support@parikart.com", subtitle_style))
+    content.append(Spacer(1, 20))
+
+    # Invoice Details
+    content.append(Paragraph(f"<b>Invoice Number:</b> {order.order_id}", normal_style))
+    content.append(Paragraph(f"<b>Date:</b> {order.created_at.strftime('%d-%m-%Y %H:%M')}", normal_style))
+    content.append(Paragraph(f"<b>Status:</b> {order.get_status_display()}", normal_style))
+    content.append(Spacer(1, 20))
+
+    # Customer Details
+    content.append(Paragraph("<b>Bill To:</b>", heading_style))
+    content.append(Paragraph(f"{user.get_full_name() or user.username}", normal_style))
+    content.append(Paragraph(f"Email: {user.email}", normal_style))
+    content.append(Paragraph(f"Phone: {order.phone}", normal_style))
+    content.append(Paragraph(f"Address: {order.shipping_address}", normal_style))
+    content.append(Spacer(1, 20))
+
+    # Items Table
+    table_data = [['Item', 'Variant', 'Qty', 'Price', 'Total']]
+    for item in _items(order):
+        variant_info = f"{item.variant.size} / {item.variant.color}" if item.variant else "-"
+        table_data.append([
+            item.product.name,
+            variant_info,
+            str(item.quantity),
+            f"₹{item.price}",
+            f"₹{item.get_total()}"
+        ])
+
+    # Add totals
+    table_data.append(['', '', '', 'Subtotal:', f"₹{order.total_price}"])
+    table_data.append(['', '', '', 'Shipping:', 'Free'])
+    table_data.append(['', '', '', 'Total:', f"₹{order.total_price}"])
+
+    table = Table(table_data, colWidths=COLUMN_WIDTHS)
+    table.setStyle(table_style)
+    content.append(table)
+    content.append(Spacer(1, 30))
+
+    # Payment Details
+    content.append(Paragraph("<b>Payment Details:</b>", heading_style))
+    content.append(Paragraph(f"Payment ID: {order.payment_id or 'Pending'}", normal_style))
+    content.append(Paragraph(f"Payment Status: {order.payment_status}", normal_style))
+    content.append(Paragraph(f"Payment Method: {order.payment_method.title() if order.payment_method else 'COD'}", normal_style))
+    content.append(Spacer(1, 20))
+
+    # Footer
+    content.append(Paragraph("<b>Terms & Conditions:</b>", heading_style))
+    content.append(Paragraph("1. This is a computer-generated invoice.", normal_style))
+    content.append(Paragraph("2. Goods once sold cannot be returned.", normal_style))
+    content.append(Paragraph("3. Please contact support for any queries.", normal_style))
+    content.append(Spacer(1, 30))
+    content.append(Paragraph("Thank you for shopping with us!", normal_style))
+
+    doc.build(content)
+    return buffer.getvalue()
+
+
+def get_invoice(order):
+    """Path and digest of the current invoice for ``order``, rendering it if needed"""
+    order_digest = digest(order)
+    path = path_for(order, order_digest)
+    if not path.exists():
+        _write(path, render(order))
+        # Older renderings of this order are stale now
+        for stale in path.parent.glob('*.pdf'):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+    return path, order_digest
+
+
+def open_invoice(order):
+    """
+    ``(file, digest)`` of the current invoice for ``order``, opened for
+    reading. A concurrent rendering of newer inputs deletes the file it
+    replaces; then the order is reloaded and its invoice looked up again.
+    """
+    for attempt in range(OPEN_ATTEMPTS):
+        path, order_digest = get_invoice(order)
+        try:
+            return open(path, 'rb'), order_digest
+        except FileNotFoundError:
+            if attempt == OPEN_ATTEMPTS - 1:
+                raise
+            order.refresh_from_db()
+
+
+def _write(path, data):
+    """Write atomically: a concurrent reader sees the whole file or none"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def render_for_order(order_pk):
+    order = Order.objects.select_related('user').filter(pk=order_pk).first()
+    if order is not None:
+        get_invoice(order)
+
+
+def schedule(order):
+    """Pre-render the invoice in the background once the transaction commits"""
+    background.submit(render_for_order, order.pk)
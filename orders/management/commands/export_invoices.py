@@ -0,0 +1,61 @@
+import os
+import time
+from datetime import date, datetime, time as day_time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders import exports
+from orders.models import Order
+
+
+def _day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}; use YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Render the invoices for a date range into a ZIP archive, across a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP file to write')
+        parser.add_argument('--from', dest='start', type=_day, help='First order date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', type=_day, help='Last order date, inclusive (YYYY-MM-DD)')
+        parser.add_argument('--status', action='append', choices=[value for value, label in Order.STATUS_CHOICES],
+                            help='Only orders in this status (repeatable)')
+        parser.add_argument('--payment-status', help='Only orders with this payment status, e.g. completed')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Rendering processes (default: one per core)')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['start']:
+            orders = orders.filter(created_at__gte=timezone.make_aware(datetime.combine(options['start'], day_time.min)))
+        if options['end']:
+            orders = orders.filter(created_at__lt=timezone.make_aware(datetime.combine(options['end'] + timedelta(days=1), day_time.min)))
+        if options['status']:
+            orders = orders.filter(status__in=options['status'])
+        if options['payment_status']:
+            orders = orders.filter(payment_status=options['payment_status'])
+
+        last_report = [0.0]
+
+        def on_progress(done, total, elapsed):
+            if done < total and time.monotonic() - last_report[0] < 0.5:
+                return
+            last_report[0] = time.monotonic()
+            rate = done / elapsed if elapsed else 0
+            eta = (total - done) / rate if rate else 0
+            self.stderr.write(f'\r{done}/{total} invoices, {rate:.1f}/s, ETA {eta:.0f}s', ending='')
+
+        started = time.monotonic()
+        with open(options['output'], 'wb') as output:
+            count = exports.write_zip(output, orders, options['workers'], on_progress)
+        if count:
+            self.stderr.write('')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} invoices to {options["output"]} in {elapsed:.1f}s '
+            f'({count / elapsed if elapsed else 0:.1f}/s, {options["workers"]} workers)'
+        ))
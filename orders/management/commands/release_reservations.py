@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders import reservations
+
+
+class Command(BaseCommand):
+    help = 'Release stock held for orders whose online payment never arrived, and cancel them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=reservations.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--every', type=float, default=0,
+                            help='Keep running, sweeping every this many seconds (0: sweep once and exit)')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+
+            def on_batch(stats):
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{stats.orders} orders, {stats.units} units so far')
+
+            stats = reservations.release_expired(options['batch_size'], options['sleep'], on_batch=on_batch)
+            if stats.batches or not options['every']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Released {stats.units} units from {stats.orders} expired orders '
+                    f'in {stats.batches} batches ({time.monotonic() - started:.1f}s)'
+                ))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
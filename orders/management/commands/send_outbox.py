@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued transactional email, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+        parser.add_argument('--every', type=float, default=0,
+                            help='Keep running, polling every this many seconds (0: drain once and exit)')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+
+            def on_batch(stats):
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{stats.sent} sent, {stats.retried} to retry, {stats.dead} dead so far')
+
+            stats = outbox.drain(options['batch_size'], options['sleep'], on_batch=on_batch)
+            if stats.batches or not options['every']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Sent {stats.sent} emails, {stats.retried} to retry, {stats.dead} dead-lettered '
+                    f'in {stats.batches} batches ({time.monotonic() - started:.1f}s)'
+                ))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
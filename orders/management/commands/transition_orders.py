@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import transitions
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Move many orders to a new status at once, e.g. everything on a shipping manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=[value for value, label in Order.STATUS_CHOICES])
+        parser.add_argument('ids_file', nargs='?', default='-',
+                            help='File with one order ID per line (default: stdin)')
+        parser.add_argument('--note', default='', help='Recorded on every order event')
+        parser.add_argument('--batch-size', type=int, default=transitions.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['ids_file'] == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(options['ids_file']) as ids_file:
+                lines = ids_file.read().splitlines()
+        order_ids = {line.strip() for line in lines if line.strip()}
+
+        orders = Order.objects.filter(order_id__in=order_ids)
+        unknown = len(order_ids) - orders.count()
+        try:
+            stats = transitions.bulk_transition(
+                orders, options['status'], note=options['note'], batch_size=options['batch_size'],
+            )
+        except transitions.InvalidTransition as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(
+            f'{stats.moved} orders marked {options["status"]}, {stats.skipped} not in a status that allows it, '
+            f'{unknown} unknown IDs ({stats.batches} batches)'
+        ))
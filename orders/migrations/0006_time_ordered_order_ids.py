@@ -0,0 +1,57 @@
+# Generated by Django 5.2.11 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def convert_legacy_ids(apps, schema_editor):
+    """Give pre-existing orders time-ordered IDs, keeping the old one for lookups"""
+    from orders import ids
+
+    Order = apps.get_model('orders', 'Order')
+    taken = set()
+    last_pk = 0
+    while True:
+        batch = list(
+            Order.objects.filter(pk__gt=last_pk, legacy_order_id__isnull=True)
+            .order_by('pk').only('pk', 'order_id', 'created_at')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        converted = []
+        for order in batch:
+            try:
+                ids.decode(order.order_id)
+                continue
+            except ValueError:
+                pass
+            order.legacy_order_id = order.order_id
+            order.order_id = ids.for_legacy(order.created_at, taken)
+            converted.append(order)
+        Order.objects.bulk_update(converted, ['order_id', 'legacy_order_id'])
+
+
+def restore_legacy_ids(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(legacy_order_id__isnull=False).update(
+        order_id=models.F('legacy_order_id'), legacy_order_id=None,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='legacy_order_id',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True, unique=True),
+        ),
+        migrations.RunPython(convert_legacy_ids, restore_legacy_ids),
+    ]
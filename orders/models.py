@@ -2,14 +2,12 @@ from django.db import models
 from django.contrib.auth.models import User
 from products.models import Product, ProductVariant
 from django.utils import timezone
-import random
-import string
+from . import ids
 
 
 def generate_order_id():
-    """Generate unique order ID"""
-    random_str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-    return f"ORD-{random_str}"
+    """Generate unique, time-ordered order ID (see orders/ids.py)"""
+    return ids.new_order_id()
 
 
 class Order(models.Model):
@@ -27,8 +25,11 @@ class Order(models.Model):
         ('stripe', 'Stripe'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Indexed by (user, created_at) below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     order_id = models.CharField(max_length=50, unique=True, default=generate_order_id)
+    # ``ORD-XXXXXXXX`` ID from before time-ordered IDs; old links still resolve
+    legacy_order_id = models.CharField(max_length=50, unique=True, null=True, blank=True, editable=False)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_id = models.CharField(max_length=100, blank=True, null=True)
@@ -45,6 +46,48 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Fulfilment queues: orders in a status, oldest first
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # Order history: one customer's orders, newest first
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ]
+
+
+class OrderEvent(models.Model):
+    """One status change of an order. Rows are only ever added, never edited"""
+    # Indexed by (order, created_at) below
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events', db_index=False)
+    # Blank for the order being placed
+    from_status = models.CharField(max_length=20, blank=True)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'pk']
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='order_event_order_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id}: {self.from_status or '-'} -> {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Order events are append-only')
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def record(cls, moved, to_status, actor=None, note='', created_at=None):
+        """Log ``[(order_pk, from_status), ...]`` moving to ``to_status`` with one INSERT"""
+        created_at = created_at or timezone.now()
+        return cls.objects.bulk_create([
+            cls(order_id=order_pk, from_status=from_status, to_status=to_status,
+                actor=actor, note=note, created_at=created_at)
+            for order_pk, from_status in moved
+        ])
 
 
 class OrderItem(models.Model):
@@ -59,3 +102,44 @@ class OrderItem(models.Model):
 
     def get_total(self):
         return self.price * self.quantity
+
+
+class StockReservation(models.Model):
+    """Stock held for an order until its online payment arrives or the hold lapses"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    # Released by the release_reservations sweeper after this
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.order_id}: {self.quantity} x {self.variant_id} until {self.expires_at}"
+
+
+class OutgoingEmail(models.Model):
+    """Email written with the order change it reports; sent later by send_outbox"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The sender only ever scans pending mail that is due
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='outbox_pending_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,115 @@
+"""
+Transactional email outbox.
+
+Views never talk to the mail server. ``enqueue`` writes an
+``OutgoingEmail`` row inside the same transaction as the order change it
+reports, so the mail exists exactly when the change does. The
+``send_outbox`` worker drains due rows in batches over one reused mail
+connection. Failures are retried with exponential backoff; after
+``OUTBOX_MAX_ATTEMPTS`` a row is dead-lettered (status ``dead``) for
+someone to look at in the admin.
+
+Rows are claimed by pushing ``next_attempt_at`` past a lease, so several
+workers can run at once and a crashed worker's batch is picked up again
+once the lease runs out.
+"""
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+
+DEFAULT_BATCH_SIZE = 50
+# Seconds a claimed batch is reserved for the worker sending it
+LEASE = 300
+
+
+@dataclass
+class SendStats:
+    sent: int = 0
+    retried: int = 0
+    dead: int = 0
+    batches: int = 0
+
+
+def enqueue(subject, body, to, from_email=None):
+    """Queue an email; call inside the transaction making the change it reports"""
+    to = [address for address in to if address]
+    if not to:
+        return None
+    return OutgoingEmail.objects.create(
+        subject=subject, body=body, to=to, from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying after ``attempts`` failures"""
+    base = getattr(settings, 'OUTBOX_RETRY_BASE', 60)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'OUTBOX_RETRY_MAX', 6 * 60 * 60))
+
+
+def _claim(batch_size, now):
+    with transaction.atomic():
+        pks = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size]
+        )
+        OutgoingEmail.objects.filter(pk__in=pks).update(next_attempt_at=now + timedelta(seconds=LEASE))
+    return list(OutgoingEmail.objects.filter(pk__in=pks).order_by('pk'))
+
+
+def send_batch(connection, batch_size=DEFAULT_BATCH_SIZE, stats=None):
+    """Send one batch of due mail over ``connection``; returns how many were claimed"""
+    stats = stats or SendStats()
+    now = timezone.now()
+    batch = _claim(batch_size, now)
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+
+    for email in batch:
+        message = EmailMessage(email.subject, email.body, email.from_email, email.to)
+        try:
+            # A no-op while open, so every message goes over the same connection
+            connection.open()
+            connection.send_messages([message])
+        except Exception as exc:
+            # Drop the connection; the next message opens a fresh one
+            connection.close()
+            email.attempts += 1
+            email.last_error = f'{type(exc).__name__}: {exc}'
+            if email.attempts >= max_attempts:
+                email.status = 'dead'
+                stats.dead += 1
+            else:
+                email.next_attempt_at = timezone.now() + timedelta(seconds=backoff(email.attempts))
+                stats.retried += 1
+        else:
+            email.status = 'sent'
+            email.sent_at = timezone.now()
+            stats.sent += 1
+
+    OutgoingEmail.objects.bulk_update(batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    if batch:
+        stats.batches += 1
+    return len(batch)
+
+
+def drain(batch_size=DEFAULT_BATCH_SIZE, sleep=0, on_batch=None):
+    """Send everything that's due, reusing one mail connection throughout"""
+    stats = SendStats()
+    connection = get_connection(fail_silently=False)
+    try:
+        while send_batch(connection, batch_size, stats):
+            if on_batch:
+                on_batch(stats)
+            if sleep:
+                time.sleep(sleep)
+    finally:
+        connection.close()
+    return stats
@@ -0,0 +1,135 @@
+"""
+Stock held for orders awaiting online payment.
+
+Checkout moves the ordered quantities from sellable into
+``ProductVariant.reserved`` and records a ``StockReservation`` per variant
+with an expiry. A successful payment turns the hold into a sale (stock and
+reserved both go down); an abandoned one is released by the
+``release_reservations`` sweeper, which cancels the order. Available to
+sell is always ``stock - reserved``, a plain column read.
+"""
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from products import cache as catalog_cache
+from products.models import ProductVariant
+
+from .models import Order, OrderEvent, StockReservation
+
+
+DEFAULT_BATCH_SIZE = 500
+
+
+@dataclass
+class ReleaseStats:
+    orders: int = 0
+    units: int = 0
+    batches: int = 0
+
+
+def _per_variant(quantities):
+    return Case(*(When(pk=pk, then=quantity) for pk, quantity in quantities.items()))
+
+
+def _lock_variants(variant_ids):
+    # Always in pk order, like checkout, so concurrent writers can't deadlock
+    list(ProductVariant.objects.select_for_update().filter(pk__in=variant_ids).order_by('pk').values_list('pk'))
+
+
+def stock_changed(variant_ids):
+    """Refresh cached pages showing these variants once the transaction commits"""
+    variant_ids = list(variant_ids)
+    if variant_ids:
+        transaction.on_commit(lambda: catalog_cache.bump_variants(variant_ids))
+
+
+def create(order, quantities, ttl=None):
+    """Record holds for ``{variant_id: quantity}`` already added to ``reserved``"""
+    ttl = getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60) if ttl is None else ttl
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+        for variant_id, quantity in quantities.items()
+    ])
+
+
+def _holds(order_ids):
+    holds = list(StockReservation.objects.filter(order_id__in=order_ids).values_list('pk', 'variant_id', 'quantity'))
+    quantities = Counter()
+    for pk, variant_id, quantity in holds:
+        quantities[variant_id] += quantity
+    return [pk for pk, variant_id, quantity in holds], quantities
+
+
+def commit(order):
+    """Turn the order's holds into a sale; False if it has none left (expired)"""
+    with transaction.atomic():
+        pks, quantities = _holds([order.pk])
+        if not pks:
+            return False
+        _lock_variants(quantities)
+        ProductVariant.objects.filter(pk__in=quantities).update(
+            stock=F('stock') - _per_variant(quantities),
+            reserved=F('reserved') - _per_variant(quantities),
+        )
+        StockReservation.objects.filter(pk__in=pks).delete()
+        stock_changed(quantities)
+    return True
+
+
+def _release(order_ids):
+    """Give the holds of ``order_ids`` back to sellable stock; returns the units released"""
+    pks, quantities = _holds(order_ids)
+    if not pks:
+        return 0
+    _lock_variants(quantities)
+    ProductVariant.objects.filter(pk__in=quantities).update(reserved=F('reserved') - _per_variant(quantities))
+    StockReservation.objects.filter(pk__in=pks).delete()
+    stock_changed(quantities)
+    return sum(quantities.values())
+
+
+def release(order):
+    """Give back whatever the order still holds (e.g. when it's cancelled)"""
+    with transaction.atomic():
+        return _release([order.pk])
+
+
+def release_expired(batch_size=DEFAULT_BATCH_SIZE, sleep=0, now=None, on_batch=None):
+    """Release lapsed holds a batch of orders at a time and cancel those orders"""
+    now = now or timezone.now()
+    stats = ReleaseStats()
+    # Orders locked by a payment being confirmed right now are left alone
+    skipped = set()
+    while True:
+        expired = StockReservation.objects.filter(expires_at__lte=now).exclude(order_id__in=skipped)
+        order_ids = list(expired.order_by('order_id').values_list('order_id', flat=True).distinct()[:batch_size])
+        if not order_ids:
+            return stats
+
+        with transaction.atomic():
+            locked = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=order_ids).values_list('pk', flat=True)
+            )
+            stats.units += _release(locked)
+            expiring = list(
+                Order.objects.filter(pk__in=locked, payment_status='pending').values_list('pk', 'status')
+            )
+            stats.orders += Order.objects.filter(pk__in=[pk for pk, status in expiring]).update(
+                status='cancelled', payment_status='expired', updated_at=now,
+            )
+            OrderEvent.record(expiring, 'cancelled', note='Payment window expired', created_at=now)
+        skipped.update(set(order_ids) - set(locked))
+        stats.batches += 1
+        if on_batch:
+            on_batch(stats)
+        if sleep:
+            time.sleep(sleep)
@@ -0,0 +1,11 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from . import reservations
+from .models import Order
+
+
+@receiver(pre_delete, sender=Order)
+def release_held_stock(sender, instance, **kwargs):
+    """Deleting an unpaid order must not leave its units reserved forever"""
+    reservations.release(instance)
@@ -1,3 +1,565 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cart.models import Cart, CartItem, recalculate_totals
+from products.models import Product, ProductVariant
+
+from . import exports, ids, invoices, outbox, transitions
+from .checkout import OutOfStock, confirm_payment, place_order
+from .models import Order, OrderEvent, OrderItem, OutgoingEmail, StockReservation
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='buyer', password='testpass', email='b@example.com')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Jacket', description='desc', price='500.00', category='test')
+        self.plain = Product.objects.create(name='Sticker', description='desc', price='10.00', category='test')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def variant(self, stock):
+        count = ProductVariant.objects.count()
+        return ProductVariant.objects.create(product=self.product, size=f'S{count}', color='Black', stock=stock)
+
+    def fill(self, *lines):
+        for variant, quantity in lines:
+            product = variant.product if variant else self.plain
+            CartItem.objects.create(cart=self.cart, product=product, variant=variant, quantity=quantity)
+        recalculate_totals(Cart.objects.filter(pk=self.cart.pk))
+
+    def test_order_takes_stock_and_clears_cart(self):
+        small, large = self.variant(5), self.variant(1)
+        self.fill((small, 2), (large, 1), (None, 3))
+        resp = self.client.post('/orders/create/', {'address': '1 Main St', 'phone': '123', 'payment_method': 'cod'})
+
+        order = Order.objects.get()
+        self.assertRedirects(resp, f'/orders/detail/{order.order_id}/', fetch_redirect_response=False)
+        self.assertEqual(order.total_price, Decimal('1530.00'))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertEqual(list(ProductVariant.objects.order_by('pk').values_list('stock', flat=True)), [3, 0])
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.items.count(), self.cart.item_count), (0, 0))
+
+    def test_shortfall_rolls_back_everything(self):
+        plenty, scarce = self.variant(10), self.variant(1)
+        self.fill((plenty, 2), (scarce, 2))
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.user, self.cart, '1 Main St', '123')
+
+        self.assertEqual([(variant.pk, left) for variant, left in raised.exception.shortages], [(scarce.pk, 1)])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(list(ProductVariant.objects.order_by('pk').values_list('stock', flat=True)), [10, 1])
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_shortfall_redirects_back_to_cart(self):
+        self.fill((self.variant(0), 1))
+        resp = self.client.post('/orders/create/', {'address': '1 Main St', 'phone': '123'})
+        self.assertRedirects(resp, '/cart/', fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.fill((self.variant(5), 1))
+        with CaptureQueriesContext(connection) as one:
+            place_order(self.user, self.cart, '1 Main St', '123')
+        self.fill(*((self.variant(5), 1) for _ in range(6)))
+        with CaptureQueriesContext(connection) as six:
+            place_order(self.user, self.cart, '1 Main St', '123')
+        self.assertEqual(len(six), len(one))
+
+    def test_taken_order_id_is_retried_with_new_node(self):
+        taken = Order.objects.create(user=self.user, total_price='1.00', shipping_address='1 Main St', phone='123')
+        self.fill((self.variant(5), 1))
+        fresh = ids.new_order_id()
+        with mock.patch.object(ids, 'new_order_id', side_effect=[taken.order_id, fresh]), \
+                mock.patch.object(ids, 'renew_node') as renew_node:
+            order = place_order(self.user, self.cart, '1 Main St', '123')
+        self.assertEqual(order.order_id, fresh)
+        renew_node.assert_called_once()
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 1)
+
+    def test_cancel_restores_stock_once(self):
+        variant = self.variant(4)
+        self.fill((variant, 3))
+        order = place_order(self.user, self.cart, '1 Main St', '123')
+        self.client.get(f'/orders/cancel/{order.order_id}/')
+        self.client.get(f'/orders/cancel/{order.order_id}/')
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 4)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='payer', password='testpass', email='p@example.com')
+        self.product = Product.objects.create(name='Boots', description='desc', price='800.00', category='test')
+        self.variant = ProductVariant.objects.create(product=self.product, size='9', color='Brown', stock=3)
+
+    def order(self, quantity, payment_method='razorpay'):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, variant=self.variant, quantity=quantity)
+        return place_order(self.user, cart, '1 Main St', '123', payment_method)
+
+    def stock(self):
+        self.variant.refresh_from_db()
+        return self.variant.stock, self.variant.reserved, self.variant.available
+
+    def expire(self, order):
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = io.StringIO()
+        call_command('release_reservations', '--sleep', '0', stdout=out)
+        return out.getvalue()
+
+    def test_online_order_holds_stock_until_paid(self):
+        order = self.order(2)
+        self.assertEqual(self.stock(), (3, 2, 1))
+        # Nobody else can buy the held units
+        with self.assertRaises(OutOfStock):
+            self.order(2, 'cod')
+
+        confirm_payment(order, 'pay_1')
+        self.assertEqual(self.stock(), (1, 0, 1))
+        self.assertFalse(StockReservation.objects.exists())
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status, order.payment_id), ('processing', 'completed', 'pay_1'))
+        # A replayed callback changes nothing
+        confirm_payment(order, 'pay_1')
+        self.assertEqual(self.stock(), (1, 0, 1))
+
+    def test_cod_order_takes_stock_directly(self):
+        self.order(1, 'cod')
+        self.assertEqual(self.stock(), (2, 0, 2))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_sweeper_releases_expired_holds_and_cancels(self):
+        expired, live = self.order(1), self.order(1)
+        self.assertIn('Released 1 units from 1 expired orders', self.expire(expired))
+        self.assertEqual(self.stock(), (3, 1, 2))
+        expired.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((expired.status, expired.payment_status), ('cancelled', 'expired'))
+        self.assertEqual((live.status, live.payment_status), ('pending', 'pending'))
+
+    def test_late_payment_takes_stock_again_or_is_flagged(self):
+        late = self.order(2)
+        self.expire(late)
+        late = confirm_payment(late, 'pay_late')
+        self.assertEqual((late.status, late.payment_status), ('processing', 'completed'))
+        self.assertEqual(self.stock(), (1, 0, 1))
+
+        sold_out = self.order(1)
+        self.expire(sold_out)
+        self.order(1, 'cod')
+        sold_out = confirm_payment(sold_out, 'pay_too_late')
+        self.assertEqual((sold_out.status, sold_out.payment_status), ('cancelled', 'refund_due'))
+        self.assertEqual(self.stock(), (0, 0, 0))
+
+    def test_payment_after_cancel_is_refunded(self):
+        order = self.order(2)
+        self.client.force_login(self.user)
+        self.client.get(f'/orders/cancel/{order.order_id}/')
+        order = confirm_payment(order, 'pay_after_cancel')
+        self.assertEqual((order.status, order.payment_status), ('cancelled', 'refund_due'))
+        self.assertEqual(self.stock(), (3, 0, 3))
+        self.assertFalse(OutgoingEmail.objects.filter(subject__startswith='Payment Successful').exists())
+
+    def test_cancel_releases_hold(self):
+        order = self.order(2)
+        self.client.force_login(self.user)
+        self.client.get(f'/orders/cancel/{order.order_id}/')
+        self.assertEqual(self.stock(), (3, 0, 3))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_listing_and_cart_use_available_stock(self):
+        self.order(3)
+        resp = self.client.get('/')
+        card = next(product for product in resp.context['products'] if product.pk == self.product.pk)
+        self.assertEqual((card.total_stock, card.in_stock), (0, False))
+
+        self.client.post('/cart/add/', {'product_id': self.product.id, 'variant_id': self.variant.id, 'quantity': 1})
+        self.assertFalse(CartItem.objects.filter(cart__user__isnull=True).exists())
+
+
+class CountingBackend(LocmemBackend):
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_open = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        CountingBackend.opened += 1
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+
+class DownBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionRefusedError('mail server down')
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='mailer', password='testpass', email='m@example.com')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Lamp', description='desc', price='250.00', category='test')
+        self.variant = ProductVariant.objects.create(product=self.product, size='One', color='White', stock=1)
+
+    def checkout(self):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, variant=self.variant, quantity=1)
+        recalculate_totals(Cart.objects.filter(pk=cart.pk))
+        return self.client.post('/orders/create/', {'address': '1 Main St', 'phone': '123', 'payment_method': 'cod'})
+
+    def test_order_email_is_queued_and_sent_by_worker(self):
+        self.checkout()
+        order = Order.objects.get()
+        self.assertEqual(mail.outbox, [])
+        queued = OutgoingEmail.objects.get()
+        self.assertEqual((queued.subject, queued.to), (f'Order Confirmation - {order.order_id}', ['m@example.com']))
+
+        out = io.StringIO()
+        call_command('send_outbox', stdout=out)
+        self.assertIn('Sent 1 emails', out.getvalue())
+        self.assertEqual([message.subject for message in mail.outbox], [queued.subject])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'sent')
+
+    def test_failed_checkout_queues_nothing(self):
+        self.checkout()
+        resp = self.checkout()
+        self.assertIn('Only 0 of Lamp', str(list(resp.wsgi_request._messages)))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    @override_settings(EMAIL_BACKEND='orders.tests.CountingBackend')
+    def test_batch_reuses_one_connection(self):
+        for i in range(5):
+            outbox.enqueue(f'Mail {i}', 'body', ['x@example.com'])
+        CountingBackend.opened = 0
+        stats = outbox.drain(batch_size=2)
+        self.assertEqual((stats.sent, stats.batches), (5, 3))
+        self.assertEqual(CountingBackend.opened, 1)
+
+    @override_settings(EMAIL_BACKEND='orders.tests.DownBackend', OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BASE=60)
+    def test_failures_back_off_then_dead_letter(self):
+        email = outbox.enqueue('Hello', 'body', ['x@example.com'])
+        stats = outbox.drain()
+        self.assertEqual((stats.sent, stats.retried, stats.dead), (0, 1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('mail server down', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+        # Not due yet
+        self.assertEqual(outbox.drain().batches, 0)
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain().dead, 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('dead', 2))
+
+
+class InvoiceTests(TestCase):
+    def setUp(self):
+        self.invoice_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.invoice_root, ignore_errors=True)
+        settings_override = override_settings(INVOICE_ROOT=self.invoice_root, BACKGROUND_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = get_user_model().objects.create_user(username='invoiced', password='testpass', email='i@example.com')
+        self.client.force_login(self.user)
+        product = Product.objects.create(name='Kettle', description='desc', price='1200.00', category='test')
+        variant = ProductVariant.objects.create(product=product, size='1L', color='Steel', stock=5)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=product, variant=variant, quantity=1)
+        self.order = place_order(self.user, cart, '1 Main St', '123', 'razorpay')
+        self.url = f'/orders/invoice/{self.order.order_id}/'
+
+    def pdfs(self):
+        return sorted(path.name for path in (invoices._root() / self.order.order_id).glob('*.pdf'))
+
+    def test_payment_prerenders_invoice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm_payment(self.order, 'pay_1')
+        self.assertEqual(len(self.pdfs()), 1)
+
+    def test_invoice_is_rendered_once_and_revalidated(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(resp.streaming_content).startswith(b'%PDF'))
+        etag = resp['ETag']
+
+        rendered = []
+        original = invoices.render
+        invoices.render = lambda order: rendered.append(order) or original(order)
+        self.addCleanup(setattr, invoices, 'render', original)
+        resp = self.client.get(self.url)
+        resp.close()
+        self.assertEqual((resp.status_code, resp['ETag'], rendered), (200, etag, []))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_status_change_renders_new_invoice(self):
+        first = self.client.get(self.url)
+        first.close()
+        Order.objects.filter(pk=self.order.pk).update(status='delivered')
+        second = self.client.get(self.url)
+        second.close()
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        # The stale rendering is gone
+        self.assertEqual(self.pdfs(), [f'{second["ETag"].strip(chr(34))}.pdf'])
+
+    def test_address_edit_renders_new_invoice(self):
+        first = self.client.get(self.url)
+        first.close()
+        Order.objects.filter(pk=self.order.pk).update(shipping_address='2 Side St', phone='456')
+        second = self.client.get(self.url)
+        second.close()
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_file_deleted_by_concurrent_render_is_found_again(self):
+        get_invoice = invoices.get_invoice
+        calls = []
+
+        def replaced_meanwhile(order):
+            path, order_digest = get_invoice(order)
+            if not calls:
+                path.unlink()
+            calls.append(path)
+            return path, order_digest
+
+        with mock.patch.object(invoices, 'get_invoice', side_effect=replaced_meanwhile):
+            resp = self.client.get(self.url)
+            self.assertTrue(b''.join(resp.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(len(calls), 2)
+
+
+class InvoiceExportTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        settings_override = override_settings(INVOICE_ROOT=os.path.join(self.tmpdir, 'invoices'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = get_user_model().objects.create_user(username='finance', password='testpass', email='f@example.com')
+        product = Product.objects.create(name='Chair', description='desc', price='2000.00', category='test')
+        self.orders = []
+        for i in range(4):
+            order = Order.objects.create(user=user, total_price='2000.00', shipping_address='1 Main St', phone='123',
+                                         status='delivered' if i else 'cancelled')
+            OrderItem.objects.create(order=order, product=product, quantity=1, price='2000.00')
+            self.orders.append(order)
+        # One order from last month
+        Order.objects.filter(pk=self.orders[3].pk).update(created_at=timezone.now() - timedelta(days=40))
+
+    def test_command_exports_date_range_and_status(self):
+        output = os.path.join(self.tmpdir, 'invoices.zip')
+        today = timezone.localdate()
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_invoices', output, '--from', str(today - timedelta(days=7)), '--to', str(today),
+                     '--status', 'delivered', '--workers', '1', stdout=out, stderr=err)
+
+        self.assertIn('Wrote 2 invoices', out.getvalue())
+        self.assertIn('2/2 invoices', err.getvalue())
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(
+                sorted(archive.namelist()),
+                sorted(f'invoice_{order.order_id}.pdf' for order in self.orders[1:3]),
+            )
+            self.assertTrue(archive.read(archive.namelist()[0]).startswith(b'%PDF'))
+
+    def test_admin_action_streams_zip(self):
+        admin_user = get_user_model().objects.create_superuser(username='admin', password='x', email='a@example.com')
+        self.client.force_login(admin_user)
+        resp = self.client.post('/admin/orders/order/', {
+            'action': 'export_invoices', '_selected_action': [order.pk for order in self.orders[:2]],
+        })
+        self.assertEqual(resp['Content-Type'], 'application/zip')
+        with mock.patch.object(exports, 'render_all', wraps=exports.render_all) as render_all:
+            content = b''.join(resp.streaming_content)
+        # Never forks a process pool from inside a web request
+        self.assertEqual(render_all.call_args.args[1], 1)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(len(archive.namelist()), 2)
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='regular', password='testpass', email='r@example.com')
+        self.client.force_login(self.user)
+        self.products = [
+            Product.objects.create(name=f'Item {i}', description='desc', price='10.00', category='test')
+            for i in range(6)
+        ]
+
+    def add_orders(self, count, lines):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, total_price='10.00', shipping_address='1 Main St', phone='123')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price='10.00') for product in self.products[:lines]
+            ])
+
+    def test_page_cost_is_constant(self):
+        self.add_orders(2, 1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/orders/')
+        self.add_orders(25, 6)
+        with CaptureQueriesContext(connection) as many:
+            resp = self.client.get('/orders/')
+        self.assertEqual(len(many), len(few))
+
+        page = resp.context['orders']
+        self.assertEqual((len(page), page.paginator.num_pages), (10, 3))
+        newest = page[0]
+        self.assertEqual((newest.item_count, len(newest.preview_items), newest.more_items), (6, 3, 3))
+        self.assertContains(resp, '+3 more')
+
+    def test_later_pages(self):
+        self.add_orders(12, 1)
+        resp = self.client.get('/orders/?page=2')
+        self.assertEqual(len(resp.context['orders']), 2)
+        self.assertEqual([order.more_items for order in resp.context['orders']], [0, 0])
+
+
+class OrderIdTests(TestCase):
+    def test_ids_increase_and_never_repeat(self):
+        made = [ids.new_order_id() for _ in range(5000)]
+        self.assertEqual(made, sorted(made))
+        self.assertEqual(len(set(made)), len(made))
+        self.assertRegex(made[0], r'^ORD-[0-9A-HJKMNP-TV-Z]{7}-[0-9A-HJKMNP-TV-Z]{7}$')
+
+    def test_decode_round_trip(self):
+        self.assertEqual(ids.decode(ids.encode(123456789, 42, 7)), (123456789, 42, 7))
+        # Lower case and Crockford look-alikes read back the same
+        order_id = ids.encode(1, 1, 0)
+        self.assertEqual(ids.decode(order_id.lower().replace('1', 'l')), (1, 1, 0))
+        self.assertLess(abs((ids.created_at(ids.new_order_id()) - timezone.now()).total_seconds()), 5)
+        with self.assertRaises(ValueError):
+            ids.decode('ORD-AB12CD34')
+
+    def test_legacy_ids(self):
+        created = timezone.now() - timedelta(days=30)
+        taken = set()
+        converted = [ids.for_legacy(created, taken) for _ in range(3)]
+        self.assertEqual(len(set(converted)), 3)
+        self.assertEqual([ids.decode(order_id)[1] for order_id in converted], [0, 0, 0])
+        self.assertLess(abs((ids.created_at(converted[0]) - created).total_seconds()), 1)
+
+    def test_old_links_still_resolve(self):
+        user = get_user_model().objects.create_user(username='regular', password='testpass')
+        self.client.force_login(user)
+        order = Order.objects.create(
+            user=user, total_price='10.00', shipping_address='1 Main St', phone='123', legacy_order_id='ORD-AB12CD34',
+        )
+        self.assertRegex(order.order_id, r'^ORD-\w{7}-\w{7}$')
+        self.assertEqual(self.client.get(f'/orders/detail/{order.order_id}/').status_code, 200)
+        self.assertEqual(self.client.get('/orders/detail/ORD-AB12CD34/').context['order'], order)
+
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser(username='ops', password='testpass', email='o@example.com')
+        self.product = Product.objects.create(name='Lamp', description='desc', price='40.00', category='test')
+        self.variant = ProductVariant.objects.create(product=self.product, size='One', color='White', stock=100)
+
+    def order(self, payment_method='cod'):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, variant=self.variant, quantity=2)
+        return place_order(self.user, cart, '1 Main St', '123', payment_method)
+
+    def orders(self, count, status):
+        orders = [self.order() for _ in range(count)]
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(status=status)
+        return orders
+
+    def test_bulk_ship_moves_only_processing_orders(self):
+        self.orders(3, 'processing')
+        self.orders(2, 'pending')
+        stats = transitions.bulk_transition(Order.objects.all(), 'shipped', actor=self.user, note='Manifest 7')
+
+        self.assertEqual((stats.moved, stats.skipped), (3, 2))
+        self.assertEqual(Order.objects.filter(status='shipped').count(), 3)
+        events = OrderEvent.objects.filter(to_status='shipped')
+        self.assertEqual(
+            set(events.values_list('from_status', 'actor', 'note')), {('processing', self.user.pk, 'Manifest 7')},
+        )
+
+    def test_bulk_cost_does_not_grow_with_orders(self):
+        self.orders(2, 'processing')
+        with CaptureQueriesContext(connection) as few:
+            transitions.bulk_transition(Order.objects.filter(status='processing'), 'shipped')
+        self.orders(20, 'processing')
+        with CaptureQueriesContext(connection) as many:
+            transitions.bulk_transition(Order.objects.filter(status='processing'), 'shipped')
+        self.assertEqual(len(many), len(few))
+
+    def test_invalid_transition(self):
+        order = self.orders(1, 'delivered')[0]
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.transition(order, 'cancelled')
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.bulk_transition([order.pk], 'pending')
+        self.assertEqual(order.status, 'delivered')
+        self.assertFalse(OrderEvent.objects.filter(to_status='cancelled').exists())
+
+    def test_bulk_cancel_restocks(self):
+        paid_cod, online = self.order(), self.order('razorpay')
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (98, 2))
+
+        stats = transitions.bulk_transition([paid_cod.pk, online.pk], 'cancelled')
+        self.assertEqual(stats.moved, 2)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (100, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_history_is_logged(self):
+        self.client.force_login(self.user)
+        order = self.order()
+        self.client.get(f'/orders/cancel/{order.order_id}/')
+        self.assertEqual(
+            list(order.events.values_list('from_status', 'to_status', 'actor')),
+            [('', 'pending', self.user.pk), ('pending', 'cancelled', self.user.pk)],
+        )
+        event = order.events.first()
+        event.note = 'edited'
+        with self.assertRaises(ValueError):
+            event.save()
+
+    def test_admin_action_and_command(self):
+        self.client.force_login(self.user)
+        first, second = self.orders(2, 'pending')
+        self.client.post('/admin/orders/order/', {
+            'action': 'mark_processing', '_selected_action': [first.pk, second.pk],
+        })
+        self.assertEqual(Order.objects.filter(status='processing').count(), 2)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as manifest:
+            manifest.write(f'{first.order_id}\n{second.order_id}\nORD-UNKNOWN\n')
+        self.addCleanup(os.unlink, manifest.name)
+        out = io.StringIO()
+        call_command('transition_orders', 'shipped', manifest.name, stdout=out)
+        self.assertIn('2 orders marked shipped', out.getvalue())
+        self.assertIn('1 unknown', out.getvalue())
@@ -0,0 +1,94 @@
+"""
+Order status changes.
+
+``TRANSITIONS`` says where each status may go next. Staff and customers
+move orders only through ``transition`` and ``bulk_transition``, which
+change the status with a conditional UPDATE (of two concurrent moves only
+one can win) and append an ``OrderEvent`` per order moved.
+
+Moving many orders costs a fixed handful of statements per batch, not per
+order: lock the batch, one UPDATE, one INSERT for the events and, when
+cancelling, one bulk restock. Orders whose status can't make the move are
+skipped and counted.
+"""
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .checkout import restock_orders
+from .models import Order, OrderEvent
+
+
+DEFAULT_BATCH_SIZE = 500
+
+TRANSITIONS = {
+    'pending': ('processing', 'cancelled'),
+    'processing': ('shipped', 'cancelled'),
+    'shipped': ('delivered',),
+    'delivered': (),
+    'cancelled': (),
+}
+
+
+@dataclass
+class TransitionStats:
+    moved: int = 0
+    skipped: int = 0
+    batches: int = 0
+
+
+class InvalidTransition(Exception):
+    def __init__(self, from_status, to_status):
+        self.from_status, self.to_status = from_status, to_status
+        super().__init__(f'Cannot move an order from {from_status} to {to_status}')
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def sources(to_status):
+    """Statuses an order can be moved to ``to_status`` from"""
+    return [status for status, targets in TRANSITIONS.items() if to_status in targets]
+
+
+def bulk_transition(orders, to_status, actor=None, note='', batch_size=DEFAULT_BATCH_SIZE):
+    """Move ``orders`` (a queryset or primary keys) to ``to_status``, a batch per transaction"""
+    from_statuses = sources(to_status)
+    if not from_statuses:
+        raise InvalidTransition('any status', to_status)
+    if isinstance(orders, QuerySet):
+        pks = list(orders.order_by('pk').values_list('pk', flat=True))
+    else:
+        pks = sorted(set(orders))
+
+    stats = TransitionStats()
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start:start + batch_size]
+        with transaction.atomic():
+            moved = list(
+                Order.objects.select_for_update().filter(pk__in=batch, status__in=from_statuses)
+                .order_by('pk').values_list('pk', 'status')
+            )
+            if moved:
+                moved_pks = [pk for pk, status in moved]
+                now = timezone.now()
+                Order.objects.filter(pk__in=moved_pks).update(status=to_status, updated_at=now)
+                OrderEvent.record(moved, to_status, actor=actor, note=note, created_at=now)
+                if to_status == 'cancelled':
+                    restock_orders(moved_pks)
+        stats.moved += len(moved)
+        stats.skipped += len(batch) - len(moved)
+        stats.batches += 1
+    return stats
+
+
+def transition(order, to_status, actor=None, note=''):
+    """Move one order, raising ``InvalidTransition`` if its status can't go to ``to_status``"""
+    moved = bulk_transition([order.pk], to_status, actor, note).moved
+    order.refresh_from_db(fields=['status', 'updated_at'])
+    if not moved:
+        raise InvalidTransition(order.status, to_status)
+    return order
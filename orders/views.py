@@ -1,40 +1,62 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.conf import settings
-from django.http import HttpResponse
+from django.core.paginator import Paginator
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Q, Subquery, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from . import invoices
+from .checkout import EmptyCart, OutOfStock, place_order
 from .models import Order, OrderItem
-from cart.models import Cart
-from products.models import ProductVariant
-import random
-import string
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from io import BytesIO
-from datetime import datetime
+from .transitions import InvalidTransition, transition
+from cart.loader import get_request_cart
 
 
-def generate_order_id():
-    """Generate unique order ID"""
-    random_str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-    return f"ORD-{random_str}"
+def _get_user_order(request, order_id, queryset=Order.objects):
+    """The requester's order by its ID, or by the ID it had before time-ordered IDs"""
+    return get_object_or_404(queryset, Q(order_id=order_id) | Q(legacy_order_id=order_id), user=request.user)
+
+
+ORDERS_PER_PAGE = 10
+
+# Item thumbnails shown per order in the history list
+PREVIEW_ITEMS = 3
 
 
 @login_required
 def order_history(request):
     """View order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'order_history.html', {'orders': orders})
+    item_count = Subquery(
+        OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        .annotate(count=Count('pk')).values('count'),
+        output_field=IntegerField(),
+    )
+    orders = (
+        Order.objects.filter(user=request.user)
+        .only('id', 'order_id', 'created_at', 'status', 'payment_status', 'total_price')
+        .annotate(item_count=Coalesce(item_count, 0))
+        .order_by('-created_at', '-id')
+    )
+    page = Paginator(orders, ORDERS_PER_PAGE).get_page(request.GET.get('page'))
+
+    # First few lines of every order on the page, with their products, in one query
+    preview = (
+        OrderItem.objects.select_related('product')
+        .only('id', 'order_id', 'product__id', 'product__name', 'product__image', 'product__image_renditions')
+        .order_by('pk')
+    )
+    prefetch_related_objects(page.object_list, Prefetch('items', queryset=preview[:PREVIEW_ITEMS], to_attr='preview_items'))
+    for order in page:
+        order.more_items = order.item_count - len(order.preview_items)
+    return render(request, 'order_history.html', {'orders': page})
 
 
 @login_required
 def order_detail(request, order_id):
     """View order detail"""
-    order = get_object_or_404(Order, order_id=order_id, user=request.user)
+    order = _get_user_order(request, order_id)
     return render(request, 'order_detail.html', {'order': order})
 
 
@@ -42,9 +64,9 @@ def order_detail(request, order_id):
 def create_order(request):
     """Create order from cart"""
     if request.method == 'POST':
-        cart = Cart.objects.filter(user=request.user).first()
+        cart = get_request_cart(request)
 
-        if not cart or not cart.items.exists():
+        if not cart:
             messages.error(request, "Your cart is empty")
             return redirect('cart')
 
@@ -57,54 +79,21 @@ def create_order(request):
             messages.error(request, "Please provide shipping address")
             return redirect('checkout')
 
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            order_id=generate_order_id(),
-            total_price=cart.get_total(),
-            shipping_address=shipping_address,
-            phone=phone,
-            status='pending',
-            payment_method=payment_method
-        )
-
-        # Create order items
-        for cart_item in cart.items.all():
-            price = cart_item.variant.product.price if cart_item.variant else cart_item.product.price
-
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                variant=cart_item.variant,
-                quantity=cart_item.quantity,
-                price=price
-            )
-
-            # Update stock
-            if cart_item.variant:
-                cart_item.variant.stock -= cart_item.quantity
-                cart_item.variant.save()
-
-        # Clear cart
-        cart.items.all().delete()
+        # Create order, take stock and clear cart in one transaction
+        try:
+            order = place_order(request.user, cart.cart, shipping_address, phone, payment_method)
+        except EmptyCart:
+            messages.error(request, "Your cart is empty")
+            return redirect('cart')
+        except OutOfStock as exc:
+            messages.error(request, str(exc))
+            return redirect('cart')
+        finally:
+            cart.invalidate()
 
         # Handle payment based on method
         if payment_method == 'cod':
-            order.payment_status = 'pending'
-            order.save()
-            
-            # Send confirmation email
-            try:
-                send_mail(
-                    f'Order Confirmation - {order.order_id}',
-                    f'Thank you for your order! Your order ID is {order.order_id}.\n\nTotal: ₹{order.total_price}\n\nPayment Method: Cash on Delivery',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [request.user.email],
-                    fail_silently=True,
-                )
-            except:
-                pass
-
+            # The confirmation email was queued with the order
             messages.success(request, f"Order placed successfully! Order ID: {order.order_id}")
             return redirect('order_detail', order_id=order.order_id)
         
@@ -122,128 +111,34 @@ def create_order(request):
 @login_required
 def cancel_order(request, order_id):
     """Cancel order"""
-    order = get_object_or_404(Order, order_id=order_id, user=request.user)
-
-    if order.status in ['pending', 'processing']:
-        # Restore stock
-        for item in order.items.all():
-            if item.variant:
-                item.variant.stock += item.quantity
-                item.variant.save()
+    order = _get_user_order(request, order_id)
 
-        order.status = 'cancelled'
-        order.save()
-        messages.success(request, "Order cancelled successfully")
-    else:
+    # Of two concurrent cancels only one moves the order and restores the stock
+    try:
+        transition(order, 'cancelled', actor=request.user, note='Cancelled by customer')
+    except InvalidTransition:
         messages.error(request, "Cannot cancel this order")
+    else:
+        messages.success(request, "Order cancelled successfully")
 
     return redirect('order_history')
 
 
 @login_required
 def download_invoice(request, order_id):
-    """Generate and download PDF invoice"""
-    order = get_object_or_404(Order, order_id=order_id, user=request.user)
-
-    # Create PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-
-    # Get styles
-    styles = getSampleStyleSheet()
-    title_style = styles['Title']
-    heading_style = styles['Heading2']
-    normal_style = styles['Normal']
-
-    # Create custom styles
-    subtitle_style = ParagraphStyle(
-        'Subtitle',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.gray
-    )
-
-    # Build content
-    content = []
-
-    # Company Header
-    content.append(Paragraph("Pari kart - Invoice", title_style))
-    content.append(Paragraph("123 E-Commerce Street, Online City, India", subtitle_style))
-    content.append(Paragraph("Phone: +91 9876543210 | Email: support@parikart.com", subtitle_style))
-    content.append(Spacer(1, 20))
-
-    # Invoice Details
-    content.append(Paragraph(f"<b>Invoice Number:</b> {order.order_id}", normal_style))
-    content.append(Paragraph(f"<b>Date:</b> {order.created_at.strftime('%d-%m-%Y %H:%M')}", normal_style))
-    content.append(Paragraph(f"<b>Status:</b> {order.get_status_display()}", normal_style))
-    content.append(Spacer(1, 20))
-
-    # Customer Details
-    content.append(Paragraph("<b>Bill To:</b>", heading_style))
-    content.append(Paragraph(f"{request.user.get_full_name() or request.user.username}", normal_style))
-    content.append(Paragraph(f"Email: {request.user.email}", normal_style))
-    content.append(Paragraph(f"Phone: {order.phone}", normal_style))
-    content.append(Paragraph(f"Address: {order.shipping_address}", normal_style))
-    content.append(Spacer(1, 20))
-
-    # Items Table
-    table_data = [['Item', 'Variant', 'Qty', 'Price', 'Total']]
-
-    for item in order.items.all():
-        variant_info = f"{item.variant.size} / {item.variant.color}" if item.variant else "-"
-        table_data.append([
-            item.product.name,
-            variant_info,
-            str(item.quantity),
-            f"₹{item.price}",
-            f"₹{item.get_total()}"
-        ])
-
-    # Add totals
-    table_data.append(['', '', '', 'Subtotal:', f"₹{order.total_price}"])
-    table_data.append(['', '', '', 'Shipping:', 'Free'])
-    table_data.append(['', '', '', 'Total:', f"₹{order.total_price}"])
-
-    # Create table
-    table = Table(table_data, colWidths=[2*inch, 1.5*inch, 0.5*inch, 1*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -3), colors.beige),
-        ('TEXTCOLOR', (0, 1), (-1, -3), colors.black),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-
-    content.append(table)
-    content.append(Spacer(1, 30))
-
-    # Payment Details
-    content.append(Paragraph("<b>Payment Details:</b>", heading_style))
-    content.append(Paragraph(f"Payment ID: {order.payment_id or 'Pending'}", normal_style))
-    content.append(Paragraph(f"Payment Status: {order.payment_status}", normal_style))
-    content.append(Paragraph(f"Payment Method: {order.payment_method.title() if order.payment_method else 'COD'}", normal_style))
-    content.append(Spacer(1, 20))
-
-    # Footer
-    content.append(Paragraph("<b>Terms & Conditions:</b>", heading_style))
-    content.append(Paragraph("1. This is a computer-generated invoice.", normal_style))
-    content.append(Paragraph("2. Goods once sold cannot be returned.", normal_style))
-    content.append(Paragraph("3. Please contact support for any queries.", normal_style))
-    content.append(Spacer(1, 30))
-    content.append(Paragraph("Thank you for shopping with us!", normal_style))
-
-    # Build PDF
-    doc.build(content)
-
-    # Get PDF content
-    buffer.seek(0)
-    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="invoice_{order.order_id}.pdf"'
-
+    """Download the PDF invoice (rendered once, then served from disk)"""
+    order = _get_user_order(request, order_id, Order.objects.select_related('user'))
+    # Opened straight away: a concurrent rendering may delete the file
+    invoice, etag = invoices.open_invoice(order)
+
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        response = FileResponse(
+            invoice, as_attachment=True, filename=f'invoice_{order.order_id}.pdf',
+            content_type='application/pdf',
+        )
+        response['ETag'] = quote_etag(etag)
+    else:
+        invoice.close()
+    patch_cache_control(response, private=True, no_cache=True)
     return response
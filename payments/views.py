@@ -4,10 +4,11 @@ from django.contrib import messages
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse, HttpResponse
-from django.core.mail import send_mail
 import razorpay
 import stripe
+from orders.checkout import confirm_payment
 from orders.models import Order
+from cart.loader import get_request_cart
 from cart.models import Cart
 from django.urls import reverse
 import qrcode
@@ -33,14 +34,19 @@ except Exception as e:
 # Initialize Stripe
 stripe.api_key = settings.STRIPE_SECRET_KEY if hasattr(settings, 'STRIPE_SECRET_KEY') else None
 
+REFUND_DUE_MESSAGE = (
+    "Your payment arrived after the items were released and they have since sold out. "
+    "The order has been cancelled and your payment will be refunded."
+)
+
 
 @login_required
 def checkout(request, order_id=None):
     """Checkout page with payment options"""
-    # Get user's cart
-    cart = Cart.objects.filter(user=request.user).first()
+    # Get user's cart (loaded once with its totals)
+    cart = get_request_cart(request)
     
-    if not cart or not cart.items.exists():
+    if not cart:
         messages.error(request, "Your cart is empty")
         return redirect('cart')
 
@@ -58,10 +64,10 @@ def checkout(request, order_id=None):
 
     context = {
         'order': order,
-        'cart': cart,
-        'cart_items': cart.items.all(),
-        'total': cart.get_total(),
-        'total_items': cart.get_item_count(),
+        'cart': cart.cart,
+        'cart_items': cart.items(),
+        'total': cart.total,
+        'total_items': cart.item_count,
         'razorpay_key': settings.RAZORPAY_KEY_ID if razorpay_client else None,
     }
     return render(request, 'checkout.html', context)
@@ -162,32 +168,16 @@ def razorpay_callback(request):
                     'razorpay_signature': signature
                 })
 
-            # Update order
-            order = Order.objects.get(razorpay_order_id=order_id)
-            order.payment_id = payment_id
-            order.payment_status = 'completed'
-            order.status = 'processing'
-            order.save()
+            # Update order and turn its stock hold into a sale
+            order = confirm_payment(Order.objects.get(razorpay_order_id=order_id), payment_id)
+            if order.payment_status == 'refund_due':
+                messages.error(request, REFUND_DUE_MESSAGE)
+                return redirect('order_detail', order_id=order.order_id)
 
             # Clear cart
             user_cart = Cart.objects.filter(user=order.user).first()
             if user_cart:
-                user_cart.items.all().delete()
-
-            # Send confirmation email
-            try:
-                send_mail(
-                    f'Payment Successful - Order {order.order_id}',
-                    f'Your payment of ₹{order.total_price} has been successful!\n\n'
-                    f'Order ID: {order.order_id}\n'
-                    f'Payment ID: {payment_id}\n\n'
-                    f'Thank you for shopping with us!',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [order.user.email],
-                    fail_silently=True,
-                )
-            except:
-                pass
+                user_cart.clear()
 
             messages.success(request, "Payment successful! Order placed successfully.")
             return redirect('order_detail', order_id=order.order_id)
@@ -253,30 +243,15 @@ def stripe_success(request):
         session = stripe.checkout.Session.retrieve(session_id)
         
         if session.payment_status == 'paid':
-            order = Order.objects.get(id=order_id, user=request.user)
-            order.payment_id = session.payment_intent
-            order.payment_status = 'completed'
-            order.status = 'processing'
-            order.save()
+            order = confirm_payment(Order.objects.get(id=order_id, user=request.user), session.payment_intent)
+            if order.payment_status == 'refund_due':
+                messages.error(request, REFUND_DUE_MESSAGE)
+                return redirect('order_detail', order_id=order.order_id)
             
             # Clear cart
             user_cart = Cart.objects.filter(user=request.user).first()
             if user_cart:
-                user_cart.items.all().delete()
-            
-            # Send confirmation email
-            try:
-                send_mail(
-                    f'Payment Successful - Order {order.order_id}',
-                    f'Your payment of ₹{order.total_price} has been successful!\n\n'
-                    f'Order ID: {order.order_id}\n'
-                    f'Thank you for shopping with us!',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [request.user.email],
-                    fail_silently=True,
-                )
-            except:
-                pass
+                user_cart.clear()
             
             messages.success(request, "Payment successful! Order placed successfully.")
             return redirect('order_detail', order_id=order.order_id)
@@ -9,10 +9,11 @@ class ProductVariantInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'category')
+    list_display = ('name', 'sku', 'price', 'category')
+    search_fields = ('name', 'sku')
     inlines = [ProductVariantInline]
 
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
-    list_display = ('product', 'size', 'color', 'stock')
\ No newline at end of file
+    list_display = ('product', 'size', 'color', 'stock', 'reserved')
\ No newline at end of file
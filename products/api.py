@@ -1,8 +1,23 @@
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from . import cache as catalog_cache
+from .facets import facet_counts, filter_products, selected_facets
+from .listing import with_variants
 from .models import Product, ProductVariant
+from .pagination import ProductCursorPagination
+from .renditions import fallback_url, srcsets
+from .search import search_products
 
 
 class ProductVariantSerializer(serializers.ModelSerializer):
+    # What can still be bought, net of units held for pending payments
+    stock = serializers.IntegerField(source='available', read_only=True)
+
     class Meta:
         model = ProductVariant
         fields = ['id', 'size', 'color', 'stock']
@@ -10,28 +25,62 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     variants = ProductVariantSerializer(many=True, read_only=True)
+    image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'category', 'image', 'variants']
+        fields = ['id', 'name', 'description', 'price', 'category', 'image', 'image_srcset', 'variants']
+    
+    def get_image_srcset(self, product):
+        """Fallback ``src`` plus a ``srcset`` per format, or None without an image"""
+        src = fallback_url(product, 480)
+        if src is None:
+            return None
+        request = self.context.get('request')
+        build_url = request.build_absolute_uri if request else None
+        return {
+            'src': build_url(src) if build_url else src,
+            'srcset': srcsets(product, build_url),
+        }
+
+
+def _conditional(scopes):
+    """
+    ETag / Last-Modified from catalog versions for a read-only action.
+
+    Matching requests get 304 before the queryset is evaluated or the
+    serializer runs. The validators cover the full URL and the negotiated
+    format, so JSON and the browsable API never share an ETag.
+    """
+    def decorator(action):
+        @wraps(action)
+        def wrapper(self, request, *args, **kwargs):
+            etag, last_modified = catalog_cache.validators(
+                scopes(**kwargs), request.build_absolute_uri(), request.accepted_renderer.format,
+            )
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = action(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Accept',))
+            return response
+        return wrapper
+    return decorator
 
 
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     
     def get_queryset(self):
-        queryset = Product.objects.all()
-        
-        # Search
-        search = self.request.query_params.get('search')
-        if search:
-            queryset = queryset.filter(name__icontains=search)
+        queryset = with_variants(self._search_results())
         
-        # Category filter
-        category = self.request.query_params.get('category')
-        if category:
-            queryset = queryset.filter(category__iexact=category)
+        # Category / size / color / price band filters
+        queryset = filter_products(queryset, selected_facets(self.request.query_params))
         
         # Price filter
         min_price = self.request.query_params.get('min_price')
@@ -42,3 +91,25 @@ class ProductViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(price__lte=max_price)
         
         return queryset
+    
+    @_conditional(lambda **kwargs: [catalog_cache.ALL_SCOPE])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @_conditional(lambda pk, **kwargs: [catalog_cache.product_scope(pk)])
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    def _search_results(self):
+        queryset = Product.objects.all()
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = search_products(queryset, search)
+        return queryset
+    
+    @action(detail=False)
+    @_conditional(lambda **kwargs: [catalog_cache.ALL_SCOPE])
+    def facets(self, request):
+        """Facet counts for the current search and filter parameters"""
+        search_results = self._search_results() if request.query_params.get('search') else None
+        return Response(facet_counts(selected_facets(request.query_params), search_results))
@@ -0,0 +1,246 @@
+"""
+Versioned catalog cache.
+
+Cached values are keyed by the current version of every scope they depend
+on (``all``, ``category:<name>``, ``product:<id>``). Changing a product
+bumps its scopes in ``products.signals``, so stale entries are never read
+again and simply age out; nothing has to be deleted.
+
+The backend is whichever Django cache ``CATALOG_CACHE_ALIAS`` names:
+local memory or the file-based cache in development and tests, a shared
+cache (Redis/Memcached) in production. With several workers on local
+memory a bump only reaches the worker that made it, so there version keys
+expire after ``CATALOG_LOCAL_VERSION_TIMEOUT`` seconds to bound how long
+the others serve stale data (``check --deploy`` warns about this setup).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import quote_etag
+
+from ecommerce.caches import is_process_local
+
+from . import related
+from .models import AVAILABLE, Product
+
+
+KEY_PREFIX = 'catalog'
+
+# How long a rebuilding caller holds the stampede lock, and how long
+# others wait for its result before building it themselves.
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 5
+LOCK_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+def get_cache():
+    return caches[_alias()]
+
+
+def _alias():
+    return getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+
+
+def _version_timeout():
+    """None (keep forever) on a shared cache; bounded on a per-process one"""
+    if is_process_local(_alias()):
+        return getattr(settings, 'CATALOG_LOCAL_VERSION_TIMEOUT', 60)
+    return None
+
+
+def _scope_key(scope):
+    return f'{KEY_PREFIX}:version:{scope}'
+
+
+def category_scope(category):
+    return f'category:{category.lower()}'
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+ALL_SCOPE = 'all'
+
+
+def _initial_version():
+    # Versions restart from the clock after an eviction so a re-created
+    # version key can never collide with one that was used before.
+    return int(time.time() * 1000)
+
+
+def get_versions(scopes):
+    """Current version for each scope, initialising missing ones"""
+    cache = get_cache()
+    keys = [_scope_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    timeout = _version_timeout()
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            cache.add(key, _initial_version(), timeout)
+            version = cache.get(key)
+        versions.append(version)
+    return versions
+
+
+def bump(*scopes):
+    """Invalidate everything cached under ``scopes``"""
+    cache = get_cache()
+    now = time.time()
+    timeout = _version_timeout()
+    for scope in scopes:
+        key = _scope_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), timeout)
+        cache.set(f'{KEY_PREFIX}:modified:{scope}', now, None)
+
+
+def bump_variants(variant_ids):
+    """Invalidate pages showing these variants, after writes that skip the model signals"""
+    scopes = {ALL_SCOPE}
+    for product_id, category in Product.objects.filter(variants__in=variant_ids).values_list('pk', 'category').distinct():
+        scopes.update((product_scope(product_id), category_scope(category)))
+    bump(*scopes)
+
+
+def last_modified(scopes):
+    """Unix time of the most recent bump across ``scopes`` (or None)"""
+    cache = get_cache()
+    stamps = cache.get_many([f'{KEY_PREFIX}:modified:{scope}' for scope in scopes])
+    return max(stamps.values()) if stamps else None
+
+
+def validators(scopes, *parts):
+    """
+    ``(etag, last_modified)`` for a response built from ``scopes``.
+
+    Both come from the version counters alone, so conditional requests can
+    be answered before any of the response is built. ``parts`` must identify
+    everything else the response varies on (path, query, format...).
+    """
+    versions = get_versions(scopes)
+    etag = quote_etag(hashlib.sha1(repr((parts, versions)).encode()).hexdigest())
+    modified = last_modified(scopes)
+    return etag, int(modified) if modified else None
+
+
+def make_key(name, scopes, *parts):
+    versions = get_versions(scopes)
+    digest = hashlib.sha1(repr((versions, parts)).encode()).hexdigest()
+    return f'{KEY_PREFIX}:{name}:{digest}'
+
+
+def get_or_build(name, scopes, builder, *parts, timeout=None):
+    """
+    Return the cached value for ``name``/``parts`` at the current scope
+    versions, calling ``builder()`` on a miss.
+
+    Only one caller rebuilds a missing entry; concurrent callers wait up to
+    ``LOCK_WAIT`` seconds for it instead of all hitting the database.
+    """
+    cache = get_cache()
+    key = make_key(name, scopes, *parts)
+    if timeout is None:
+        timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 3600)
+
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count('hits')
+        return value
+    _count('misses')
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = builder()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+    # The builder holding the lock is taking too long; don't queue behind it
+    _count('lock_timeouts')
+    return builder()
+
+
+def _count(counter):
+    cache = get_cache()
+    key = f'{KEY_PREFIX}:stats:{counter}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats():
+    cache = get_cache()
+    counters = ('hits', 'misses', 'lock_timeouts')
+    found = cache.get_many([f'{KEY_PREFIX}:stats:{counter}' for counter in counters])
+    result = {counter: found.get(f'{KEY_PREFIX}:stats:{counter}', 0) for counter in counters}
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = result['hits'] / lookups if lookups else 0.0
+    return result
+
+
+def reset_stats():
+    get_cache().delete_many([f'{KEY_PREFIX}:stats:{counter}' for counter in ('hits', 'misses', 'lock_timeouts')])
+
+
+# ---------------------------------------------------------------------------
+# Cached catalog reads
+# ---------------------------------------------------------------------------
+
+def product_detail(product_id):
+    """Product with its variants, sizes and colours, or None if it doesn't exist"""
+    def build():
+        product = Product.objects.defer('search_vector').filter(pk=product_id).first()
+        if product is None:
+            return None
+        # Plain dicts: cheap to pickle and handed to the page's JS via json_script
+        # ``stock`` is what can still be sold (less reserved units)
+        variants = [
+            {'id': pk, 'size': size, 'color': color, 'stock': available}
+            for pk, size, color, available in product.variants.order_by('id').annotate(
+                available=AVAILABLE,
+            ).values_list('id', 'size', 'color', 'available')
+        ]
+        return {
+            'product': product,
+            'variants': variants,
+            'sizes': list(dict.fromkeys(variant['size'] for variant in variants)),
+            'colors': list(dict.fromkeys(variant['color'] for variant in variants)),
+        }
+
+    return get_or_build('product_detail', [product_scope(product_id)], build, product_id)
+
+
+def related_products(product, limit=4):
+    """Precomputed neighbours, or same-category products until the first rebuild"""
+    def build():
+        neighbours = related.related_products(product, limit)
+        if neighbours:
+            return neighbours
+        return list(
+            Product.objects.filter(category=product.category)
+            .exclude(id=product.id)
+            .defer('description', 'search_vector')[:limit]
+        )
+
+    scopes = [product_scope(product.id), category_scope(product.category)]
+    return get_or_build('related', scopes, build, product.id, limit)
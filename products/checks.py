@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from ecommerce.caches import is_process_local
+
+
+@register(Tags.caches, deploy=True)
+def check_catalog_cache(app_configs, **kwargs):
+    alias = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+    if settings.DEBUG or not is_process_local(alias):
+        return []
+    return [Warning(
+        f'The catalog cache ({alias!r}) is local to each process.',
+        hint=(
+            'Catalog changes only reach the worker that made them; the others serve stale pages for up to '
+            'CATALOG_LOCAL_VERSION_TIMEOUT seconds. Set CATALOG_CACHE_BACKEND to a shared cache such as '
+            'django.core.cache.backends.redis.RedisCache.'
+        ),
+        id='products.W001',
+    )]
@@ -0,0 +1,252 @@
+"""
+Faceted navigation counts.
+
+Every facet value keeps a bitmap of the product ids that carry it (a plain
+Python int used as a bitset). Counting a facet under the current filters is
+then a handful of ANDs and popcounts instead of GROUP BYs over the product
+and variant tables. The bitmaps are built lazily, updated incrementally from
+``products.signals`` and rebuilt after ``FACET_INDEX_TTL`` seconds so other
+worker processes converge on changes they did not see.
+"""
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+from .models import Product, ProductVariant
+
+
+# (slug, label, lower bound inclusive, upper bound exclusive)
+PRICE_BANDS = (
+    ('under-500', 'Under ₹500', None, Decimal('500')),
+    ('500-1000', '₹500 - ₹1000', Decimal('500'), Decimal('1000')),
+    ('1000-2000', '₹1000 - ₹2000', Decimal('1000'), Decimal('2000')),
+    ('above-2000', 'Above ₹2000', Decimal('2000'), None),
+)
+PRICE_BAND_BOUNDS = {slug: (low, high) for slug, label, low, high in PRICE_BANDS}
+
+# Facet names double as query parameters; listed in display order
+FACETS = ('category', 'price', 'size', 'color')
+
+
+def price_band(price):
+    for slug, label, low, high in PRICE_BANDS:
+        if (low is None or price >= low) and (high is None or price < high):
+            return slug
+    return None
+
+
+def selected_facets(params):
+    """Facet selections present in a QueryDict / query_params"""
+    selected = {}
+    for facet in FACETS:
+        value = (params.get(facet) or '').strip()
+        # Unknown price bands are dropped so neither the listing nor the
+        # counts filter on them
+        if value and (facet != 'price' or value in PRICE_BAND_BOUNDS):
+            selected[facet] = value.lower() if facet == 'category' else value
+    return selected
+
+
+def filter_products(queryset, selected):
+    """Apply facet selections to a product queryset"""
+    if 'category' in selected:
+        queryset = queryset.filter(category__iexact=selected['category'])
+    if 'price' in selected:
+        low, high = PRICE_BAND_BOUNDS[selected['price']]
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+    # Size and colour are matched independently, the same way the bitmaps
+    # count them, so listing totals and facet counts always agree.
+    for facet in ('size', 'color'):
+        if facet in selected:
+            queryset = queryset.filter(
+                Exists(ProductVariant.objects.filter(product=OuterRef('pk'), **{facet: selected[facet]}))
+            )
+    return queryset
+
+
+def to_bits(product_ids):
+    """Bitset with bit ``pk`` set for every id; built in one allocation"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    buffer = bytearray(max(product_ids) // 8 + 1)
+    for pk in product_ids:
+        buffer[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class FacetIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._all = 0
+        self._bits = {facet: defaultdict(int) for facet in FACETS}
+        self._labels = {facet: {} for facet in FACETS}
+        self._products = {}
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._all = 0
+            for facet in FACETS:
+                self._bits[facet].clear()
+                self._labels[facet].clear()
+            self._products.clear()
+
+    def ensure_loaded(self):
+        ttl = getattr(settings, 'FACET_INDEX_TTL', 300)
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < ttl:
+            return
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < ttl:
+                return
+            self.clear()
+            variants = defaultdict(list)
+            rows = ProductVariant.objects.values_list('product_id', 'size', 'color').distinct()
+            for product_id, size, color in rows.iterator():
+                variants[product_id].append((size, color))
+
+            # Collect member ids first; OR-ing bit by bit into growing ints
+            # would copy every bitmap once per product.
+            members = {facet: defaultdict(list) for facet in FACETS}
+            all_ids = []
+            for pk, category, price in Product.objects.values_list('pk', 'category', 'price').iterator():
+                values = self._facet_values(category, price, variants.get(pk, ()))
+                self._remember(pk, category, values)
+                all_ids.append(pk)
+                for facet, keys in values.items():
+                    for key in keys:
+                        members[facet][key].append(pk)
+
+            self._all = to_bits(all_ids)
+            for facet in FACETS:
+                for key, ids in members[facet].items():
+                    self._bits[facet][key] = to_bits(ids)
+            self._loaded_at = time.monotonic()
+
+    def refresh_product(self, product_id):
+        """Re-read one product and its variants after a change"""
+        if self._loaded_at is None:
+            return
+        product = Product.objects.filter(pk=product_id).values_list('category', 'price').first()
+        variants = []
+        if product is not None:
+            variants = list(ProductVariant.objects.filter(product_id=product_id).values_list('size', 'color'))
+        with self._lock:
+            self._remove(product_id)
+            if product is not None:
+                self._add(product_id, product[0], product[1], variants)
+
+    def counts(self, selected, candidates=None):
+        """
+        Counts for every facet value under ``selected``.
+
+        Each facet is counted with the *other* facets' selections applied,
+        so picking a size still shows how many products every other size
+        has. ``candidates`` restricts the universe (e.g. search hits).
+        """
+        self.ensure_loaded()
+        with self._lock:
+            universe = self._all if candidates is None else self._all & candidates
+            masks = {
+                facet: self._bits[facet].get(self._key(facet, value), 0)
+                for facet, value in selected.items()
+            }
+
+            result = {}
+            for facet in FACETS:
+                base = universe
+                for other, mask in masks.items():
+                    if other != facet:
+                        base &= mask
+                options = []
+                for key, bits in self._bits[facet].items():
+                    count = (base & bits).bit_count()
+                    if count:
+                        options.append({
+                            'value': key,
+                            'label': self._labels[facet][key],
+                            'count': count,
+                            'selected': self._key(facet, selected.get(facet, '')) == key,
+                        })
+                result[facet] = self._sorted(facet, options)
+
+            total = universe
+            for mask in masks.values():
+                total &= mask
+            result['total'] = total.bit_count()
+        return result
+
+    @staticmethod
+    def _key(facet, value):
+        return value.lower() if facet == 'category' else value
+
+    @staticmethod
+    def _sorted(facet, options):
+        if facet == 'price':
+            order = {slug: i for i, (slug, *rest) in enumerate(PRICE_BANDS)}
+            return sorted(options, key=lambda option: order[option['value']])
+        return sorted(options, key=lambda option: option['label'].lower())
+
+    @staticmethod
+    def _facet_values(category, price, variants):
+        return {
+            'category': {category.lower()},
+            'price': {price_band(price)},
+            'size': {size for size, color in variants},
+            'color': {color for size, color in variants},
+        }
+
+    def _remember(self, pk, category, values):
+        self._labels['category'].setdefault(category.lower(), category)
+        self._labels['price'].update({slug: label for slug, label, low, high in PRICE_BANDS})
+        for facet in ('size', 'color'):
+            for key in values[facet]:
+                self._labels[facet].setdefault(key, key)
+        self._products[pk] = values
+
+    def _add(self, pk, category, price, variants):
+        values = self._facet_values(category, price, variants)
+        self._remember(pk, category, values)
+        bit = 1 << pk
+        self._all |= bit
+        for facet, keys in values.items():
+            for key in keys:
+                self._bits[facet][key] |= bit
+
+    def _remove(self, pk):
+        values = self._products.pop(pk, None)
+        if values is None:
+            return
+        bit = 1 << pk
+        self._all &= ~bit
+        for facet, keys in values.items():
+            for key in keys:
+                remaining = self._bits[facet][key] & ~bit
+                if remaining:
+                    self._bits[facet][key] = remaining
+                else:
+                    del self._bits[facet][key]
+                    self._labels[facet].pop(key, None)
+
+
+_index = FacetIndex()
+
+
+def get_index():
+    return _index
+
+
+def facet_counts(selected, search_results=None):
+    """Facet counts for a filter state; ``search_results`` is a product queryset"""
+    candidates = None
+    if search_results is not None:
+        candidates = to_bits(search_results.order_by().values_list('pk', flat=True))
+    return get_index().counts(selected, candidates)
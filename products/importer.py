@@ -0,0 +1,258 @@
+"""
+Bulk catalog import.
+
+Input is one row per variant (CSV with a header, or JSON Lines) with the
+columns in ``COLUMNS``. Rows are streamed and applied in batches: products
+are upserted on ``sku`` and variants on ``(product, size, color)`` with
+``bulk_create``/``bulk_update``, one transaction per batch, so memory use
+depends on the batch size and not on the file.
+
+Bulk writes skip model signals, so each batch refreshes what
+``products.signals`` would have: search vectors, related-products dirty
+flags and catalog cache versions. In-process indexes are reset at the end.
+"""
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+
+from . import cache as catalog_cache
+from . import facets, related, search
+from .models import Product, ProductVariant
+from .signals import catalog_bulk_updated
+
+
+PRODUCT_FIELDS = ('name', 'description', 'price', 'category', 'image')
+COLUMNS = ('sku',) + PRODUCT_FIELDS + ('size', 'color', 'stock')
+REQUIRED = ('sku', 'name', 'price', 'category', 'size', 'color', 'stock')
+
+DEFAULT_BATCH_SIZE = 2000
+
+# The model field each column lands in, for its length, digit and range limits
+FIELDS = {
+    column: (ProductVariant if column in ('size', 'color', 'stock') else Product)._meta.get_field(column)
+    for column in COLUMNS
+}
+# IntegerField's portable range: SQLite would take more, PostgreSQL won't
+MAX_STOCK = BaseDatabaseOperations.integer_field_ranges['IntegerField'][1]
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    skipped: int = 0
+    products_created: int = 0
+    products_updated: int = 0
+    variants_created: int = 0
+    variants_updated: int = 0
+    errors: list = field(default_factory=list)
+
+
+def read_rows(path, format=None):
+    """
+    Yield ``(line number, row)`` from a CSV or JSONL file, lazily. JSONL
+    rows are the raw lines; ``clean_row`` parses them, so one malformed line
+    is skipped like any other invalid row.
+    """
+    format = format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if format == 'jsonl':
+            for line_number, line in enumerate(handle, 1):
+                if line.strip():
+                    yield line_number, line
+        else:
+            # Header is line 1
+            for line_number, row in enumerate(csv.DictReader(handle), 2):
+                yield line_number, row
+
+
+def _parse(row):
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError as exc:
+            raise InvalidRow(f'invalid JSON: {exc.msg}')
+    if not isinstance(row, dict):
+        raise InvalidRow(f'expected an object, got {type(row).__name__}')
+    return row
+
+
+def clean_row(row):
+    """Validate and normalise one input row (a dict, or a JSON line)"""
+    row = _parse(row)
+    missing = [column for column in REQUIRED if not str(row.get(column) or '').strip()]
+    if missing:
+        raise InvalidRow(f'missing {", ".join(missing)}')
+    cleaned = {column: str(row.get(column) or '').strip() for column in COLUMNS}
+    try:
+        price = Decimal(cleaned['price'])
+        # NaN and Infinity parse (and NaN even quantizes) without complaint
+        if not price.is_finite() or price < 0:
+            raise InvalidOperation
+        cleaned['price'] = price.quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise InvalidRow(f'invalid price {cleaned["price"]!r}')
+    try:
+        cleaned['stock'] = int(cleaned['stock'])
+        if not 0 <= cleaned['stock'] <= MAX_STOCK:
+            raise ValueError
+    except ValueError:
+        raise InvalidRow(f'invalid stock {cleaned["stock"]!r}')
+
+    # What the database would reject would abort the whole batch
+    for column, field in FIELDS.items():
+        value = cleaned[column]
+        if field.max_length and len(value) > field.max_length:
+            raise InvalidRow(f'{column} longer than {field.max_length} characters')
+    try:
+        # max_digits and decimal_places
+        FIELDS['price'].run_validators(cleaned['price'])
+    except ValidationError as exc:
+        raise InvalidRow(f'invalid price {str(cleaned["price"])!r}: {" ".join(exc.messages)}')
+    return cleaned
+
+
+def import_batch(rows, stats):
+    """Upsert one batch of cleaned rows; returns the touched product ids"""
+    # Last row wins for product fields repeated across a product's variants
+    products = {row['sku']: row for row in rows}
+    variants = {(row['sku'], row['size'], row['color']): row['stock'] for row in rows}
+
+    with transaction.atomic():
+        existing = {
+            product.sku: product
+            for product in Product.objects.filter(sku__in=products).only('id', 'sku', 'category', *PRODUCT_FIELDS)
+        }
+        to_create, to_update, categories = [], [], set()
+        for sku, row in products.items():
+            product = existing.get(sku)
+            if product is None:
+                to_create.append(Product(sku=sku, **{name: row[name] for name in PRODUCT_FIELDS}))
+                categories.add(row['category'])
+                continue
+            changed = False
+            for name in PRODUCT_FIELDS:
+                if _current_value(product, name) != row[name]:
+                    if name == 'category':
+                        categories.update((product.category, row['category']))
+                    setattr(product, name, row[name])
+                    changed = True
+            if changed:
+                to_update.append(product)
+
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update, PRODUCT_FIELDS)
+        stats.products_created += len(to_create)
+        stats.products_updated += len(to_update)
+
+        ids = {product.sku: product.pk for product in existing.values()}
+        ids.update((product.sku, product.pk) for product in to_create)
+        if any(pk is None for pk in ids.values()):
+            # Backends that can't return ids from bulk_create
+            ids.update(Product.objects.filter(sku__in=products).values_list('sku', 'pk'))
+
+        current = {
+            (product_id, size, color): (pk, stock)
+            for pk, product_id, size, color, stock in ProductVariant.objects.filter(
+                product_id__in=ids.values()
+            ).values_list('pk', 'product_id', 'size', 'color', 'stock')
+        }
+        new_variants, changed_variants = [], []
+        for (sku, size, color), stock in variants.items():
+            key = (ids[sku], size, color)
+            if key not in current:
+                new_variants.append(ProductVariant(product_id=ids[sku], size=size, color=color, stock=stock))
+            elif current[key][1] != stock:
+                changed_variants.append(ProductVariant(pk=current[key][0], stock=stock))
+        ProductVariant.objects.bulk_create(new_variants)
+        ProductVariant.objects.bulk_update(changed_variants, ['stock'])
+        stats.variants_created += len(new_variants)
+        stats.variants_updated += len(changed_variants)
+
+        product_ids = list(ids.values())
+        search.update_search_vector(product_ids)
+        related.mark_dirty(product.pk for product in to_create + to_update)
+
+    catalog_bulk_updated.send(sender=Product, product_ids=[product.pk for product in to_update])
+    catalog_cache.bump(
+        catalog_cache.ALL_SCOPE,
+        *[catalog_cache.category_scope(category) for category in categories | {row['category'] for row in rows}],
+        *[catalog_cache.product_scope(pk) for pk in product_ids],
+    )
+    return product_ids
+
+
+def _current_value(product, name):
+    if name == 'image':
+        return product.image.name or ''
+    return getattr(product, name)
+
+
+def import_catalog(rows, batch_size=DEFAULT_BATCH_SIZE, skip=0, on_batch=None, max_errors=100):
+    """
+    Import ``(line number, row)`` pairs; returns ``ImportStats``.
+
+    The first ``skip`` rows are consumed without being applied (resume).
+    ``on_batch(stats)`` runs after every committed batch, with
+    ``stats.rows`` counting every row consumed so far.
+    """
+    stats = ImportStats(rows=skip)
+    batch = []
+
+    def flush():
+        import_batch(batch, stats)
+        stats.rows += len(batch)
+        batch.clear()
+        if on_batch:
+            on_batch(stats)
+
+    for index, (line_number, row) in enumerate(rows):
+        if index < skip:
+            continue
+        try:
+            batch.append(clean_row(row))
+        except InvalidRow as exc:
+            # Invalid rows still advance the checkpoint; they're reported, not retried
+            stats.rows += 1
+            stats.skipped += 1
+            if len(stats.errors) < max_errors:
+                stats.errors.append(f'line {line_number}: {exc}')
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    # Other processes pick these up through their TTL or on restart
+    search.get_index().clear()
+    facets.get_index().clear()
+    return stats
+
+
+def read_checkpoint(path, source):
+    """Rows already imported from ``source`` according to ``path``"""
+    try:
+        with open(path) as handle:
+            checkpoint = json.load(handle)
+    except FileNotFoundError:
+        return 0
+    if checkpoint.get('source') != os.path.abspath(source):
+        return 0
+    return checkpoint.get('rows', 0)
+
+
+def write_checkpoint(path, source, rows):
+    """Atomically record progress so a crash never leaves a torn file"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump({'source': os.path.abspath(source), 'rows': rows}, handle)
+    os.replace(tmp_path, path)
@@ -0,0 +1,55 @@
+"""
+Query builders for product listings.
+
+Product cards need a handful of columns plus a few variant aggregates. The
+aggregates are correlated subqueries rather than a JOIN/GROUP BY so the
+database only evaluates them for the rows on the current page.
+"""
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce, Left
+
+from .models import AVAILABLE, ProductVariant
+
+
+# Columns a product card actually renders
+CARD_FIELDS = ('id', 'name', 'price', 'category', 'image', 'image_renditions', 'created_at')
+
+# Characters of the description kept for the card blurb
+SUMMARY_LENGTH = 200
+
+
+def _variant_aggregate(expression):
+    return Coalesce(
+        Subquery(
+            ProductVariant.objects.filter(product=OuterRef('pk'))
+            .order_by()
+            .values('product')
+            .annotate(value=expression)
+            .values('value'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def product_cards(queryset):
+    """
+    Narrow ``queryset`` to what a product card renders.
+
+    Adds ``summary`` (start of the description), ``variant_count``,
+    ``total_stock`` and ``in_stock`` so templates never touch
+    ``product.variants`` per card.
+    """
+    return queryset.only(*CARD_FIELDS).annotate(
+        summary=Left('description', SUMMARY_LENGTH),
+        variant_count=_variant_aggregate(Count('pk')),
+        total_stock=_variant_aggregate(Sum(AVAILABLE)),
+        in_stock=Exists(ProductVariant.objects.filter(product=OuterRef('pk'), stock__gt=F('reserved'))),
+    )
+
+
+def with_variants(queryset):
+    """Full product rows with variants prefetched in one extra query (API)"""
+    return queryset.defer('search_vector').prefetch_related(
+        Prefetch('variants', queryset=ProductVariant.objects.only('id', 'product_id', 'size', 'color', 'stock', 'reserved'))
+    )
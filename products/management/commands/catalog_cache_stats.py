@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products import cache
+
+
+class Command(BaseCommand):
+    help = 'Show catalog cache hit/miss counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = cache.stats()
+        self.stdout.write(f"Hits:          {stats['hits']}")
+        self.stdout.write(f"Misses:        {stats['misses']}")
+        self.stdout.write(f"Lock timeouts: {stats['lock_timeouts']}")
+        self.stdout.write(f"Hit rate:      {stats['hit_rate']:.1%}")
+
+        if options['reset']:
+            cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,44 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from products import renditions
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated product image renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'image_renditions')
+        pending = [product.pk for product in products.iterator() if not renditions.is_current(product)]
+        if not pending:
+            self.stdout.write('All product images already have renditions')
+            return
+
+        def generate(product_id):
+            try:
+                return renditions.generate_for_product(product_id)
+            finally:
+                close_old_connections()
+
+        started = time.monotonic()
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(generate, pk): pk for pk in pending}
+            for future, pk in futures.items():
+                try:
+                    future.result()
+                    done += 1
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'Product {pk}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Renditions generated for {done} products ({failed} failed) in {time.monotonic() - started:.1f}s'
+        ))
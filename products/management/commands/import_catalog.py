@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import importer
+
+
+class Command(BaseCommand):
+    help = 'Import products and variants from a CSV or JSONL file (one row per variant)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=importer.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--checkpoint', help='Progress file (default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true', help='Skip rows recorded in the checkpoint')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        skip = importer.read_checkpoint(checkpoint, path) if options['resume'] else 0
+        if skip:
+            self.stdout.write(f'Resuming after {skip} rows')
+
+        started = time.monotonic()
+
+        def on_batch(stats):
+            importer.write_checkpoint(checkpoint, path, stats.rows)
+            elapsed = time.monotonic() - started
+            rate = (stats.rows - skip) / elapsed if elapsed else 0
+            self.stdout.write(f'{stats.rows} rows ({rate:,.0f} rows/s)')
+
+        rows = importer.read_rows(path, options['format'])
+        try:
+            stats = importer.import_catalog(rows, batch_size=options['batch_size'], skip=skip, on_batch=on_batch)
+        except ValueError as exc:
+            raise CommandError(f'{exc} (resume with --resume)')
+
+        for error in stats.errors:
+            self.stderr.write(error)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.monotonic() - started
+        imported = stats.rows - skip
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} rows in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:,.0f} rows/s): '
+            f'{stats.products_created} products created, {stats.products_updated} updated, '
+            f'{stats.variants_created} variants created, {stats.variants_updated} updated, '
+            f'{stats.skipped} invalid rows skipped'
+        ))
+        self.stdout.write('Run rebuild_related_products and generate_renditions to refresh derived data')
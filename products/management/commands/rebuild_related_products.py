@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products import related
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related-products neighbour table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every product, not just changed ones')
+        parser.add_argument('--k', type=int, default=related.NEIGHBOURS, help='Neighbours kept per product')
+
+    def handle(self, *args, **options):
+        refreshed, seconds = related.rebuild(full=options['full'], k=options['k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Related products refreshed for {refreshed} products in {seconds:.1f}s'
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from products import search
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if not search.uses_postgres():
+            self.stdout.write('In-process search index is built on first search; nothing to do')
+            return
+
+        ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), batch_size):
+            search.update_search_vector(ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f'Search vectors rebuilt for {len(ids)} products'))
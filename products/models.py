@@ -1,13 +1,32 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 
+# What can still be sold: stock less what unpaid online orders are holding
+AVAILABLE = models.F('stock') - models.F('reserved')
+
+
 class Product(models.Model):
+    # Merchant's stock-keeping unit; import_catalog upserts on it
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=100)
     image = models.ImageField(upload_to="products/", blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by products.signals; only populated on PostgreSQL
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Resized copies of ``image``; written by products.renditions
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        # Keyset pagination walks these (sort column, id) pairs
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -18,6 +37,41 @@ class ProductVariant(models.Model):
     size = models.CharField(max_length=20)
     color = models.CharField(max_length=20)
     stock = models.IntegerField()
+    # Held by orders awaiting online payment (see orders.reservations)
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    def __str__(self):
+        return f"{self.product.name} - {self.size} - {self.color}"
+
+    @property
+    def available(self):
+        return self.stock - self.reserved
+
+
+class ProductVector(models.Model):
+    """Hashed term counts for a product, used by the related-products engine"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='vector')
+    data = models.BinaryField(default=bytes)
+    # Set whenever the product changes; cleared by rebuild_related_products
+    dirty = models.BooleanField(default=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Vector for {self.product_id}"
+
+
+class RelatedProduct(models.Model):
+    """Precomputed nearest neighbours of a product, best first"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbours')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='related_product_rank_unique'),
+        ]
 
     def __str__(self):
-        return f"{self.product.name} - {self.size} - {self.color}"
\ No newline at end of file
+        return f"{self.product_id} -> {self.related_id} ({self.score:.3f})"
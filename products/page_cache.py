@@ -0,0 +1,100 @@
+"""
+Whole-page caching for anonymous storefront traffic.
+
+Pages wrapped in ``shared_page`` are identical for every anonymous visitor:
+the per-user bits (cart badge, wishlist hearts, CSRF token) are filled in by
+the browser from ``cart_status``. Responses carry an ETag and Last-Modified
+derived from the catalog versions the page depends on, so revalidation is a
+cache lookup that ends in ``304 Not Modified``.
+
+A page invalidated in one worker must be invalidated in all of them, so the
+cache is only on when the catalog cache is shared (or in DEBUG, with a
+single process). ``SHARED_PAGE_CACHE = True/False`` overrides that.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from ecommerce.caches import is_process_local
+
+from . import cache as catalog_cache
+
+
+CACHEABLE_STATUSES = (200, 404)
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def _enabled():
+    enabled = getattr(settings, 'SHARED_PAGE_CACHE', None)
+    if enabled is None:
+        return settings.DEBUG or not is_process_local(getattr(settings, 'CATALOG_CACHE_ALIAS', 'default'))
+    return enabled
+
+
+def _is_shareable(request):
+    if not _enabled():
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Flash messages are per visitor; render those pages normally
+    return len(get_messages(request)) == 0
+
+
+def shared_page(scopes):
+    """
+    Cache a view's response for anonymous visitors.
+
+    ``scopes(request, *args, **kwargs)`` returns the catalog cache scopes the
+    page depends on; bumping any of them changes the ETag and the cache key.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_shareable(request):
+                response = view(request, *args, **kwargs)
+                patch_vary_headers(response, ('Cookie',))
+                return response
+
+            request.shared_page = True
+            page_scopes = scopes(request, *args, **kwargs)
+            path = request.get_full_path()
+            etag, last_modified = catalog_cache.validators(page_scopes, path)
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                def build():
+                    rendered = view(request, *args, **kwargs)
+                    if rendered.status_code not in CACHEABLE_STATUSES or rendered.cookies:
+                        raise _Uncacheable(rendered)
+                    return {
+                        'status': rendered.status_code,
+                        'content': rendered.content,
+                        'content_type': rendered['Content-Type'],
+                    }
+
+                try:
+                    snapshot = catalog_cache.get_or_build('page', page_scopes, build, path)
+                except _Uncacheable as uncacheable:
+                    return uncacheable.response
+                response = HttpResponse(
+                    snapshot['content'], status=snapshot['status'], content_type=snapshot['content_type'],
+                )
+
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'SHARED_PAGE_MAX_AGE', 0))
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,229 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Pages are addressed by the sort key of the last row seen rather than an
+offset, so fetching page N is a bounded index range scan just like page 1.
+``id`` is always the final sort column to make the key unique.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Public ``?sort=`` values and the keyset they paginate on
+SORT_ORDERINGS = {
+    '-created_at': ('-created_at', '-id'),
+    'created_at': ('created_at', 'id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'name': ('name', 'id'),
+    '-name': ('-name', '-id'),
+}
+DEFAULT_SORT = '-created_at'
+
+# Search results without an explicit sort are ordered by relevance
+RELEVANCE_ORDERING = ('-rank', '-id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def resolve_ordering(sort, searching=False):
+    """Map a ``?sort=`` value to a keyset ordering, falling back to the default"""
+    if sort in SORT_ORDERINGS:
+        return sort, SORT_ORDERINGS[sort]
+    if searching:
+        return '', RELEVANCE_ORDERING
+    return DEFAULT_SORT, SORT_ORDERINGS[DEFAULT_SORT]
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: str = None
+    previous_cursor: str = None
+    ordering: tuple = field(default=())
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _json_default(value):
+    # Full precision on purpose: a cursor that rounds the key skips rows
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': values, 'r': int(reverse)}, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, model, ordering):
+    """Return ``(values, reverse)`` with values converted back to Python types"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        raw_values, reverse = payload['v'], bool(payload['r'])
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise InvalidCursor(token)
+
+    if not isinstance(raw_values, list) or len(raw_values) != len(ordering):
+        raise InvalidCursor(token)
+
+    values = []
+    for name, raw in zip(_field_names(ordering), raw_values):
+        try:
+            values.append(model._meta.get_field(name).to_python(raw))
+        except FieldDoesNotExist:
+            # Annotations such as the search rank
+            values.append(float(raw))
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor(token)
+    return values, reverse
+
+
+def _field_names(ordering):
+    return [column.lstrip('-') for column in ordering]
+
+
+def _keyset_filter(ordering, values, reverse):
+    """``(a, b) > (x, y)`` spelled out so it works for mixed sort directions"""
+    condition = Q()
+    equal_prefix = {}
+    for column, value in zip(ordering, values):
+        name = column.lstrip('-')
+        descending = column.startswith('-') != reverse
+        lookup = f"{name}__{'lt' if descending else 'gt'}"
+        condition |= Q(**equal_prefix, **{lookup: value})
+        equal_prefix[name] = value
+    return condition
+
+
+def _reverse_ordering(ordering):
+    return tuple(column[1:] if column.startswith('-') else f'-{column}' for column in ordering)
+
+
+def paginate(queryset, ordering, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return a ``KeysetPage`` of at most ``page_size`` rows from ``queryset``.
+
+    ``cursor`` is an opaque token taken from a previous page's
+    ``next_cursor``/``previous_cursor``. Raises ``InvalidCursor`` for
+    tokens that cannot be decoded.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    reverse = False
+
+    if cursor:
+        values, reverse = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(_keyset_filter(ordering, values, reverse))
+
+    queryset = queryset.order_by(*(_reverse_ordering(ordering) if reverse else ordering))
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    page = KeysetPage(rows, ordering=ordering)
+    if not rows:
+        return page
+
+    names = _field_names(ordering)
+    first = [getattr(rows[0], name) for name in names]
+    last = [getattr(rows[-1], name) for name in names]
+
+    if has_more or reverse:
+        page.next_cursor = encode_cursor(last)
+    if cursor and (has_more or not reverse):
+        page.previous_cursor = encode_cursor(first, reverse=True)
+    return page
+
+
+def cursor_url(request, cursor):
+    """Current URL with ``cursor`` swapped in (or removed for ``None``)"""
+    url = request.get_full_path()
+    if cursor is None:
+        return remove_query_param(url, 'cursor')
+    return replace_query_param(url, 'cursor', cursor)
+
+
+class ProductCursorPagination(BasePagination):
+    """DRF pagination class sharing the storefront keyset rules"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        searching = bool(request.query_params.get('search'))
+        _, ordering = resolve_ordering(request.query_params.get('sort', ''), searching)
+
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, DEFAULT_PAGE_SIZE))
+        except ValueError:
+            page_size = DEFAULT_PAGE_SIZE
+
+        try:
+            self.page = paginate(queryset, ordering, request.query_params.get(self.cursor_query_param), page_size)
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page.next_cursor)
+
+    def get_previous_link(self):
+        if not self.page.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,234 @@
+"""
+Content-based "related products".
+
+Each product is turned into a hashed bag of words (name, category and
+description tokens, stemmed like search) stored in ``ProductVector``. A
+rebuild weights the counts with TF-IDF, L2-normalises them and takes the
+top-k cosine neighbours of every product with blocked matrix products, then
+writes them to ``RelatedProduct`` so serving is a single indexed lookup.
+
+Product saves only mark the vector dirty. An incremental refresh recomputes
+the dirty products plus every product whose neighbour list they now enter
+or leave.
+"""
+import math
+import time
+import zlib
+
+import numpy as np
+from django.db import transaction
+
+from .models import Product, ProductVector, RelatedProduct
+from .search import tokenize
+
+
+DIMENSIONS = 512
+NEIGHBOURS = 8
+
+# Term weights per field; the category also adds one exact-match token
+FIELD_WEIGHTS = {'name': 3.0, 'category': 2.0, 'description': 1.0}
+CATEGORY_TOKEN_WEIGHT = 2.0
+
+# Upper bound on the similarity block held in memory at once
+BLOCK_BYTES = 64 * 1024 * 1024
+
+WRITE_BATCH_SIZE = 5000
+
+
+def _bucket(token):
+    return zlib.crc32(token.encode()) % DIMENSIONS
+
+
+def term_counts(name, category, description):
+    """Raw hashed term counts for one product"""
+    counts = np.zeros(DIMENSIONS, dtype=np.float32)
+    fields = {'name': name, 'category': category, 'description': description}
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(fields[field]):
+            counts[_bucket(token)] += weight
+    counts[_bucket(f'category:{(category or "").lower()}')] += CATEGORY_TOKEN_WEIGHT
+    return counts
+
+
+def weight_matrix(counts):
+    """TF-IDF weight and L2-normalise a (products x DIMENSIONS) count matrix"""
+    n = counts.shape[0]
+    df = np.count_nonzero(counts, axis=0).astype(np.float32)
+    idf = np.log((1 + n) / (1 + df)) + 1
+    matrix = np.log1p(counts) * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def top_neighbours(matrix, rows, k=NEIGHBOURS):
+    """
+    Yield ``(row, neighbour_rows, scores)`` for each row in ``rows``.
+
+    Similarities are computed a block of rows at a time so memory stays at
+    ``BLOCK_BYTES`` however large the catalog is.
+    """
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        for row in rows:
+            yield row, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return
+
+    rows = np.asarray(rows, dtype=np.int64)
+    block = max(1, BLOCK_BYTES // (4 * n))
+    for start in range(0, len(rows), block):
+        block_rows = rows[start:start + block]
+        similarity = matrix[block_rows] @ matrix.T
+        similarity[np.arange(len(block_rows)), block_rows] = -np.inf
+        candidates = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        for i, row in enumerate(block_rows):
+            scores = similarity[i, candidates[i]]
+            order = np.argsort(-scores, kind='stable')
+            yield int(row), candidates[i][order], scores[order]
+
+
+def mark_dirty(product_ids):
+    """Flag products for the next refresh (creating their vector rows)"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    ProductVector.objects.filter(product_id__in=product_ids).update(dirty=True)
+    ProductVector.objects.bulk_create(
+        [ProductVector(product_id=pk, dirty=True) for pk in product_ids],
+        ignore_conflicts=True,
+    )
+
+
+def _refresh_vectors(product_ids):
+    """
+    Recompute stored term counts for ``product_ids``. Leaves ``dirty`` alone
+    on existing rows, so a save landing meanwhile stays flagged.
+    """
+    for start in range(0, len(product_ids), WRITE_BATCH_SIZE):
+        chunk = product_ids[start:start + WRITE_BATCH_SIZE]
+        vectors = [
+            ProductVector(product_id=pk, data=term_counts(name, category, description).tobytes(), dirty=False)
+            for pk, name, category, description in
+            Product.objects.filter(pk__in=chunk).values_list('pk', 'name', 'category', 'description')
+        ]
+        ProductVector.objects.bulk_create(
+            vectors,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['data'],
+        )
+
+
+def _load_matrix():
+    ids, rows = [], []
+    queryset = ProductVector.objects.exclude(data=b'').order_by('product_id').values_list('product_id', 'data')
+    for pk, data in queryset.iterator(chunk_size=WRITE_BATCH_SIZE):
+        ids.append(pk)
+        rows.append(np.frombuffer(bytes(data), dtype=np.float32))
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, DIMENSIONS), dtype=np.float32)
+    return np.asarray(ids, dtype=np.int64), weight_matrix(np.vstack(rows))
+
+
+def _write_neighbours(ids, results):
+    """Replace neighbour rows for every product in ``results``"""
+    written = 0
+    batch_products, batch_rows = [], []
+
+    def flush():
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product_id__in=batch_products).delete()
+            RelatedProduct.objects.bulk_create(batch_rows, batch_size=WRITE_BATCH_SIZE)
+        batch_products.clear()
+        batch_rows.clear()
+
+    for row, neighbours, scores in results:
+        product_id = int(ids[row])
+        batch_products.append(product_id)
+        for rank, (neighbour, score) in enumerate(zip(neighbours, scores)):
+            if score <= 0 or not math.isfinite(score):
+                break
+            batch_rows.append(RelatedProduct(
+                product_id=product_id, related_id=int(ids[neighbour]), rank=rank, score=float(score),
+            ))
+        written += 1
+        if len(batch_rows) >= WRITE_BATCH_SIZE:
+            flush()
+    if batch_products:
+        flush()
+    return written
+
+
+def rebuild(full=False, k=NEIGHBOURS):
+    """
+    Recompute neighbour lists and return ``(products refreshed, seconds)``.
+
+    ``full`` recomputes every product; otherwise only dirty products and the
+    products whose lists they enter or leave.
+    """
+    from . import cache as catalog_cache
+
+    started = time.monotonic()
+    # Flags are cleared before the products are read: a product saved while
+    # the rebuild runs is flagged again and picked up next time
+    if full:
+        ProductVector.objects.filter(dirty=True).update(dirty=False)
+        _refresh_vectors(list(Product.objects.values_list('pk', flat=True)))
+        dirty_ids = None
+    else:
+        dirty_ids = list(ProductVector.objects.filter(dirty=True).values_list('product_id', flat=True))
+        if not dirty_ids:
+            return 0, time.monotonic() - started
+        for start in range(0, len(dirty_ids), WRITE_BATCH_SIZE):
+            ProductVector.objects.filter(product_id__in=dirty_ids[start:start + WRITE_BATCH_SIZE]).update(dirty=False)
+        _refresh_vectors(dirty_ids)
+
+    ids, matrix = _load_matrix()
+    if dirty_ids is None:
+        rows = np.arange(len(ids))
+    else:
+        rows = _affected_rows(ids, matrix, dirty_ids, k)
+
+    refreshed = _write_neighbours(ids, top_neighbours(matrix, rows, k))
+    refreshed_ids = [int(ids[row]) for row in rows]
+    catalog_cache.bump(*[catalog_cache.product_scope(pk) for pk in refreshed_ids])
+    return refreshed, time.monotonic() - started
+
+
+def _affected_rows(ids, matrix, dirty_ids, k):
+    """Dirty rows plus rows whose top-k a dirty product enters or leaves"""
+    position = {int(pk): row for row, pk in enumerate(ids)}
+    dirty_rows = np.asarray([position[pk] for pk in dirty_ids if pk in position], dtype=np.int64)
+    affected = set(dirty_rows.tolist())
+
+    # Lists that currently contain a dirty product may need to drop it
+    for pk in RelatedProduct.objects.filter(related_id__in=dirty_ids).values_list('product_id', flat=True):
+        if pk in position:
+            affected.add(position[pk])
+
+    # Lists a dirty product now scores into: anything more similar to it
+    # than the list's current last entry (lists shorter than k take anything)
+    if len(dirty_rows):
+        worst = dict(RelatedProduct.objects.filter(rank=k - 1).values_list('product_id', 'score'))
+        threshold = np.array([worst.get(int(pk), 0.0) for pk in ids], dtype=np.float32)
+        block = max(1, BLOCK_BYTES // (4 * len(ids)))
+        for start in range(0, len(dirty_rows), block):
+            block_rows = dirty_rows[start:start + block]
+            similarity = matrix[block_rows] @ matrix.T
+            similarity[np.arange(len(block_rows)), block_rows] = 0
+            entering = np.nonzero((similarity > threshold).any(axis=0))[0]
+            affected.update(entering.tolist())
+
+    return np.asarray(sorted(affected), dtype=np.int64)
+
+
+def related_products(product, limit=4):
+    """Neighbours of ``product`` from the precomputed table (one query)"""
+    rows = (
+        RelatedProduct.objects.filter(product=product, rank__lt=limit)
+        .select_related('related')
+        .defer('related__description', 'related__search_vector')
+        .order_by('rank')
+    )
+    return [row.related for row in rows]
@@ -0,0 +1,140 @@
+"""
+Resized, re-encoded copies of product images.
+
+Every uploaded image gets a set of fixed-width renditions in AVIF (when
+Pillow supports it), WebP and JPEG. Files are content-addressed: the name
+is derived from the source bytes and the rendition parameters, so
+regenerating is idempotent and identical uploads share files. The manifest
+of what exists is kept on ``Product.image_renditions`` and rendered as
+``srcset`` by the ``product_image`` template tag and the API.
+"""
+import hashlib
+import io
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from ecommerce import background
+
+from .models import Product
+
+
+RENDITION_DIR = 'products/renditions'
+
+# Widths in CSS pixels x 1-2 device pixel ratios of the places images show:
+# order/cart thumbnails (60-100px), listing cards (~300px), detail page (~600px)
+WIDTHS = (120, 240, 480, 960)
+
+# (format, Pillow encoder, extension, save options), best compression first
+FORMATS = (
+    ('avif', 'AVIF', 'avif', {'quality': 55}),
+    ('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+# Bump to regenerate every rendition after changing the settings above
+VERSION = 1
+
+
+def available_formats():
+    formats = []
+    for name, encoder, extension, options in FORMATS:
+        if name == 'avif' and not features.check('avif'):
+            continue
+        formats.append((name, encoder, extension, options))
+    return formats
+
+
+def is_current(product):
+    manifest = product.image_renditions or {}
+    return bool(product.image) and manifest.get('source') == product.image.name and manifest.get('version') == VERSION
+
+
+def schedule(product):
+    """Generate renditions in the background if ``product.image`` changed"""
+    if product.image and not is_current(product):
+        background.submit(generate_for_product, product.pk)
+
+
+def generate_for_product(product_id):
+    """Build any missing renditions for one product and record the manifest"""
+    from . import cache as catalog_cache
+
+    product = Product.objects.filter(pk=product_id).only('id', 'category', 'image', 'image_renditions').first()
+    if product is None or not product.image or is_current(product):
+        return None
+
+    source_name = product.image.name
+    with product.image.open('rb') as source:
+        data = source.read()
+    manifest = generate(data)
+    manifest['source'] = source_name
+
+    # Only record it if the image wasn't replaced while we were working
+    updated = Product.objects.filter(pk=product_id, image=source_name).update(image_renditions=manifest)
+    if updated:
+        catalog_cache.bump(
+            catalog_cache.ALL_SCOPE,
+            catalog_cache.product_scope(product_id),
+            catalog_cache.category_scope(product.category),
+        )
+    return manifest
+
+
+def generate(data):
+    """
+    Write renditions of the image in ``data`` and return their manifest:
+    ``{'version', 'width', 'height', 'formats': {format: [[width, name], ...]}}``.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    with Image.open(io.BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # Never upscale; an image narrower than the smallest width gets one rendition
+    widths = [width for width in WIDTHS if width < image.width] + [min(image.width, WIDTHS[-1])]
+    widths = sorted(set(widths))
+
+    manifest = {'version': VERSION, 'width': image.width, 'height': image.height, 'formats': {}}
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        for name, encoder, extension, options in available_formats():
+            path = posixpath.join(RENDITION_DIR, digest[:2], f'{digest}-{width}-v{VERSION}.{extension}')
+            if not default_storage.exists(path):
+                frame = resized.convert('RGB') if encoder == 'JPEG' else resized
+                buffer = io.BytesIO()
+                frame.save(buffer, encoder, **options)
+                default_storage.save(path, ContentFile(buffer.getvalue()))
+            manifest['formats'].setdefault(name, []).append([width, path])
+    return manifest
+
+
+def srcsets(product, build_url=None):
+    """
+    ``{format: srcset}`` for the product's renditions (empty if none yet).
+    ``build_url`` can turn the storage URLs into absolute ones.
+    """
+    if not is_current(product):
+        return {}
+    build_url = build_url or (lambda url: url)
+    return {
+        name: ', '.join(f'{build_url(default_storage.url(path))} {width}w' for width, path in entries)
+        for name, entries in product.image_renditions['formats'].items()
+    }
+
+
+def fallback_url(product, width):
+    """Smallest JPEG at least ``width`` pixels wide, else the original upload"""
+    if is_current(product):
+        entries = product.image_renditions['formats'].get('jpeg', [])
+        for rendition_width, path in entries:
+            if rendition_width >= width:
+                return default_storage.url(path)
+        if entries:
+            return default_storage.url(entries[-1][1])
+    return product.image.url if product.image else None
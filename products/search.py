@@ -0,0 +1,258 @@
+"""
+Product search.
+
+On PostgreSQL products are matched against a weighted ``search_vector``
+column (GIN indexed, stemmed with the ``english`` config) and a trigram
+index on the name for typo tolerance. Other backends (SQLite in tests and
+local dev) use an in-process inverted index with the same tokenising rules.
+Both are kept up to date from ``Product`` saves in ``products.signals``.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+from .models import Product
+
+
+SEARCH_CONFIG = 'english'
+
+# Maximum number of hits the in-process index hands back to the ORM
+FALLBACK_RESULT_LIMIT = 1000
+
+# Minimum trigram similarity for a misspelt term to count as a match
+TRIGRAM_THRESHOLD = 0.3
+
+# Field weights, highest first (same order as the Postgres A/B/C weights)
+FIELD_WEIGHTS = {
+    'name': 1.0,
+    'category': 0.4,
+    'description': 0.2,
+}
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def search_vector():
+    """Weighted tsvector expression matching the GIN index definition"""
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('category', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def search_products(queryset, query):
+    """
+    Filter ``queryset`` down to products matching ``query``.
+
+    The result is annotated with a ``rank`` (higher is better) so callers
+    can order by relevance.
+    """
+    query = query.strip()
+    if not query:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+    if uses_postgres():
+        return _postgres_search(queryset, query)
+    return _fallback_search(queryset, query)
+
+
+def _postgres_search(queryset, query):
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.filter(
+        Q(search_vector=search_query) | Q(name__trigram_similar=query)
+    ).annotate(
+        # ts_rank is a float4; widen it so the value a cursor carries back
+        # compares equal to the one in the ORDER BY
+        rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+    )
+
+
+def _fallback_search(queryset, query):
+    hits = get_index().search(query, limit=FALLBACK_RESULT_LIMIT)
+    if not hits:
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+
+    return queryset.filter(pk__in=[pk for pk, score in hits]).annotate(
+        rank=Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in hits],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    )
+
+
+def update_search_vector(product_ids):
+    """Recompute the stored tsvector for the given products (Postgres only)"""
+    if uses_postgres():
+        Product.objects.filter(pk__in=product_ids).update(search_vector=search_vector())
+
+
+# ---------------------------------------------------------------------------
+# Tokenising shared by the in-process index
+# ---------------------------------------------------------------------------
+
+def stem(word):
+    """Very small suffix-stripping stemmer (shirts -> shirt, running -> run)"""
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[:-len(suffix)]
+            if suffix in ('ing', 'ed') and len(word) > 2 and word[-1] == word[-2]:
+                word = word[:-1]
+            return word
+    return word
+
+
+def tokenize(text):
+    return [
+        stem(token)
+        for token in TOKEN_RE.findall((text or '').lower())
+        if token not in STOPWORDS
+    ]
+
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InvertedIndex:
+    """
+    In-process inverted index over product name, category and description.
+
+    Postings map a stemmed term to ``{product_id: weight}``. Unknown query
+    terms are expanded to vocabulary terms with similar trigrams, so a
+    misspelt search still finds something.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._trigrams = defaultdict(set)
+
+    def clear(self):
+        with self._lock:
+            self._loaded = False
+            self._postings.clear()
+            self._documents.clear()
+            self._trigrams.clear()
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = Product.objects.values_list('pk', 'name', 'category', 'description')
+            for pk, name, category, description in rows.iterator():
+                self._add(pk, name, category, description)
+            self._loaded = True
+
+    def index_product(self, product):
+        # Nothing to do until the index is first used; the initial load
+        # will pick the product up from the database.
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(product.pk)
+            self._add(product.pk, product.name, product.category, product.description)
+
+    def remove_product(self, product_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(product_id)
+
+    def search(self, query, limit=FALLBACK_RESULT_LIMIT):
+        """Return ``[(product_id, score), ...]`` best first"""
+        self.ensure_loaded()
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = self._match_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    # Every query term has to match (AND semantics)
+                    scores = {
+                        pk: score + term_scores[pk]
+                        for pk, score in scores.items()
+                        if pk in term_scores
+                    }
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda hit: (-hit[1], -hit[0]))
+        return ranked[:limit]
+
+    def _match_term(self, term):
+        postings = self._postings.get(term)
+        if postings:
+            return dict(postings)
+
+        # Typo tolerance: score vocabulary terms by trigram similarity
+        query_grams = trigrams(term)
+        candidates = defaultdict(int)
+        for gram in query_grams:
+            for candidate in self._trigrams.get(gram, ()):
+                candidates[candidate] += 1
+
+        matches = {}
+        for candidate, shared in candidates.items():
+            similarity = shared / len(query_grams | trigrams(candidate))
+            if similarity < TRIGRAM_THRESHOLD:
+                continue
+            for pk, weight in self._postings[candidate].items():
+                matches[pk] = max(matches.get(pk, 0.0), weight * similarity)
+        return matches
+
+    def _add(self, pk, name, category, description):
+        terms = {}
+        for field, text in (('name', name), ('category', category), ('description', description)):
+            for term in tokenize(text):
+                terms[term] = max(terms.get(term, 0.0), FIELD_WEIGHTS[field])
+
+        for term, weight in terms.items():
+            if term not in self._postings:
+                for gram in trigrams(term):
+                    self._trigrams[gram].add(term)
+            self._postings[term][pk] = weight
+        self._documents[pk] = set(terms)
+
+    def _remove(self, pk):
+        for term in self._documents.pop(pk, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[term]
+                for gram in trigrams(term):
+                    self._trigrams[gram].discard(term)
+
+
+_index = InvertedIndex()
+
+
+def get_index():
+    return _index
@@ -0,0 +1,76 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from . import cache, facets, related, renditions, search
+from .models import Product, ProductVariant, RelatedProduct
+
+
+# Sent with ``product_ids`` after bulk writes that bypassed the model
+# signals (import_catalog), so other apps can refresh what they derive
+catalog_bulk_updated = Signal()
+
+
+@receiver(pre_save, sender=Product)
+def remember_category(sender, instance, raw=False, **kwargs):
+    """A product moving category invalidates the category it left as well"""
+    instance._previous_category = None
+    if instance.pk and not raw:
+        instance._previous_category = (
+            Product.objects.filter(pk=instance.pk).values_list('category', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    """Keep the search and facet indexes and the catalog cache in step"""
+    if raw:
+        return
+    search.update_search_vector([instance.pk])
+    search.get_index().index_product(instance)
+    facets.get_index().refresh_product(instance.pk)
+    # Neighbours are recomputed by rebuild_related_products
+    related.mark_dirty([instance.pk])
+    renditions.schedule(instance)
+
+    scopes = {cache.ALL_SCOPE, cache.product_scope(instance.pk), cache.category_scope(instance.category)}
+    previous = getattr(instance, '_previous_category', None)
+    if previous:
+        scopes.add(cache.category_scope(previous))
+    # Pages that show this product as related
+    scopes.update(cache.product_scope(pk) for pk in _listed_by(instance.pk))
+    cache.bump(*scopes)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance, **kwargs):
+    """Products listing this one lose a neighbour; refill their lists later"""
+    instance._listed_by = _listed_by(instance.pk)
+    related.mark_dirty(instance._listed_by)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    search.get_index().remove_product(instance.pk)
+    facets.get_index().refresh_product(instance.pk)
+    scopes = [cache.ALL_SCOPE, cache.product_scope(instance.pk), cache.category_scope(instance.category)]
+    scopes.extend(cache.product_scope(pk) for pk in getattr(instance, '_listed_by', ()))
+    cache.bump(*scopes)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    facets.get_index().refresh_product(instance.product_id)
+
+    # Variant aggregates show up on category listings too
+    scopes = [cache.ALL_SCOPE, cache.product_scope(instance.product_id)]
+    category = Product.objects.filter(pk=instance.product_id).values_list('category', flat=True).first()
+    if category is not None:
+        scopes.append(cache.category_scope(category))
+    cache.bump(*scopes)
+
+
+def _listed_by(product_id):
+    return list(RelatedProduct.objects.filter(related_id=product_id).values_list('product_id', flat=True))
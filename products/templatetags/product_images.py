@@ -0,0 +1,36 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from products import renditions
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, width, sizes=None, **attrs):
+    """
+    ``<picture>`` for a product image displayed ``width`` CSS pixels wide.
+
+    Browsers pick the best format and size from the renditions; until those
+    exist the original upload is used. Extra keyword arguments become
+    attributes of the ``<img>`` (``class``, ``alt``, ``style``, ``id``...).
+    """
+    sizes = sizes or f'{width}px'
+    srcsets = renditions.srcsets(product)
+    attrs.setdefault('alt', product.name)
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if srcsets.get('jpeg'):
+        attrs['srcset'] = srcsets['jpeg']
+        attrs['sizes'] = sizes
+
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((name, srcsets[name], sizes) for name in ('avif', 'webp') if name in srcsets),
+    )
+    img_attrs = format_html_join('', ' {}="{}"', attrs.items())
+    return format_html(
+        '<picture>{}<img src="{}"{}></picture>',
+        sources, renditions.fallback_url(product, width * 2), img_attrs,
+    )
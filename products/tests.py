@@ -1,3 +1,621 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.template import Context, Template
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from products import cache as catalog_cache
+from products import checks, facets, related, renditions, search
+from products.pagination import RELEVANCE_ORDERING, SORT_ORDERINGS, InvalidCursor, paginate
+from products.listing import product_cards
+from products.models import Product, ProductVariant, ProductVector, RelatedProduct
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        search.get_index().clear()
+
+        self.shirt = Product.objects.create(
+            name='Cotton Shirt', description='Breathable summer shirt', price='499.00', category='clothing')
+        self.shoes = Product.objects.create(
+            name='Running Shoes', description='Lightweight trainers for running', price='1999.00', category='footwear')
+        self.mug = Product.objects.create(
+            name='Coffee Mug', description='Ceramic mug, fits a shirt pocket', price='199.00', category='kitchen')
+
+    def test_stemmed_search_ranks_name_matches_first(self):
+        results = list(search.search_products(Product.objects.all(), 'shirts').order_by('-rank', '-id'))
+        self.assertEqual(results, [self.shirt, self.mug])
+
+    def test_typo_tolerance(self):
+        results = search.search_products(Product.objects.all(), 'runnign shoes')
+        self.assertEqual(list(results), [self.shoes])
+
+    def test_index_follows_saves_and_deletes(self):
+        search.search_products(Product.objects.all(), 'mug')  # loads the index
+
+        self.mug.name = 'Coffee Cup'
+        self.mug.save()
+        self.assertEqual(list(search.search_products(Product.objects.all(), 'cup')), [self.mug])
+
+        self.mug.delete()
+        self.assertEqual(list(search.search_products(Product.objects.all(), 'cup')), [])
+
+    def test_home_and_api_use_search(self):
+        resp = self.client.get('/', {'search': 'trainers'})
+        self.assertEqual(list(resp.context['products']), [self.shoes])
+
+        resp = self.client.get('/api/products/products/', {'search': 'ceramic'})
+        self.assertEqual([p['id'] for p in resp.json()['results']], [self.mug.id])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        # Duplicate prices make sure the id tiebreaker keeps pages disjoint
+        self.products = [
+            Product.objects.create(name=f'Product {i:02d}', description='desc', price=str(100 + (i % 3)), category='test')
+            for i in range(7)
+        ]
+
+    def walk(self, ordering, page_size=3):
+        seen, cursor = [], None
+        while True:
+            page = paginate(Product.objects.all(), ordering, cursor, page_size)
+            seen.extend(page.object_list)
+            if not page.has_next:
+                return seen, page
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once(self):
+        for sort, ordering in SORT_ORDERINGS.items():
+            seen, _ = self.walk(ordering)
+            expected = list(Product.objects.order_by(*ordering))
+            self.assertEqual(seen, expected, sort)
+
+    def test_previous_cursor_returns_prior_page(self):
+        ordering = SORT_ORDERINGS['price']
+        first = paginate(Product.objects.all(), ordering, page_size=3)
+        second = paginate(Product.objects.all(), ordering, first.next_cursor, page_size=3)
+        back = paginate(Product.objects.all(), ordering, second.previous_cursor, page_size=3)
+        self.assertEqual(back.object_list, first.object_list)
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            paginate(Product.objects.all(), SORT_ORDERINGS['name'], 'not-a-cursor')
+
+        resp = self.client.get('/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get('/api/products/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_api_follows_next_links(self):
+        ids, url = [], '/api/products/products/?sort=name&page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(item['id'] for item in data['results'])
+            url = data['next']
+        self.assertEqual(ids, [p.id for p in self.products])
+
+    def test_relevance_pages_with_tied_ranks(self):
+        search.get_index().clear()
+        tied = [
+            Product.objects.create(name='Linen Scarf', description='desc', price='10.00', category='test')
+            for i in range(5)
+        ]
+        results = search.search_products(Product.objects.all(), 'scarf')
+        seen, cursor = [], None
+        while True:
+            page = paginate(results, RELEVANCE_ORDERING, cursor, page_size=2)
+            seen.extend(page.object_list)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(len({p.rank for p in seen}), 1)
+        self.assertEqual(seen, sorted(tied, key=lambda p: -p.id))
+
+        # ts_rank's float4 is widened so the cursor round-trips it exactly
+        rank = search._postgres_search(Product.objects.all(), 'scarf').query.annotations['rank']
+        self.assertIsInstance(rank, Cast)
+        self.assertIsInstance(rank.output_field, FloatField)
+
+
+class ProductListingQueryTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f'Item {i}', description='word ' * 100, price='10.00', category='test')
+            ProductVariant.objects.create(product=product, size='M', color='Red', stock=i)
+            ProductVariant.objects.create(product=product, size='L', color='Red', stock=1)
+
+    def count_queries(self, url):
+        self.client.get(url)  # loads the in-process facet index
+        catalog_cache.get_cache().clear()
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_card_annotations(self):
+        self.add_products(2)
+        cards = {p.name: p for p in product_cards(Product.objects.all())}
+        self.assertEqual(cards['Item 0'].variant_count, 2)
+        self.assertEqual(cards['Item 1'].total_stock, 2)
+        self.assertTrue(cards['Item 0'].in_stock)
+        self.assertIn('description', cards['Item 0'].get_deferred_fields())
+
+    def test_query_count_does_not_grow_with_page(self):
+        for url in ('/', '/api/products/products/'):
+            self.add_products(2)
+            small = self.count_queries(url)
+            self.add_products(10)
+            large = self.count_queries(url)
+            self.assertEqual(small, large, url)
+            Product.objects.all().delete()
+
+        self.add_products(3)
+        self.assertEqual(self.count_queries('/api/products/products/'), 2)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        facets.get_index().clear()
+        search.get_index().clear()
+
+        self.tee = Product.objects.create(name='Tee', description='cotton tee', price='299.00', category='Clothing')
+        self.jacket = Product.objects.create(name='Jacket', description='warm jacket', price='2499.00', category='Clothing')
+        self.kettle = Product.objects.create(name='Kettle', description='steel kettle', price='799.00', category='Kitchen')
+        ProductVariant.objects.create(product=self.tee, size='M', color='Red', stock=3)
+        ProductVariant.objects.create(product=self.tee, size='L', color='Blue', stock=3)
+        ProductVariant.objects.create(product=self.jacket, size='L', color='Black', stock=1)
+
+    def options(self, counts, facet):
+        return {option['value']: option['count'] for option in counts[facet]}
+
+    def test_counts_apply_other_facets(self):
+        counts = facets.facet_counts({'size': 'L'})
+        self.assertEqual(counts['total'], 2)
+        self.assertEqual(self.options(counts, 'category'), {'clothing': 2})
+        # The size facet itself ignores the size selection
+        self.assertEqual(self.options(counts, 'size'), {'L': 2, 'M': 1})
+        self.assertEqual(self.options(counts, 'price'), {'under-500': 1, 'above-2000': 1})
+
+    def test_counts_follow_catalog_changes(self):
+        facets.facet_counts({})  # load the index
+        variant = ProductVariant.objects.create(product=self.kettle, size='L', color='Steel', stock=5)
+        self.assertEqual(self.options(facets.facet_counts({}), 'size'), {'L': 3, 'M': 1})
+
+        variant.delete()
+        self.kettle.price = '2999.00'
+        self.kettle.save()
+        counts = facets.facet_counts({})
+        self.assertEqual(self.options(counts, 'size'), {'L': 2, 'M': 1})
+        self.assertEqual(self.options(counts, 'price')['above-2000'], 2)
+
+    def test_listing_matches_facet_total(self):
+        resp = self.client.get('/', {'category': 'clothing', 'color': 'Blue'})
+        self.assertEqual(list(resp.context['products']), [self.tee])
+        self.assertEqual(resp.context['facets']['total'], 1)
+
+    def test_unknown_price_band_is_ignored(self):
+        resp = self.client.get('/', {'category': 'clothing', 'price': 'bogus'})
+        self.assertEqual(len(resp.context['products']), 2)
+        self.assertEqual(resp.context['facets']['total'], 2)
+
+        data = self.client.get('/api/products/products/facets/', {'price': 'bogus'}).json()
+        self.assertEqual(data['total'], 3)
+
+    def test_api_facets_with_search(self):
+        data = self.client.get('/api/products/products/facets/', {'search': 'kettle'}).json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(self.options(data, 'category'), {'kitchen': 1})
+
+        data = self.client.get('/api/products/products/', {'price': 'above-2000'}).json()
+        self.assertEqual([p['id'] for p in data['results']], [self.jacket.id])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.product = Product.objects.create(name='Lamp', description='desk lamp', price='899.00', category='Home')
+        self.variant = ProductVariant.objects.create(product=self.product, size='S', color='White', stock=4)
+        self.other = Product.objects.create(name='Rug', description='wool rug', price='1299.00', category='Home')
+        catalog_cache.reset_stats()
+
+    def test_detail_served_from_cache_until_product_changes(self):
+        first = catalog_cache.product_detail(self.product.id)
+        self.assertEqual(first['sizes'], ['S'])
+        catalog_cache.related_products(self.product)
+
+        with self.assertNumQueries(0):
+            catalog_cache.product_detail(self.product.id)
+            catalog_cache.related_products(self.product)
+
+        self.variant.size = 'M'
+        self.variant.save()
+        self.assertEqual(catalog_cache.product_detail(self.product.id)['sizes'], ['M'])
+
+        stats = catalog_cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 3)
+
+    def test_category_change_invalidates_related(self):
+        self.assertEqual(catalog_cache.related_products(self.product), [self.other])
+        self.other.category = 'Garden'
+        self.other.save()
+        self.assertEqual(catalog_cache.related_products(self.product), [])
+
+    def test_variant_values_are_escaped_for_scripts(self):
+        ProductVariant.objects.create(product=self.product, size="Kid's", color='</script><script>alert(1)//', stock=1)
+        resp = self.client.get(f'/products/product/{self.product.id}/')
+        self.assertNotContains(resp, '</script><script>alert(1)')
+        self.assertNotContains(resp, "selectSize('")
+
+    def test_process_local_versions_expire(self):
+        # Another worker's bump never reaches this one; the version key ages out instead
+        scopes = [catalog_cache.product_scope(self.product.id)]
+        etag, _ = catalog_cache.validators(scopes, 'path')
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertNotEqual(catalog_cache.validators(scopes, 'path')[0], etag)
+        self.assertEqual([warning.id for warning in checks.check_catalog_cache(None)], ['products.W001'])
+        with override_settings(DEBUG=True):
+            self.assertEqual(checks.check_catalog_cache(None), [])
+
+    def test_missing_product_is_404(self):
+        resp = self.client.get('/products/product/999999/')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_miss_waits_for_lock_holder_then_builds(self):
+        calls = []
+        key = catalog_cache.make_key('stampede', ['all'])
+        catalog_cache.get_cache().add(f'{key}:lock', 1)
+
+        def build():
+            calls.append(1)
+            return 'fresh'
+
+        # Another worker holds the lock but never publishes a result
+        original_wait = catalog_cache.LOCK_WAIT
+        catalog_cache.LOCK_WAIT = 0.2
+        try:
+            self.assertEqual(catalog_cache.get_or_build('stampede', ['all'], build), 'fresh')
+        finally:
+            catalog_cache.LOCK_WAIT = original_wait
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(catalog_cache.stats()['lock_timeouts'], 1)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'catalog-cache-tests'),
+    },
+})
+class FileCatalogCacheTests(TestCase):
+    def test_versions_survive_file_backend(self):
+        product = Product.objects.create(name='Vase', description='glass vase', price='499.00', category='Home')
+        self.assertEqual(catalog_cache.product_detail(product.id)['product'], product)
+        product.name = 'Tall Vase'
+        product.save()
+        self.assertEqual(catalog_cache.product_detail(product.id)['product'].name, 'Tall Vase')
+
+
+class RelatedProductsTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        make = lambda name, category, description: Product.objects.create(
+            name=name, description=description, price='999.00', category=category,
+        )
+        self.oxford = make('Blue Oxford Shirt', 'Shirts', 'Cotton oxford shirt with button-down collar')
+        self.linen = make('White Linen Shirt', 'Shirts', 'Breathable linen shirt with button-down collar')
+        self.chino = make('Khaki Chino Trousers', 'Trousers', 'Slim cotton chinos')
+        self.denim = make('Dark Denim Jeans', 'Trousers', 'Slim fit denim jeans')
+
+    def test_rebuild_ranks_similar_products_first(self):
+        refreshed, seconds = related.rebuild(full=True, k=2)
+        self.assertEqual(refreshed, 4)
+        self.assertFalse(ProductVector.objects.filter(dirty=True).exists())
+        self.assertEqual(related.related_products(self.oxford, 1), [self.linen])
+        self.assertEqual(related.related_products(self.denim, 1), [self.chino])
+
+        with self.assertNumQueries(1):
+            related.related_products(self.oxford)
+
+    def test_incremental_refresh_picks_up_changes(self):
+        related.rebuild(full=True, k=2)
+        self.denim.name = 'Denim Button-Down Shirt'
+        self.denim.category = 'Shirts'
+        self.denim.description = 'Denim shirt with button-down collar'
+        self.denim.save()
+        self.assertEqual(list(ProductVector.objects.filter(dirty=True).values_list('product_id', flat=True)), [self.denim.pk])
+
+        refreshed, seconds = related.rebuild(k=2)
+        self.assertIn(self.denim, related.related_products(self.oxford, 2))
+        self.assertNotIn(self.chino, related.related_products(self.denim, 1))
+        self.assertFalse(ProductVector.objects.filter(dirty=True).exists())
+        self.assertEqual(related.rebuild(k=2)[0], 0)
+
+    def test_save_during_rebuild_stays_dirty(self):
+        related.rebuild(full=True, k=2)
+        self.denim.save()
+        load_matrix = related._load_matrix
+
+        def save_meanwhile():
+            # Saved again after its vector was read, before the rebuild finishes
+            self.denim.save()
+            return load_matrix()
+
+        with mock.patch.object(related, '_load_matrix', side_effect=save_meanwhile):
+            related.rebuild(k=2)
+        self.assertEqual(list(ProductVector.objects.filter(dirty=True).values_list('product_id', flat=True)), [self.denim.pk])
+
+    def test_detail_page_serves_precomputed_neighbours(self):
+        related.rebuild(full=True, k=2)
+        resp = self.client.get(f'/products/product/{self.oxford.id}/')
+        self.assertEqual(resp.context['related_products'][0], self.linen)
+
+        self.linen.delete()
+        self.assertFalse(RelatedProduct.objects.filter(related_id=self.linen.id).exists())
+        self.assertTrue(ProductVector.objects.get(pk=self.oxford.pk).dirty)
+        resp = self.client.get(f'/products/product/{self.oxford.id}/')
+        self.assertNotIn('White Linen Shirt', [p.name for p in resp.context['related_products']])
+
+
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, BACKGROUND_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # Noisy image so the original is realistically heavy
+        image = Image.effect_noise((1000, 750), 64).convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        self.original_size = buffer.tell()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                name='Printed Kurta', description='Cotton kurta', price='899.00', category='Ethnic',
+                image=SimpleUploadedFile('kurta.png', buffer.getvalue(), content_type='image/png'),
+            )
+        self.product.refresh_from_db()
+
+    def test_renditions_generated_on_upload(self):
+        manifest = self.product.image_renditions
+        self.assertTrue(renditions.is_current(self.product))
+        self.assertEqual([width for width, path in manifest['formats']['webp']], list(renditions.WIDTHS))
+        for entries in manifest['formats'].values():
+            for width, path in entries:
+                self.assertTrue(default_storage.exists(path))
+        card = manifest['formats']['webp'][1][1]
+        self.assertLess(default_storage.size(card) * 10, self.original_size)
+
+        # Content-addressed: regenerating the same bytes reuses the files
+        with self.product.image.open('rb') as source:
+            self.assertEqual(renditions.generate(source.read())['formats'], manifest['formats'])
+
+    def test_template_tag_and_api_emit_srcset(self):
+        html = Template('{% load product_images %}{% product_image product 300 class="card-img-top" %}').render(
+            Context({'product': self.product})
+        )
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn('class="card-img-top"', html)
+        self.assertIn('-960-v1.jpg" class=', html)
+        self.assertNotIn(self.product.image.url, html)
+
+        data = self.client.get(f'/api/products/products/{self.product.id}/').json()
+        self.assertIn(' 240w', data['image_srcset']['srcset']['webp'])
+        self.assertTrue(data['image_srcset']['src'].startswith('http://testserver/media/products/renditions/'))
+
+    def test_original_used_until_renditions_exist(self):
+        Product.objects.filter(pk=self.product.pk).update(image_renditions={})
+        self.product.refresh_from_db()
+        self.assertEqual(renditions.fallback_url(self.product, 300), self.product.image.url)
+        self.assertEqual(renditions.srcsets(self.product), {})
+
+
+class ImportCatalogTests(TestCase):
+    HEADER = 'sku,name,description,price,category,size,color,stock\n'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out = io.StringIO()
+        call_command('import_catalog', path, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_csv_upserts_products_and_variants(self):
+        path = self.write('catalog.csv', self.HEADER + (
+            'TS-1,Crew Tee,Cotton tee,499,Shirts,M,Black,10\n'
+            'TS-1,Crew Tee,Cotton tee,499,Shirts,L,Black,5\n'
+            'JN-1,Slim Jeans,Denim,1599,Jeans,32,Blue,7\n'
+            'BAD-1,Broken,,not-a-price,Shirts,M,Red,1\n'
+        ))
+        output = self.run_import(path, '--batch-size', '2')
+        self.assertIn('rows/s', output)
+        self.assertIn('1 invalid rows skipped', output)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(ProductVariant.objects.filter(product__sku='TS-1').count(), 2)
+
+        # Re-import updates in place instead of duplicating
+        path = self.write('update.jsonl', json.dumps({
+            'sku': 'TS-1', 'name': 'Crew Tee', 'description': 'Organic cotton tee', 'price': '549',
+            'category': 'Shirts', 'size': 'M', 'color': 'Black', 'stock': 3,
+        }) + '\n')
+        self.run_import(path)
+        tee = Product.objects.get(sku='TS-1')
+        self.assertEqual(str(tee.price), '549.00')
+        self.assertEqual(tee.variants.get(size='M').stock, 3)
+        self.assertEqual(tee.variants.count(), 2)
+        self.assertTrue(search.get_index().search('organic'))
+
+    def test_rejects_non_finite_and_negative_values(self):
+        path = self.write('catalog.csv', self.HEADER + (
+            'OK-1,Fine,,100,Misc,S,Red,1\n'
+            'NAN-1,No Price,,NaN,Misc,S,Red,1\n'
+            'INF-1,Endless,,Infinity,Misc,S,Red,1\n'
+            'NEG-1,Rebate,,-5,Misc,S,Red,1\n'
+            'NEG-2,Owed,,100,Misc,S,Red,-3\n'
+            f'LONG-1,{"x" * 256},,100,Misc,S,Red,1\n'
+            'LONG-2,Wide,,100,Misc,S,Ultramarine with a hint of teal,1\n'
+            'BIG-1,Dear,,123456789.00,Misc,S,Red,1\n'
+            'BIG-2,Plenty,,100,Misc,S,Red,9999999999\n'
+        ))
+        self.assertIn('8 invalid rows skipped', self.run_import(path))
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['OK-1'])
+
+    def test_malformed_json_lines_are_skipped(self):
+        good = json.dumps({
+            'sku': 'OK-1', 'name': 'Fine', 'price': '100', 'category': 'Misc', 'size': 'S', 'color': 'Red', 'stock': 1,
+        })
+        path = self.write('catalog.jsonl', f'{{"sku": "BROKEN-1", \n[]\n"just a string"\n{good}\n')
+        out = io.StringIO()
+        err = io.StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err)
+        self.assertIn('3 invalid rows skipped', out.getvalue())
+        self.assertIn('line 1: invalid JSON', err.getvalue())
+        self.assertIn('line 2: expected an object, got list', err.getvalue())
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['OK-1'])
+
+    def test_resume_skips_checkpointed_rows(self):
+        path = self.write('catalog.csv', self.HEADER + (
+            'A-1,First,,100,Misc,S,Red,1\n'
+            'B-1,Second,,100,Misc,S,Red,1\n'
+            'C-1,Third,,100,Misc,S,Red,1\n'
+        ))
+        with open(f'{path}.checkpoint', 'w') as handle:
+            json.dump({'source': os.path.abspath(path), 'rows': 2}, handle)
+        output = self.run_import(path, '--resume')
+        self.assertIn('Resuming after 2 rows', output)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['C-1'])
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+
+class ProductApiConditionalTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.product = Product.objects.create(name='Linen Shirt', description='Linen', price='1299.00', category='Shirts')
+        ProductVariant.objects.create(product=self.product, size='M', color='White', stock=4)
+
+    def test_list_and_detail_revalidate_without_serializing(self):
+        for url in ('/api/products/products/', f'/api/products/products/{self.product.id}/'):
+            first = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(first.status_code, 200)
+            self.assertIn('Last-Modified', first)
+
+            with self.assertNumQueries(0):
+                cached = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.content, b'')
+
+            # The browsable API is a different representation
+            html = self.client.get(url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(html.status_code, 200)
+
+    def test_catalog_change_invalidates_etag(self):
+        url = f'/api/products/products/{self.product.id}/'
+        first = self.client.get(url, HTTP_ACCEPT='application/json')
+        # Bulk writes skip the model signals and bump the cache themselves
+        self.product.variants.update(stock=0)
+        catalog_cache.bump_variants(self.product.variants.values_list('pk', flat=True))
+        bulk = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(bulk.status_code, 200)
+        self.assertEqual(bulk.json()['variants'][0]['stock'], 0)
+
+        variant = self.product.variants.get()
+        variant.stock = 9
+        variant.save()
+        changed = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=bulk['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotIn(changed['ETag'], (first['ETag'], bulk['ETag']))
+        self.assertEqual(changed.json()['variants'][0]['stock'], 9)
+
+
+@override_settings(SHARED_PAGE_CACHE=True)
+class SharedPageCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        catalog_cache.get_cache().clear()
+        self.product = Product.objects.create(name='Scarf', description='silk scarf', price='699.00', category='Clothing')
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='Red', stock=5)
+
+    def test_anonymous_pages_served_from_cache_with_etag(self):
+        url = f'/products/product/{self.product.id}/'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        self.assertIn('Cookie', first['Vary'])
+        self.assertNotIn(b'csrfmiddlewaretoken" value="', first.content.replace(b'value="" data-csrf-cookie', b''))
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        # A catalog change produces a new ETag and fresh content
+        self.product.price = '649.00'
+        self.product.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn(b'649.00', changed.content)
+
+    @override_settings(SHARED_PAGE_CACHE=None, DEBUG=False)
+    def test_off_by_default_on_a_process_local_cache(self):
+        # Another worker couldn't invalidate this worker's copy of the page
+        resp = self.client.get(f'/products/product/{self.product.id}/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('ETag', resp)
+
+    def test_authenticated_pages_are_not_shared(self):
+        User = get_user_model()
+        User.objects.create_user(username='shopper', password='pass12345')
+        self.client.login(username='shopper', password='pass12345')
+        resp = self.client.get('/')
+        self.assertNotIn('ETag', resp)
+        self.assertIn(b'shopper', resp.content.lower())
+
+    def test_cached_page_form_posts_with_cookie_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.get(f'/products/product/{self.product.id}/')
+        status = client.get('/cart/status/').json()
+        self.assertEqual(status, {'cart_count': 0, 'wishlist': []})
+
+        token = client.cookies['csrftoken'].value
+        resp = client.post('/cart/add/', {
+            'csrfmiddlewaretoken': token,
+            'product_id': self.product.id,
+            'variant_id': self.variant.id,
+            'quantity': 1,
+        })
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(client.get('/cart/status/').json()['cart_count'], 1)
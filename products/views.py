@@ -1,54 +1,67 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.db.models import Q
+from django.http import Http404
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from . import cache as catalog_cache
+from .facets import facet_counts, filter_products, selected_facets
+from .listing import product_cards
 from .models import Product, ProductVariant
-from cart.models import Cart, CartItem, Wishlist
-from cart.views import get_cart
+from .page_cache import shared_page
+from .pagination import InvalidCursor, cursor_url, paginate, resolve_ordering
+from .search import search_products
+from cart.wishlist import get_wishlist_ids
 
 
+def _catalog_scopes(request, *args, **kwargs):
+    return [catalog_cache.ALL_SCOPE]
+
+
+def _product_scopes(request, id):
+    scopes = [catalog_cache.product_scope(id)]
+    detail = catalog_cache.product_detail(id)
+    if detail is not None:
+        # Related products fall back to the same category before the first rebuild
+        scopes.append(catalog_cache.category_scope(detail['product'].category))
+    return scopes
+
+
+def _category_scopes(request, category):
+    return [catalog_cache.category_scope(category)]
+
+
+@shared_page(_catalog_scopes)
 def home(request):
     """Home page with product listing and search/filter"""
     # Get search query
     search_query = request.GET.get('search', '')
     category_filter = request.GET.get('category', '')
-    sort_by = request.GET.get('sort', '-created_at')
+    selected = selected_facets(request.GET)
+    # Search results default to relevance, plain listings to newest first
+    sort_by, ordering = resolve_ordering(request.GET.get('sort', ''), bool(search_query))
     
     # Base queryset
     products = Product.objects.all()
     
     # Apply search
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query) |
-            Q(category__icontains=search_query)
-        )
+        products = search_products(products, search_query)
     
-    # Apply category filter
-    if category_filter:
-        products = products.filter(category__iexact=category_filter)
+    # Facet counts for the current search, then narrow by the selected facets
+    facets = facet_counts(selected, products if search_query else None)
+    products = filter_products(products, selected)
     
-    # Apply sorting
-    if sort_by:
-        products = products.order_by(sort_by)
-    
-    # Get categories for filter dropdown
-    categories = Product.objects.values_list('category', flat=True).distinct()
-    
-    # Get cart count
-    try:
-        cart = get_cart(request)
-        cart_count = cart.get_item_count()
-    except:
-        cart_count = 0
+    # Sort and paginate (cached until any product changes)
+    listing = _listing_page(
+        request, product_cards(products), ordering,
+        [catalog_cache.ALL_SCOPE], (search_query, sorted(selected.items())),
+    )
     
     context = {
-        'products': products,
-        'categories': categories,
+        **listing,
+        'facets': _with_facet_urls(request, facets),
         'search_query': search_query,
         'category_filter': category_filter,
         'sort_by': sort_by,
-        'cart_count': cart_count,
     }
     return render(request, 'home.html', context)
 
@@ -58,47 +71,79 @@ def products(request):
     return home(request)
 
 
+@shared_page(_product_scopes)
 def product_detail(request, id):
     """Product detail page"""
-    product = get_object_or_404(Product, id=id)
-    variants = product.variants.all()
-    
-    # Get unique sizes and colors
-    sizes = variants.values_list('size', flat=True).distinct()
-    colors = variants.values_list('color', flat=True).distinct()
-    
-    # Get related products (same category)
-    related_products = Product.objects.filter(category=product.category).exclude(id=product.id)[:4]
-    
-    # Check if product is in wishlist
-    in_wishlist = False
-    if request.user.is_authenticated:
-        in_wishlist = Wishlist.objects.filter(user=request.user, product=product).exists()
+    detail = catalog_cache.product_detail(id)
+    if detail is None:
+        raise Http404("No Product matches the given query.")
+    product = detail['product']
     
-    # Get cart count
-    try:
-        cart = get_cart(request)
-        cart_count = cart.get_item_count()
-    except:
-        cart_count = 0
+    # Get related products (precomputed neighbours)
+    related_products = catalog_cache.related_products(product)
     
     context = {
-        'product': product,
-        'variants': variants,
-        'sizes': sizes,
-        'colors': colors,
+        **detail,
         'related_products': related_products,
-        'in_wishlist': in_wishlist,
-        'cart_count': cart_count,
+        # Check if product is in wishlist
+        'in_wishlist': product.id in get_wishlist_ids(request),
     }
     return render(request, 'product_detail.html', context)
 
 
+@shared_page(_category_scopes)
 def category_products(request, category):
     """Products by category"""
-    products = Product.objects.filter(category__iexact=category)
+    sort_by, ordering = resolve_ordering(request.GET.get('sort', ''))
+    products = product_cards(Product.objects.filter(category__iexact=category))
     context = {
-        'products': products,
+        **_listing_page(request, products, ordering, [catalog_cache.category_scope(category)], (category,)),
         'category': category,
+        'sort_by': sort_by,
     }
     return render(request, 'home.html', context)
+
+
+def _listing_page(request, products, ordering, cache_scopes, cache_parts):
+    """
+    Keyset page of the listing plus its navigation links.
+
+    ``cache_parts`` must identify the filters that produced ``products``;
+    the page is cached under them until one of ``cache_scopes`` changes.
+    """
+    cursor = request.GET.get('cursor')
+
+    def build():
+        try:
+            return paginate(products, ordering, cursor)
+        except InvalidCursor:
+            # A stale or tampered cursor restarts at the first page
+            return paginate(products, ordering)
+
+    page = catalog_cache.get_or_build('listing', cache_scopes, build, cache_parts, ordering, cursor)
+
+    # Product card fragments are cached per product version
+    versions = catalog_cache.get_versions([catalog_cache.product_scope(product.id) for product in page])
+    for product, version in zip(page, versions):
+        product.card_version = version
+
+    return {
+        'products': page.object_list,
+        'page': page,
+        'next_page_url': cursor_url(request, page.next_cursor) if page.has_next else None,
+        'previous_page_url': cursor_url(request, page.previous_cursor) if page.has_previous else None,
+    }
+
+
+def _with_facet_urls(request, facets):
+    """Add a toggle link to every facet option, keeping the other filters"""
+    base_url = remove_query_param(request.get_full_path(), 'cursor')
+    for facet, options in facets.items():
+        if facet == 'total':
+            continue
+        for option in options:
+            if option['selected']:
+                option['url'] = remove_query_param(base_url, facet)
+            else:
+                option['url'] = replace_query_param(base_url, facet, option['value'])
+    return facets
@@ -0,0 +1,108 @@
+"""
+Concurrent checkout stress test.
+
+Many buyers check out the same scarce variant at once, each from their own
+thread and database connection. Afterwards the script checks that no stock
+was oversold (stock never negative, orders account for exactly what was
+taken) and reports checkouts per second.
+
+    python scripts/checkout_stress.py --buyers 200 --threads 16 --stock 150
+
+Runs against the configured database (use Postgres to see real row
+locking); everything it creates is deleted again at the end.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import django
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Sum
+
+from cart.models import Cart, CartItem, recalculate_totals
+from orders.checkout import OutOfStock, place_order
+from orders.models import Order, OrderItem
+from products.models import Product, ProductVariant
+
+User = get_user_model()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--stock', type=int, default=150)
+    parser.add_argument('--quantity', type=int, default=1, help='Units each buyer wants')
+    args = parser.parse_args()
+
+    tag = uuid.uuid4().hex[:8]
+    product = Product.objects.create(name=f'Stress {tag}', description='checkout stress test', price='10.00', category='stress')
+    variant = ProductVariant.objects.create(product=product, size='M', color='Grey', stock=args.stock)
+    carts = []
+    for i in range(args.buyers):
+        user = User.objects.create_user(username=f'stress-{tag}-{i}', password=None)
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=product, variant=variant, quantity=args.quantity)
+        carts.append(cart)
+    recalculate_totals(Cart.objects.filter(pk__in=[cart.pk for cart in carts]))
+
+    placed, short, failed = [], [], []
+    lock = threading.Lock()
+
+    def checkout(cart):
+        try:
+            place_order(cart.user, cart, 'Stress Street', '0000000000')
+            outcome = placed
+        except OutOfStock:
+            outcome = short
+        except Exception as exc:
+            outcome = failed
+            print(f'  {cart.user.username}: {exc!r}', file=sys.stderr)
+        finally:
+            connection.close()
+        with lock:
+            outcome.append(cart.pk)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(checkout, carts))
+    elapsed = time.perf_counter() - started
+
+    try:
+        variant.refresh_from_db()
+        sold = OrderItem.objects.filter(variant=variant).aggregate(total=Sum('quantity'))['total'] or 0
+        expected_orders = min(args.buyers, args.stock // args.quantity)
+        print(f'{len(placed)} orders placed, {len(short)} out of stock, {len(failed)} errors '
+              f'in {elapsed:.2f}s ({len(placed) / elapsed:.1f} checkouts/s, {args.threads} threads)')
+        print(f'Stock left {variant.stock}, sold {sold} of {args.stock}')
+
+        ok = variant.stock >= 0 and variant.stock + sold == args.stock and sold == len(placed) * args.quantity
+        if not ok:
+            print('FAIL: stock and orders disagree (oversell or lost update)')
+        elif not failed and len(placed) != expected_orders:
+            print(f'FAIL: expected {expected_orders} orders')
+            ok = False
+        else:
+            print('OK: no oversell')
+    finally:
+        Order.objects.filter(user__username__startswith=f'stress-{tag}-').delete()
+        User.objects.filter(username__startswith=f'stress-{tag}-').delete()
+        product.delete()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Order ID insert benchmark.
+
+Inserts rows into a scratch table with a unique ``order_id`` column, once
+with the old random ``ORD-XXXXXXXX`` IDs and once with the time-ordered
+ones from ``orders.ids``, and reports rows per second for each (and the
+size of the unique index, on Postgres).
+
+    python scripts/order_id_bench.py --rows 200000 --batch 1000
+
+Runs against the configured database; the scratch table is dropped again at
+the end. The gap only shows once the index outgrows memory, so use Postgres
+and plenty of rows.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+import django
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
+django.setup()
+
+from django.db import connection, transaction
+
+from orders import ids
+
+TABLE = 'order_id_bench'
+
+
+def random_order_id():
+    # The scheme this replaced
+    return 'ORD-' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+
+
+def run(label, make_id, rows, batch):
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {qn(TABLE)}')
+        cursor.execute(f'CREATE TABLE {qn(TABLE)} (id integer PRIMARY KEY, order_id varchar(50) NOT NULL UNIQUE)')
+    sql = f'INSERT INTO {qn(TABLE)} (id, order_id) VALUES (%s, %s)'
+
+    collisions = 0
+    started = time.perf_counter()
+    for start in range(0, rows, batch):
+        values = [(pk, make_id()) for pk in range(start, min(start + batch, rows))]
+        # Random IDs can repeat within a batch, not just against the table
+        collisions += len(values) - len({order_id for _, order_id in values})
+        values = list({order_id: pk for pk, order_id in values}.items())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, [(pk, order_id) for order_id, pk in values])
+    elapsed = time.perf_counter() - started
+
+    size = ''
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_size_pretty(pg_relation_size(indexrelid)) FROM pg_index "
+                "WHERE indrelid = %s::regclass AND NOT indisprimary", [TABLE],
+            )
+            size = f', index {cursor.fetchone()[0]}'
+    print(f'{label:>12}: {rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s{size}), '
+          f'{collisions} collisions')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=1000, help='Rows per transaction')
+    args = parser.parse_args()
+
+    try:
+        run('random', random_order_id, args.rows, args.batch)
+        run('time-ordered', ids.new_order_id, args.rows, args.batch)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(TABLE)}')
+
+
+if __name__ == '__main__':
+    main()